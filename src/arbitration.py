@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Arbitration of the demonstrators hardware between concurrent clients.
+
+A client obtains a lease on a demonstrator by using it. As long as the lease is renewed
+(i.e. the client keeps on using the demonstrator), other clients are queued in FIFO order
+and act as viewers : they cannot drive the hardware, but are given the results produced
+for the lease holder instead.
+
+The hardware sequences themselves are serialized by the device hardware worker (see
+worker.HardwareWorker), which executes them one at a time in their submission order.
+"""
+
+__author__ = 'Eric Pascual'
+
+import threading
+import time
+import logging
+
+
+class DemonstratorArbiter(object):
+    """ Lease manager of a single demonstrator.
+    """
+    def __init__(self, name, lease_ttl=10, queue_ttl=3):
+        """
+        :param str name: the demonstrator name
+        :param float lease_ttl: the delay (in seconds) after which an unused lease expires
+        :param float queue_ttl: the delay (in seconds) after which a waiting client which has
+            not claimed the lease again is removed from the queue
+        """
+        self._log = logging.getLogger('%s(%s)' % (self.__class__.__name__, name))
+        self.name = name
+        self.lease_ttl = lease_ttl
+        self.queue_ttl = queue_ttl
+
+        self._lock = threading.Lock()
+        self._holder = None
+        self._expires = 0
+        self._waiting = []
+        self._last_seen = {}
+        self._results = {}
+        self._viewer_states = {}
+
+    def _expire(self, now):
+        if self._holder and now > self._expires:
+            self._log.info('lease of %s expired', self._holder)
+            self._holder = None
+            self._results.clear()
+
+        # forget waiting clients which are gone (closed page,...), since the lease could not
+        # be granted to anybody else while they are at the head of the queue
+        limit = now - self.queue_ttl
+        self._waiting = [c for c in self._waiting if self._last_seen[c] >= limit]
+        for client_id in self._last_seen.keys():
+            if client_id not in self._waiting:
+                del self._last_seen[client_id]
+                self._viewer_states.pop(client_id, None)
+
+    def claim(self, client_id):
+        """ Claims (or renews) the lease on behalf of a client.
+
+        If the demonstrator is leased by another client, the requester is queued and will be
+        granted the lease in its turn.
+
+        :param str client_id: the requesting client
+        :return: True if the client holds the lease
+        :rtype: bool
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+
+            if self._holder is None and (not self._waiting or self._waiting[0] == client_id):
+                if self._waiting:
+                    self._waiting.pop(0)
+                    del self._last_seen[client_id]
+                    self._viewer_states.pop(client_id, None)
+                self._holder = client_id
+                self._log.info('lease granted to %s', client_id)
+
+            if self._holder == client_id:
+                self._expires = now + self.lease_ttl
+                return True
+
+            if client_id not in self._waiting:
+                self._waiting.append(client_id)
+            self._last_seen[client_id] = now
+            return False
+
+    def release(self, client_id):
+        """ Releases the lease if held by the given client, or removes it from the queue.
+        """
+        with self._lock:
+            if self._holder == client_id:
+                self._log.info('lease released by %s', client_id)
+                self._holder = None
+                self._results.clear()
+            elif client_id in self._waiting:
+                self._waiting.remove(client_id)
+                del self._last_seen[client_id]
+                self._viewer_states.pop(client_id, None)
+
+    def status(self, client_id):
+        """ Returns the lease status of a client as a dictionary.
+
+        :rtype: dict
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            return {
+                "holder": 1 if self._holder == client_id else 0,
+                "leased": 1 if self._holder else 0,
+                "position": self._waiting.index(client_id) + 1 if client_id in self._waiting else 0,
+                "expires_in": max(self._expires - now, 0) if self._holder else 0
+            }
+
+    def publish(self, key, result):
+        """ Publishes a result obtained for the lease holder, for the viewers use.
+        """
+        with self._lock:
+            self._results[key] = result
+
+    def last_result(self, key):
+        """ Returns the last result published under a given key, or None if none yet.
+        """
+        with self._lock:
+            return self._results.get(key)
+
+    def set_viewer_state(self, client_id, state):
+        """ Records the hardware state (e.g. the light source setting) a viewer asked for,
+        since it is not applied to the hardware.
+        """
+        with self._lock:
+            self._viewer_states[client_id] = state
+
+    def viewer_state(self, client_id, default=None):
+        with self._lock:
+            return self._viewer_states.get(client_id, default)
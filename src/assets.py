@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Static assets bundler.
+
+Concatenates and minifies the JS and CSS files used by the pages into bundles, names them
+after their content hash and stores a gzip'ed version along each of them, so that they can be
+served with far-future caching headers.
+
+The produced files are stored in the "assets" directory of the static resources, together
+with a manifest mapping the bundles name to their fingerprinted file name.
+
+The bundler only uses the standard library, so that the bundles can be built on the packaging
+host without the application dependencies. The bundles are served by webapp.AssetFileHandler.
+"""
+
+__author__ = 'Eric Pascual'
+
+import os
+import re
+import json
+import gzip
+import hashlib
+import logging
+
+_here = os.path.dirname(__file__)
+
+STATIC_HOME = os.path.join(_here, "static")
+ASSETS_DIR = "assets"
+ASSETS_URL = "/" + ASSETS_DIR + "/"
+MANIFEST_NAME = "manifest.json"
+
+# Bundles definitions, as the list of their source files, in concatenation order
+# and relative to the static resources home.
+BUNDLES = {
+    'common.css': [
+        'css/bootstrap.min.css',
+        'css/jNotify.jquery.css',
+        'css/demo-color.css',
+    ],
+    'common.js': [
+        'js/jquery.min.js',
+        'js/bootstrap.min.js',
+        'js/jquery.validate.min.js',
+        'js/moment.min.js',
+        'js/jNotify.jquery.min.js',
+        'js/demo-color.js',
+    ],
+    'barrier.js': ['js/barrier.js'],
+    'bwdetector.js': ['js/bwdetector.js'],
+    'colordetector.js': ['js/colordetector.js'],
+    'calibration.css': ['css/calibration.css'],
+    'calibration.js': ['js/calibration.js'],
+}
+
+# the files are already minified
+_MINIFIED_SUFFIX = '.min'
+
+
+def _minify_css_fallback(text):
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.DOTALL)
+    text = re.sub(r'\s+', ' ', text)
+    # the spaces around colons are kept, since they are significant in selectors (e.g. "a :hover")
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    return text.replace(';}', '}').strip()
+
+
+def _minify_js_fallback(text):
+    # a real JS minification would require a parser : only trim the lines
+    return '\n'.join(line.strip() for line in text.splitlines() if line.strip())
+
+
+# use the rjsmin and rcssmin minifiers if available
+try:
+    from rjsmin import jsmin as minify_js
+except ImportError:
+    minify_js = _minify_js_fallback
+
+try:
+    from rcssmin import cssmin as minify_css
+except ImportError:
+    minify_css = _minify_css_fallback
+
+
+def _minify(path, text):
+    if os.path.splitext(os.path.splitext(path)[0])[1] == _MINIFIED_SUFFIX:
+        return text
+    if path.endswith('.css'):
+        return minify_css(text)
+    else:
+        return minify_js(text)
+
+
+def build(static_home=STATIC_HOME, bundles=BUNDLES):
+    """ Builds the bundles and their manifest.
+
+    Previously built files are removed.
+
+    :param str static_home: the path of the static resources home directory
+    :param dict bundles: the bundles definition
+    :return: the manifest, as a dictionary
+    :rtype: dict
+    """
+    log = logging.getLogger('assets')
+
+    out_dir = os.path.join(static_home, ASSETS_DIR)
+    if os.path.isdir(out_dir):
+        for name in os.listdir(out_dir):
+            os.remove(os.path.join(out_dir, name))
+    else:
+        os.makedirs(out_dir)
+
+    manifest = {}
+    for bundle, sources in sorted(bundles.items()):
+        parts = []
+        for src in sources:
+            with open(os.path.join(static_home, src), 'rb') as fp:
+                parts.append(_minify(src, fp.read().decode('utf-8')))
+
+        # the ";" protects JS files not terminated by one from being merged with the next one
+        separator = '\n' if bundle.endswith('.css') else ';\n'
+        content = separator.join(parts).encode('utf-8')
+
+        base, ext = os.path.splitext(bundle)
+        file_name = '%s-%s%s' % (base, hashlib.md5(content).hexdigest()[:12], ext)
+        path = os.path.join(out_dir, file_name)
+
+        with open(path, 'wb') as fp:
+            fp.write(content)
+        gz = gzip.GzipFile(path + '.gz', 'wb', 9)
+        try:
+            gz.write(content)
+        finally:
+            gz.close()
+
+        log.info('%s -> %s (%d bytes)', bundle, file_name, len(content))
+        manifest[bundle] = file_name
+
+    with open(os.path.join(out_dir, MANIFEST_NAME), 'wt') as fp:
+        json.dump(manifest, fp, indent=4, sort_keys=True)
+
+    return manifest
+
+
+class AssetResolver(object):
+    """ Gives the URLs to be used by the templates to reference a bundle.
+
+    If the bundles have been built, the URL of the fingerprinted file is returned. Otherwise
+    (or in debug mode) the URLs of the bundle source files are returned, so that the
+    application can be used straight from the source tree.
+    """
+    def __init__(self, static_home=STATIC_HOME, bundles=BUNDLES, use_sources=False):
+        self._bundles = bundles
+        self._manifest = {}
+
+        if not use_sources:
+            try:
+                with open(os.path.join(static_home, ASSETS_DIR, MANIFEST_NAME), 'rt') as fp:
+                    self._manifest = json.load(fp)
+            except IOError:
+                logging.getLogger('assets').warn('no bundles manifest found : using sources')
+
+    def urls(self, bundle):
+        """ Returns the list of URLs of the files implementing a bundle.
+
+        :param str bundle: the bundle name
+        :rtype: list
+        """
+        try:
+            return [ASSETS_URL + self._manifest[bundle]]
+        except KeyError:
+            return ['/' + src for src in self._bundles[bundle]]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    logging.basicConfig(
+        format="[%(levelname).1s] %(name)s > %(message)s",
+        level=logging.INFO
+    )
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        '-s', '--static',
+        help='static resources home directory',
+        dest='static_home',
+        default=STATIC_HOME)
+
+    cli_args = parser.parse_args()
+    build(cli_args.static_home)
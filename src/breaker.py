@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Containment of the hardware failures.
+
+Hardware reads are retried a bounded number of times, and a circuit breaker stops using the
+hardware of a device after repeated failures, so that requests fail fast instead of piling up
+behind a faulty device. The last good readings are kept, for being served as stale values
+while the hardware is not available.
+"""
+
+__author__ = 'Eric Pascual'
+
+import threading
+import time
+import logging
+import errno
+
+import sampling
+
+
+class CircuitOpen(IOError):
+    """ Raised instead of using the hardware while the circuit breaker is open.
+    """
+    def __init__(self, retry_after):
+        super(CircuitOpen, self).__init__(errno.EAGAIN, 'hardware disabled after repeated failures')
+        self.retry_after = retry_after
+
+
+class CircuitBreaker(object):
+    """ Circuit breaker for the hardware of a device.
+
+    The circuit opens when a given number of consecutive operations failed, and calls are
+    then rejected without being attempted. Once the reset delay has elapsed, a single trial
+    call is let through (half-open state) : the circuit is closed again if it succeeds, and
+    opened for another delay otherwise.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, threshold=3, reset_delay=10):
+        """
+        :param str name: the name of the guarded hardware, for the log
+        :param int threshold: the number of consecutive failures opening the circuit
+        :param float reset_delay: the delay (in seconds) before a trial call is let through
+        """
+        self._log = logging.getLogger('%s(%s)' % (self.__class__.__name__, name))
+        self.threshold = threshold
+        self.reset_delay = reset_delay
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_pending = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return self.CLOSED
+            if self._trial_pending or time.time() - self._opened_at >= self.reset_delay:
+                return self.HALF_OPEN
+            return self.OPEN
+
+    def retry_after(self):
+        """ Returns the delay (in seconds) before the hardware is tried again, 0 if the circuit
+        is closed.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return 0
+            return max(self._opened_at + self.reset_delay - time.time(), 0)
+
+    def check(self):
+        """ Checks that the hardware can be used.
+
+        :raise CircuitOpen: if the circuit is open
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self._opened_at + self.reset_delay - time.time()
+            if remaining > 0 or self._trial_pending:
+                raise CircuitOpen(max(remaining, 0))
+            self._trial_pending = True
+
+    def success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                self._log.info('hardware available again')
+            self._failures = 0
+            self._opened_at = None
+            self._trial_pending = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_pending or self._failures >= self.threshold:
+                if self._opened_at is None or self._trial_pending:
+                    self._log.error(
+                        'hardware disabled for %.1fs after %d failures', self.reset_delay, self._failures
+                    )
+                self._opened_at = time.time()
+                self._trial_pending = False
+
+    def status(self):
+        return {
+            'state': self.state,
+            'failures': self._failures,
+            'retry_after': self.retry_after()
+        }
+
+
+class GuardedADC(object):
+    """ ADC driver wrapper, retrying the failed reads and tripping a circuit breaker when
+    they keep failing.
+
+    The last good reading of each channel is kept with its time, given by sampling.clock.
+    """
+    def __init__(self, adc, breaker, retries=2, backoff=0.05):
+        """
+        :param adc: the ADC driver
+        :param CircuitBreaker breaker: the circuit breaker of the device
+        :param int retries: the number of retries of a failed read
+        :param float backoff: the delay (in seconds) before the first retry, doubled for each
+            subsequent one
+        """
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._adc = adc
+        self.breaker = breaker
+        self.retries = retries
+        self.backoff = backoff
+        self._last_good = {}
+
+    def readVoltages(self, channels):
+        self.breaker.check()
+        attempt = 0
+        while True:
+            try:
+                voltages = self._adc.readVoltages(channels)
+            except IOError as e:
+                if attempt == self.retries:
+                    self.breaker.failure()
+                    raise
+                self._log.warn('read error on channels %s (%s) - retrying', channels, e)
+                sampling.clock.sleep(self.backoff * 2 ** attempt)
+                attempt += 1
+            except Exception:
+                # not retried, but must conclude a half-open trial anyway
+                self.breaker.failure()
+                raise
+            else:
+                self.breaker.success()
+                now = sampling.clock.time()
+                for channel, voltage in zip(channels, voltages):
+                    self._last_good[channel] = (now, voltage)
+                return voltages
+
+    def readVoltage(self, channel):
+        return self.readVoltages([channel])[0]
+
+    def last_good(self, channel):
+        """ Returns the last good reading of a channel, as a (time, voltage) tuple, or None
+        if the channel has never been read successfully.
+        """
+        return self._last_good.get(channel)
+
+    def __getattr__(self, name):
+        return getattr(self._adc, name)
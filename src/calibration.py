@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Calibration jobs run by the server.
+
+A job samples a calibration reference of a sensor (e.g. the barrier free level, or the color
+detector white balance) with a whole sequence of hardware operations, executed as a single
+operation of the device hardware worker. It thus completes, and leaves the lights off, even
+if the client which started it goes away meanwhile. Clients follow its progress by polling
+its state, which lists the steps of the sequence with their results as they are obtained.
+
+The references are committed to the calibration data only once all the steps are done, and
+saved at once. The references of the two levels sensors are committed when both levels are
+known, the other one being the last sampled or the stored one. Optional steps (the LDR response
+measure of the color detector white balance) do not fail the job : their failure is reported
+in their state, and their result is not committed.
+"""
+
+__author__ = 'Eric Pascual'
+
+import time
+import uuid
+import logging
+import datetime
+from collections import OrderedDict
+
+from tornado.ioloop import IOLoop
+from tornado.locks import Condition
+from tornado import gen
+
+import sensors
+from controller import ControllerException
+
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+STEP_PENDING = 'pending'
+STEP_RUNNING = 'running'
+STEP_DONE = 'done'
+STEP_FAILED = 'failed'
+
+# the color detector references, and the light colors of their steps
+COLOR_REFERENCES = ('w', 'b')
+COLOR_STEPS = (('r', 1), ('g', 2), ('b', 3))
+# the steps which do not fail the job
+OPTIONAL_STEPS = ('response',)
+
+
+class JobConflict(Exception):
+    """ Raised when a job is started while another one is running on the device.
+    """
+
+
+class CalibrationJob(object):
+    """ The state of a calibration job.
+
+    It is updated and consulted in the IOLoop thread.
+    """
+    def __init__(self, sensor_id, reference, step_names):
+        """
+        :param str sensor_id: the calibrated sensor
+        :param str reference: the sampled reference (see sensors.REFERENCE_NAMES and COLOR_REFERENCES)
+        :param list step_names: the names of the job steps
+        """
+        self.id = uuid.uuid4().hex
+        self.sensor_id = sensor_id
+        self.reference = reference
+        self.state = RUNNING
+        self.steps = [
+            {"name": name, "state": STEP_PENDING, "value": None, "error": None} for name in step_names
+        ]
+        self.references = None
+        self.error = None
+        self.started = time.time()
+        self.ended = None
+        self.version = 0
+        self._changed = Condition()
+
+    @property
+    def running(self):
+        return self.state == RUNNING
+
+    def _update(self):
+        self.version += 1
+        self._changed.notify_all()
+
+    def step_started(self, index):
+        self.steps[index]['state'] = STEP_RUNNING
+        self._update()
+
+    def step_done(self, index, value):
+        self.steps[index].update(state=STEP_DONE, value=value)
+        self._update()
+
+    def step_failed(self, index, error):
+        self.steps[index].update(state=STEP_FAILED, error=error)
+        self._update()
+
+    def finished(self, references=None, error=None):
+        """
+        :param dict references: the committed references, by name
+        :param str error: the failure cause, if the job failed
+        """
+        self.state = FAILED if error else DONE
+        self.references = references
+        self.error = error
+        self.ended = time.time()
+        self._update()
+
+    @gen.coroutine
+    def wait_change(self, version, timeout):
+        """ Waits until the job state has changed since a given version, or is over.
+
+        :param int version: the last version known by the caller
+        :param float timeout: the maximum wait (in seconds)
+        """
+        deadline = datetime.timedelta(seconds=timeout)
+        while self.running and self.version <= version:
+            if not (yield self._changed.wait(timeout=deadline)):
+                break
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "sensor": self.sensor_id,
+            "reference": self.reference,
+            "state": self.state,
+            "steps": self.steps,
+            "references": self.references,
+            "error": self.error,
+            "started": self.started,
+            "ended": self.ended,
+            "version": self.version
+        }
+
+
+class CalibrationJobs(object):
+    """ The calibration jobs of a device.
+
+    Jobs run one at a time. The last ones are kept for the clients to get their outcome.
+    Its methods must be called from the IOLoop thread.
+    """
+    KEPT_JOBS = 10
+
+    def __init__(self, device):
+        """
+        :param devices.Device device: the calibrated device
+        """
+        self._log = logging.getLogger('%s(%s)' % (self.__class__.__name__, device.id))
+        self._device = device
+        self._jobs = OrderedDict()
+        # sensor id -> {reference name: level} for the two levels sensors references
+        # sampled but not committed yet
+        self._pending = {}
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def list(self):
+        return self._jobs.values()
+
+    def _plan(self, sensor_id, reference):
+        """ Returns the steps sampling a reference of a sensor, as (name, operation) tuples.
+
+        The operations of the steps only sample : their results are committed by :py:meth:`_execute`.
+
+        :raise ValueError: if the reference is not one of the sensor
+        """
+        controller = self._device.controller
+        sensor = controller.sensor(sensor_id)
+
+        if sensor.analyzer == sensors.ANALYZER_COLOR:
+            if reference not in COLOR_REFERENCES:
+                raise ValueError('invalid color detector reference (%s)' % reference)
+            steps = [
+                (name, lambda color=color: controller.sample_color_detector_reference(color))
+                for name, color in COLOR_STEPS
+            ]
+            if reference == 'w':
+                # characterize the LDR response while facing the white reference, for the
+                # fast color analysis
+                steps.append(('response', lambda: controller.measure_response(sensor_id, store=False)))
+            return steps
+
+        if reference not in (sensor.reference_names or ()):
+            raise ValueError('invalid %s reference (%s)' % (sensor_id, reference))
+        return [('sample', lambda: controller.sample_reference(sensor_id))]
+
+    def start(self, sensor_id, reference):
+        """ Starts a job sampling a reference of a sensor.
+
+        :rtype: CalibrationJob
+        :raise ValueError: if the reference is not one of the sensor
+        :raise JobConflict: if a job is already running on the device
+        """
+        running = [job for job in self._jobs.itervalues() if job.running]
+        if running:
+            raise JobConflict('calibration job %s is running' % running[0].id)
+
+        steps = self._plan(sensor_id, reference)
+        job = CalibrationJob(sensor_id, reference, [name for name, _ in steps])
+        self._jobs[job.id] = job
+        while len(self._jobs) > self.KEPT_JOBS:
+            self._jobs.popitem(last=False)
+
+        self._log.info('starting job %s (%s %s)', job.id, sensor_id, reference)
+        self._run(job, steps)
+        return job
+
+    @gen.coroutine
+    def _run(self, job, steps):
+        demand = self._device.demand
+        demand.hold(job.id)
+        try:
+            references = yield self._device.run(self._execute, job, steps, IOLoop.current())
+        except Exception as e:
+            self._log.error('job %s failed : %s', job.id, e)
+            job.finished(error=str(e) or e.__class__.__name__)
+        else:
+            self._log.info('job %s done', job.id)
+            job.finished(references=references)
+        finally:
+            demand.release(job.id)
+
+    def _execute(self, job, steps, io_loop):
+        """ Runs the job steps and commits the references, in the hardware worker.
+
+        :return: the committed references, by name
+        """
+        values = {}
+        for index, (name, operation) in enumerate(steps):
+            io_loop.add_callback(job.step_started, index)
+            try:
+                values[name] = operation()
+            except ControllerException as e:
+                if name not in OPTIONAL_STEPS:
+                    raise
+                self._log.warning('job %s : %s step failed (%s)', job.id, name, e)
+                io_loop.add_callback(job.step_failed, index, str(e))
+            else:
+                io_loop.add_callback(job.step_done, index, values[name])
+
+        controller = self._device.controller
+        if controller.sensor(job.sensor_id).analyzer == sensors.ANALYZER_COLOR:
+            levels = [values[name]['current'] for name, _ in COLOR_STEPS]
+            controller.set_color_detector_reference_levels(job.reference, levels)
+            references = {job.reference: levels}
+            if 'response' in values:
+                controller.set_response(job.sensor_id, values['response'])
+        else:
+            references = self._commit_level(job.sensor_id, job.reference, values['sample']['current'])
+
+        if references:
+            controller.save_calibration()
+        return references
+
+    def _commit_level(self, sensor_id, reference, level):
+        """ Commits a level of a two levels sensor if the other one is known.
+
+        :return: the committed references, or None if the other level is still unknown
+        """
+        controller = self._device.controller
+        names = controller.sensor(sensor_id).reference_names
+        pending = self._pending.setdefault(sensor_id, {})
+        pending[reference] = level
+
+        stored = controller.get_reference_levels(sensor_id)
+        known = dict(zip(names, stored)) if stored else {}
+        known.update(pending)
+        if len(known) < len(names):
+            return None
+
+        levels = [known[name] for name in names]
+        controller.set_reference_levels(sensor_id, levels)
+        del self._pending[sensor_id]
+        return dict(zip(names, levels))
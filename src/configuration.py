@@ -5,14 +5,20 @@ __author__ = 'Eric Pascual'
 
 import os
 import json
+from collections import OrderedDict
+
+from sensors import ANALYZER_THRESHOLD, ANALYZER_BW, ANALYZER_COLOR
 
 APP_NAME = 'pobot-demo-color'
 
+DEFAULT_DEVICE_ID = 'default'
+
 
 class Configuration(object):
     CONFIG_FILE_NAME = None
     _data = None
     _path = None
+    _version = 0
 
     def __init__(self, autoload=False, cfg_dir=None):
         self._cfg_dir = cfg_dir
@@ -33,11 +39,33 @@ class Configuration(object):
         if not path:
             path = self._path
         self._data.update(json.load(file(path, 'rt')))
+        self._changed()
 
     def save(self, path=None):
+        """ Saves the configuration.
+
+        The content is written to a temporary file which then replaces the configuration file,
+        so that it is never left partly written.
+        """
         if not path:
             path = self._path
-        json.dump(self._data, file(path, 'wt'), indent=4)
+        tmp_path = path + '.tmp'
+        with file(tmp_path, 'wt') as fp:
+            json.dump(self._data, fp, indent=4)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.rename(tmp_path, path)
+
+    def _changed(self):
+        self._version += 1
+
+    @property
+    def version(self):
+        """ A counter incremented each time the configuration content changes.
+
+        It can be used to detect that something derived from the configuration is outdated.
+        """
+        return self._version
 
 
 class SystemConfiguration(Configuration):
@@ -56,9 +84,63 @@ class SystemConfiguration(Configuration):
             'color_detector_adc': 3,
             'barrier_led_gpio': 12,
             'bw_detector_led_gpio': 13,
+            'sample_freshness': 0.2,
+            'lease_ttl': 10,
+            'queue_ttl': 3,
+            'settle_tolerance': 0.02,
+            'settle_abs_tolerance': 0.001,
+            'settle_window': 8,
+            'settle_interval': 0.05,
+            'settle_timeout': 5,
+            'prediction_samples': 4,
+            'detection_mode': 'absolute',
+            'sync_periods': 4,
+            'sync_half_period': 0.1,
+            'sync_adc_bits': None,
+            'adc_timeout': 1.0,
+            'adc_retries': 2,
+            'adc_retry_backoff': 0.05,
+            'breaker_threshold': 3,
+            'breaker_reset_delay': 10,
+            'stale_max_age': 60,
+            'history_size': 2000,
+            'samples_dir': None,
+            'samples_log_size': 16 * 1024 * 1024,
+            'color_cycle_step': 1.0,
+            'acquisition_period': 1.0,
+            'idle_timeout': 300,
+            'client_ttl': 30,
+            'flicker_filter': False,
+            'mains_frequency': 50,
+            'flicker_taps': 4,
         }
         super(SystemConfiguration, self).__init__(*args, **kwargs)
 
+    def devices(self):
+        """ Returns the configurations of the demonstrator devices.
+
+        Devices are defined by the optional "devices" list, each entry of which gives the
+        device id and the settings overriding the global ones (I2C addresses, ADC channels,
+        GPIOs,...). If no device is defined, a single one is returned, with the global
+        settings and the default id.
+
+        :return: the devices configurations, the first one being the default device
+        :rtype: list of SystemConfiguration
+        """
+        definitions = self._data.get('devices') or [{'id': DEFAULT_DEVICE_ID}]
+        result = []
+        for definition in definitions:
+            device_cfg = SystemConfiguration(cfg_dir=self._cfg_dir)
+            device_cfg._data.update(self._data)
+            device_cfg._data.pop('devices', None)
+            device_cfg._data.update(definition)
+            result.append(device_cfg)
+        return result
+
+    @property
+    def device_id(self):
+        return self._data.get('id', DEFAULT_DEVICE_ID)
+
     @property
     def listen_port(self):
         return self._data['listen_port']
@@ -147,6 +229,290 @@ class SystemConfiguration(Configuration):
     def bw_detector_led_gpio(self, value):
         self._data['bw_detector_led_gpio'] = value
 
+    @property
+    def sensors(self):
+        """ The definitions of the light sensors of the device.
+
+        The sensors of the demonstrators are defined by the dedicated settings (ADC channels,
+        shunts and LED GPIOs). The optional "sensors" list can override their definition and
+        declare additional sensors, its entries having the same form as the returned ones.
+
+        :return: the sensors definitions, as dictionaries (see sensors.Sensor.from_dict)
+        :rtype: list of dict
+        """
+        shunts = self.shunts
+        definitions = OrderedDict((d['id'], d) for d in (
+            {
+                'id': 'barrier',
+                'channel': self.barrier_adc,
+                'shunt': shunts[0],
+                'led_gpio': self.barrier_led_gpio,
+                'analyzer': ANALYZER_THRESHOLD
+            },
+            {
+                'id': 'bw_detector',
+                'channel': self.bw_detector_adc,
+                'shunt': shunts[1],
+                'led_gpio': self.bw_detector_led_gpio,
+                'analyzer': ANALYZER_BW
+            },
+            {
+                'id': 'color_detector',
+                'channel': self.color_detector_adc,
+                'shunt': shunts[2],
+                'led_gpio': None,
+                'analyzer': ANALYZER_COLOR
+            },
+        ))
+        for definition in self._data.get('sensors', []):
+            definitions.setdefault(definition['id'], {}).update(definition)
+        return definitions.values()
+
+    @sensors.setter
+    def sensors(self, value):
+        self._data['sensors'] = value[:]
+
+    @property
+    def sample_freshness(self):
+        return self._data['sample_freshness']
+
+    @sample_freshness.setter
+    def sample_freshness(self, value):
+        self._data['sample_freshness'] = value
+
+    @property
+    def lease_ttl(self):
+        return self._data['lease_ttl']
+
+    @lease_ttl.setter
+    def lease_ttl(self, value):
+        self._data['lease_ttl'] = value
+
+    @property
+    def queue_ttl(self):
+        return self._data['queue_ttl']
+
+    @queue_ttl.setter
+    def queue_ttl(self, value):
+        self._data['queue_ttl'] = value
+
+    @property
+    def settle_tolerance(self):
+        return self._data['settle_tolerance']
+
+    @settle_tolerance.setter
+    def settle_tolerance(self, value):
+        self._data['settle_tolerance'] = value
+
+    @property
+    def settle_abs_tolerance(self):
+        return self._data['settle_abs_tolerance']
+
+    @settle_abs_tolerance.setter
+    def settle_abs_tolerance(self, value):
+        self._data['settle_abs_tolerance'] = value
+
+    @property
+    def settle_window(self):
+        return self._data['settle_window']
+
+    @settle_window.setter
+    def settle_window(self, value):
+        self._data['settle_window'] = value
+
+    @property
+    def settle_interval(self):
+        return self._data['settle_interval']
+
+    @settle_interval.setter
+    def settle_interval(self, value):
+        self._data['settle_interval'] = value
+
+    @property
+    def settle_timeout(self):
+        return self._data['settle_timeout']
+
+    @settle_timeout.setter
+    def settle_timeout(self, value):
+        self._data['settle_timeout'] = value
+
+    @property
+    def prediction_samples(self):
+        return self._data['prediction_samples']
+
+    @prediction_samples.setter
+    def prediction_samples(self, value):
+        self._data['prediction_samples'] = value
+
+    @property
+    def detection_mode(self):
+        return self._data['detection_mode']
+
+    @detection_mode.setter
+    def detection_mode(self, value):
+        self._data['detection_mode'] = value
+
+    @property
+    def sync_periods(self):
+        return self._data['sync_periods']
+
+    @sync_periods.setter
+    def sync_periods(self, value):
+        self._data['sync_periods'] = value
+
+    @property
+    def sync_half_period(self):
+        return self._data['sync_half_period']
+
+    @sync_half_period.setter
+    def sync_half_period(self, value):
+        self._data['sync_half_period'] = value
+
+    @property
+    def sync_adc_bits(self):
+        return self._data['sync_adc_bits']
+
+    @sync_adc_bits.setter
+    def sync_adc_bits(self, value):
+        self._data['sync_adc_bits'] = value
+
+    @property
+    def adc_timeout(self):
+        return self._data['adc_timeout']
+
+    @adc_timeout.setter
+    def adc_timeout(self, value):
+        self._data['adc_timeout'] = value
+
+    @property
+    def adc_retries(self):
+        return self._data['adc_retries']
+
+    @adc_retries.setter
+    def adc_retries(self, value):
+        self._data['adc_retries'] = value
+
+    @property
+    def adc_retry_backoff(self):
+        return self._data['adc_retry_backoff']
+
+    @adc_retry_backoff.setter
+    def adc_retry_backoff(self, value):
+        self._data['adc_retry_backoff'] = value
+
+    @property
+    def breaker_threshold(self):
+        return self._data['breaker_threshold']
+
+    @breaker_threshold.setter
+    def breaker_threshold(self, value):
+        self._data['breaker_threshold'] = value
+
+    @property
+    def breaker_reset_delay(self):
+        return self._data['breaker_reset_delay']
+
+    @breaker_reset_delay.setter
+    def breaker_reset_delay(self, value):
+        self._data['breaker_reset_delay'] = value
+
+    @property
+    def stale_max_age(self):
+        return self._data['stale_max_age']
+
+    @stale_max_age.setter
+    def stale_max_age(self, value):
+        self._data['stale_max_age'] = value
+
+    @property
+    def history_size(self):
+        return self._data['history_size']
+
+    @history_size.setter
+    def history_size(self, value):
+        self._data['history_size'] = value
+
+    @property
+    def samples_dir(self):
+        """ The directory of the samples log files (default: /var/lib/pobot-demo-color if run as
+        root, ~/.pobot-demo-color otherwise).
+        """
+        path = self._data['samples_dir']
+        if path:
+            return path
+        elif os.getuid() == 0:
+            return os.path.join('/var/lib', APP_NAME)
+        else:
+            return os.path.expanduser(os.path.join('~', '.' + APP_NAME))
+
+    @samples_dir.setter
+    def samples_dir(self, value):
+        self._data['samples_dir'] = value
+
+    @property
+    def samples_log_size(self):
+        return self._data['samples_log_size']
+
+    @samples_log_size.setter
+    def samples_log_size(self, value):
+        self._data['samples_log_size'] = value
+
+    @property
+    def color_cycle_step(self):
+        return self._data['color_cycle_step']
+
+    @color_cycle_step.setter
+    def color_cycle_step(self, value):
+        self._data['color_cycle_step'] = value
+
+    @property
+    def acquisition_period(self):
+        return self._data['acquisition_period']
+
+    @acquisition_period.setter
+    def acquisition_period(self, value):
+        self._data['acquisition_period'] = value
+
+    @property
+    def idle_timeout(self):
+        return self._data['idle_timeout']
+
+    @idle_timeout.setter
+    def idle_timeout(self, value):
+        self._data['idle_timeout'] = value
+
+    @property
+    def client_ttl(self):
+        return self._data['client_ttl']
+
+    @client_ttl.setter
+    def client_ttl(self, value):
+        self._data['client_ttl'] = value
+
+    @property
+    def flicker_filter(self):
+        return self._data['flicker_filter']
+
+    @flicker_filter.setter
+    def flicker_filter(self, value):
+        self._data['flicker_filter'] = value
+
+    @property
+    def mains_frequency(self):
+        return self._data['mains_frequency']
+
+    @mains_frequency.setter
+    def mains_frequency(self, value):
+        self._data['mains_frequency'] = value
+
+    @property
+    def flicker_taps(self):
+        return self._data['flicker_taps']
+
+    @flicker_taps.setter
+    def flicker_taps(self, value):
+        self._data['flicker_taps'] = value
+
 
 class CalibrationConfiguration(Configuration):
     CONFIG_FILE_NAME = "calibration.cfg"
@@ -154,37 +520,72 @@ class CalibrationConfiguration(Configuration):
     _V3_0 = [0] * 3
 
     def __init__(self, *args, **kwargs):
+        """
+        :param str device_id: the id of the device the calibration applies to. Devices other than
+            the default one have their own calibration file, which is optional.
+        :param str variant: the variant of the calibration, if it depends on the way the sensors
+            are sampled (e.g. "synchronous"). Each variant has its own calibration file, which
+            is optional.
+        """
+        device_id = kwargs.pop('device_id', DEFAULT_DEVICE_ID)
+        variant = kwargs.pop('variant', None)
+        self._optional = device_id != DEFAULT_DEVICE_ID or variant is not None
+        if self._optional:
+            self.CONFIG_FILE_NAME = 'calibration%s%s.cfg' % (
+                '-' + device_id if device_id != DEFAULT_DEVICE_ID else '',
+                '-' + variant if variant else ''
+            )
+
         self._data = {
             'barrier': [0, 0],      # (free, occupied)
             'bw_detector': [0, 0],  # (black, white)
             'color_detector': {
                 'b': [0] * 3,       # (R, G, B)
                 'w': [0] * 3
-            }
+            },
+            'response': {}          # sensor id -> {'rise': tau, 'fall': tau} (in seconds)
         }
         super(CalibrationConfiguration, self).__init__(*args, **kwargs)
 
+    def load(self, path=None):
+        if not path and self._optional and not os.path.exists(self._path):
+            # not yet calibrated device or variant
+            return
+        super(CalibrationConfiguration, self).load(path)
+
+    def get_levels(self, sensor_id):
+        """ Returns the reference levels of a two levels sensor (see sensors.REFERENCE_NAMES).
+        """
+        return self._data.get(sensor_id, self._V2_0)[:]
+
+    def set_levels(self, sensor_id, value):
+        self._data[sensor_id] = value[:]
+        self._changed()
+
+    def levels_are_set(self, sensor_id):
+        return self._data.get(sensor_id, self._V2_0) != self._V2_0
+
     @property
     def barrier(self):
-        return self._data['barrier'][:]
+        return self.get_levels('barrier')
 
     @barrier.setter
     def barrier(self, value):
-        self._data['barrier'] = value[:]
+        self.set_levels('barrier', value)
 
     def barrier_is_set(self):
-        return self._data['barrier'] != self._V2_0
+        return self.levels_are_set('barrier')
 
     @property
     def bw_detector(self):
-        return self._data['bw_detector'][:]
+        return self.get_levels('bw_detector')
 
     @bw_detector.setter
     def bw_detector(self, value):
-        self._data['bw_detector'] = value[:]
+        self.set_levels('bw_detector', value)
 
     def bw_detector_is_set(self):
-        return self._data['bw_detector'] != self._V2_0
+        return self.levels_are_set('bw_detector')
 
     @property
     def color_detector_black(self):
@@ -193,6 +594,7 @@ class CalibrationConfiguration(Configuration):
     @color_detector_black.setter
     def color_detector_black(self, value):
         self._data['color_detector']['b'] = value[:]
+        self._changed()
 
     @property
     def color_detector_white(self):
@@ -201,11 +603,25 @@ class CalibrationConfiguration(Configuration):
     @color_detector_white.setter
     def color_detector_white(self, value):
         self._data['color_detector']['w'] = value[:]
+        self._changed()
 
     def color_detector_is_set(self):
         return self.color_detector_white != self._V3_0 \
             and self.color_detector_black != self._V3_0
 
+    def get_response(self, sensor_id):
+        """ Returns the step response time constants of a sensor LDR, if measured.
+
+        :return: the rise and fall time constants (in seconds), or None
+        :rtype: dict
+        """
+        response = self._data['response'].get(sensor_id)
+        return dict(response) if response else None
+
+    def set_response(self, sensor_id, rise, fall):
+        self._data['response'][sensor_id] = {'rise': rise, 'fall': fall}
+        self._changed()
+
     def is_complete(self):
         return self.barrier_is_set() and self.bw_detector_is_set() and self.color_detector_is_set()
 
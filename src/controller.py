@@ -5,16 +5,53 @@ __author__ = 'Eric Pascual'
 
 import configuration
 import logging
+import time
+import os
+from collections import OrderedDict
+
+import sampling
+import timing
+from sensors import Sensor, ANALYZER_COLOR, ANALYZER_THRESHOLD, REFERENCE_NAMES
+from sampling import CachingReader, FlickerFilter, sample_until_settled, record_until_settled, \
+    fit_time_constant, extrapolate_final, demodulate
+from arbitration import DemonstratorArbiter
+from breaker import CircuitBreaker, GuardedADC
+from frames import SampleHistory, SampleLog
 
 ADCPi = None
 BlinkM = None
 GPIO = None
 
+# the time source of the controller, replaced by a virtual clock when replaying a trace
+clock = time
 
-def set_simulation_mode(simulated_hw):
+_recorder = None
+_replaying = False
+
+
+def set_simulation_mode(simulated_hw, record=None, replay=None):
+    """ Selects the hardware drivers.
+
+    :param bool simulated_hw: if True, the hardware is simulated
+    :param str record: the path of the file the hardware trace is recorded to, if any
+    :param str replay: the path of the trace file to be replayed instead of using the hardware
+    """
     global ADCPi
     global BlinkM
     global GPIO
+    global clock
+    global _recorder
+    global _replaying
+
+    if replay:
+        import tracing
+        _replaying = True
+        source = tracing.Replay(replay)
+        ADCPi = source.adc_factory()
+        BlinkM = source.blinkm_factory()
+        GPIO = source.gpio()
+        clock = sampling.clock = source.clock
+        return
 
     if not simulated_hw:
         from extlibs.ABElectronics_ADCPi import ADCPi
@@ -25,12 +62,53 @@ def set_simulation_mode(simulated_hw):
         import simulation
         GPIO = simulation.GPIO()
 
+    if record:
+        import tracing
+        _recorder = tracing.Recorder(record)
+        ADCPi = _recorder.adc_factory(ADCPi)
+        BlinkM = _recorder.blinkm_factory(BlinkM)
+        GPIO = _recorder.gpio(GPIO)
+
+
+def replaying():
+    """ Tells if a hardware trace is replayed, the time being then given by its virtual clock.
+    """
+    return _replaying
+
+
+def release_gpio():
+    """ Releases the GPIOs, which are shared by all the devices.
+
+    To be called once all the devices are shut down.
+    """
+    if GPIO:
+        GPIO.cleanup()
+
+
+def stop_recording():
+    """ Closes the hardware trace file, if recording.
+    """
+    if _recorder:
+        _recorder.close()
+
 
 class DemonstratorController(object):
     LDR_BARRIER = 0
     LDR_BW = 1
     LDR_COLOR = 2
 
+    BARRIER = 'barrier'
+    BW_DETECTOR = 'bw_detector'
+    COLOR_DETECTOR = 'color_detector'
+
+    DEMONSTRATORS = (BARRIER, BW_DETECTOR, COLOR_DETECTOR)
+
+    # detection modes
+    ABSOLUTE = 'absolute'
+    SYNCHRONOUS = 'synchronous'
+
+    DETECTION_MODES = (ABSOLUTE, SYNCHRONOUS)
+
     AMBIENT = 0
     LIGHTENED = 1
 
@@ -63,17 +141,42 @@ class DemonstratorController(object):
         (255, 255, 255)
     )
 
-    def __init__(self, debug=False, simulation=False, cfg_dir=None):
-        self._log = logging.getLogger(self.__class__.__name__)
-
-        self._system_cfg = configuration.SystemConfiguration(
-            cfg_dir=cfg_dir,
-            autoload=True
-        )
-
-        set_simulation_mode(simulation)
-
-        self._blinkm = BlinkM(addr=self._system_cfg.blinkm_addr)
+    # the colors of the steps of the color cycle light script (see sample_color_cycle)
+    COLOR_CYCLE = (COLOR_RED, COLOR_GREEN, COLOR_BLUE, COLOR_UNDEF)
+    # the BlinkM light script used for the color cycle (the only writable one)
+    CYCLE_SCRIPT = 0
+    # the BlinkM light scripts time unit (in seconds), and "go to RGB" command
+    SCRIPT_TICK = 1 / 30.
+    SCRIPT_GO_TO = ord('n')
+    # the time (in seconds) before the end of a color cycle step at which the input is read
+    CYCLE_READ_MARGIN = 0.05
+
+    def __init__(self, debug=False, simulation=False, cfg_dir=None, system_cfg=None):
+        """
+        :param bool debug: debug mode activation
+        :param bool simulation: if True, the hardware is simulated
+        :param str cfg_dir: the configuration files directory
+        :param configuration.SystemConfiguration system_cfg: the configuration of the device to be
+            controlled. If not provided, the one of the default device is loaded from the system
+            configuration file.
+        """
+        if not system_cfg:
+            system_cfg = configuration.SystemConfiguration(
+                cfg_dir=cfg_dir,
+                autoload=True
+            ).devices()[0]
+        self._system_cfg = system_cfg
+        self._device_id = system_cfg.device_id
+
+        self._log = logging.getLogger('%s(%s)' % (self.__class__.__name__, self._device_id))
+
+        if ADCPi is None:
+            set_simulation_mode(simulation)
+
+        # the drivers of a hardware trace keep the events of the devices apart
+        trace_args = {'device_id': self._device_id} if _recorder or _replaying else {}
+
+        self._blinkm = BlinkM(addr=self._system_cfg.blinkm_addr, **trace_args)
         try:
             self._blinkm.reset()
         except IOError:
@@ -83,48 +186,86 @@ class DemonstratorController(object):
         self._adc = ADCPi(
             self._system_cfg.adc1_addr,
             self._system_cfg.adc2_addr,
-            self._system_cfg.adc_bits
+            self._system_cfg.adc_bits,
+            **trace_args
+        )
+        self._adc.setConversionTimeout(self._system_cfg.adc_timeout)
+        self._breaker = CircuitBreaker(
+            self._device_id,
+            threshold=self._system_cfg.breaker_threshold,
+            reset_delay=self._system_cfg.breaker_reset_delay
         )
+        self._guarded_adc = GuardedADC(
+            self._adc, self._breaker,
+            retries=self._system_cfg.adc_retries,
+            backoff=self._system_cfg.adc_retry_backoff
+        )
+        source = self._guarded_adc
+        if self._system_cfg.flicker_filter:
+            source = FlickerFilter(
+                source,
+                mains_frequency=self._system_cfg.mains_frequency,
+                taps=self._system_cfg.flicker_taps
+            )
+        self._reader = CachingReader(source, freshness=self._system_cfg.sample_freshness)
 
         GPIO.setmode(GPIO.BOARD)
 
-        self._barrier_adc = self._system_cfg.barrier_adc
-        self._barrier_led_gpio = self._system_cfg.barrier_led_gpio
-
-        GPIO.setup(self._barrier_led_gpio, GPIO.OUT)
-
-        self._bw_detector_adc = self._system_cfg.bw_detector_adc
-        self._bw_detector_led_gpio = self._system_cfg.bw_detector_led_gpio
-
-        GPIO.setup(self._bw_detector_led_gpio, GPIO.OUT)
-
-        self._color_detector_adc = self._system_cfg.color_detector_adc
+        self._sensors = OrderedDict()
+        for definition in self._system_cfg.sensors:
+            sensor = Sensor.from_dict(definition)
+            self._sensors[sensor.id] = sensor
+            if sensor.led_gpio is not None:
+                GPIO.setup(sensor.led_gpio, GPIO.OUT)
+        self._sensor_indexes = dict((sensor_id, i) for i, sensor_id in enumerate(self._sensors))
+        self._history = SampleHistory(self._system_cfg.history_size)
+        try:
+            self._sample_log = SampleLog(
+                os.path.join(self._system_cfg.samples_dir, '%s.samples' % self._device_id),
+                max_size=self._system_cfg.samples_log_size
+            )
+        except (IOError, OSError) as e:
+            self._log.error('samples will not be logged (%s)', e)
+            self._sample_log = None
 
         self._listen_port = self._system_cfg.listen_port
 
         self._shunts = self._system_cfg.shunts
 
+        self._arbiters = dict(
+            (sensor_id, DemonstratorArbiter(
+                sensor_id, lease_ttl=self._system_cfg.lease_ttl, queue_ttl=self._system_cfg.queue_ttl
+            ))
+            for sensor_id in self._sensors
+        )
+        self._lights = dict((sensor_id, 0) for sensor_id in self._sensors)
+        self._light_changes = {}
+        self._suspended_lights = None
+        self._cycle_script_ticks = None
+
         # process stored calibration data
 
-        self._barrier_threshold = \
-            self._bw_detector_threshold = \
-            self._white_rgb_levels = \
-            self._black_rgb_levels = None
+        self._thresholds = {}
+
+        if self._system_cfg.detection_mode not in self.DETECTION_MODES:
+            raise ValueError('invalid detection mode (%s)' % self._system_cfg.detection_mode)
+        self._synchronous = self._system_cfg.detection_mode == self.SYNCHRONOUS
 
+        # the levels measured by the detection modes are not comparable
         self._calibration_cfg = configuration.CalibrationConfiguration(
             cfg_dir=cfg_dir,
+            device_id=self._device_id,
+            variant=self.SYNCHRONOUS if self._synchronous else None,
             autoload=True
         )
 
-        if self._calibration_cfg.barrier_is_set():
-            self.set_barrier_reference_levels(*self._calibration_cfg.barrier)
+        for sensor in self._sensors.itervalues():
+            if sensor.reference_names and self._calibration_cfg.levels_are_set(sensor.id):
+                self.set_reference_levels(sensor.id, self._calibration_cfg.get_levels(sensor.id))
 
-        if self._calibration_cfg.bw_detector_is_set():
-            self.set_bw_detector_reference_levels(*self._calibration_cfg.bw_detector)
-
-        if self._calibration_cfg.color_detector_is_set():
-            self.set_color_detector_reference_levels('w', self._calibration_cfg.color_detector_white)
-            self.set_color_detector_reference_levels('b', self._calibration_cfg.color_detector_black)
+    @property
+    def device_id(self):
+        return self._device_id
 
     @property
     def blinkm(self):
@@ -138,71 +279,501 @@ class DemonstratorController(object):
     def gpio(self):
         return self._gpio
 
+    @property
+    def synchronous(self):
+        """ Tells if the analyses use the synchronous detection (see :py:meth:`sample_synchronous`).
+        """
+        return self._synchronous
+
+    def arbiter(self, demonstrator):
+        """ Returns the arbiter of a given demonstrator.
+
+        :param str demonstrator: the demonstrator name (see DEMONSTRATORS) or the id of a sensor
+        :rtype: arbitration.DemonstratorArbiter
+        """
+        return self._arbiters[demonstrator]
+
+    def light_state(self, demonstrator):
+        """ Returns the current setting of a demonstrator light source.
+
+        It is a boolean for the barrier and the B/W detector, and the color index for
+        the color detector.
+        """
+        return self._lights[demonstrator]
+
     def start(self):
         pass
 
+    def suspend(self):
+        """ Switches all the light sources off, their settings being restored by :py:meth:`resume`.
+        """
+        if self._suspended_lights is not None:
+            return
+        self._suspended_lights = dict(self._lights)
+        for sensor_id, state in self._suspended_lights.iteritems():
+            if state:
+                self._light_switch(sensor_id, state)(False)
+
+    def resume(self):
+        """ Restores the light sources settings in effect when suspended.
+        """
+        lights, self._suspended_lights = self._suspended_lights, None
+        for sensor_id, state in (lights or {}).iteritems():
+            if state:
+                self._light_switch(sensor_id, state)(True)
+
     def shutdown(self):
-        GPIO.cleanup()
+        if self._sample_log:
+            self._sample_log.close()
+
+    @property
+    def sensors(self):
+        """ The sensors of the device, in definition order.
+
+        :rtype: list of sensors.Sensor
+        """
+        return self._sensors.values()
+
+    @property
+    def sensor_ids(self):
+        return self._sensors.keys()
+
+    @property
+    def breaker(self):
+        """ The circuit breaker of the device ADC.
+
+        :rtype: breaker.CircuitBreaker
+        """
+        return self._breaker
+
+    def last_good_input(self, sensor_id):
+        """ Returns the last good current of a sensor, for being served while the hardware
+        is not available.
+
+        There is none for the color detector, which readings depend on the light color, and in
+        synchronous detection mode, which readings are not the raw input. The reading must
+        also have been made with the current light setting, and not be older than the
+        stale_max_age setting.
+
+        :return: the current (in mA) and its age (in seconds), or None if there is no usable one
+        :rtype: tuple
+        """
+        sensor = self._sensors[sensor_id]
+        if self._synchronous or sensor.analyzer == ANALYZER_COLOR:
+            return None
+
+        last = self._guarded_adc.last_good(sensor.channel)
+        if not last:
+            return None
+        read_at, voltage = last
+        age = clock.time() - read_at
+        if age > self._system_cfg.stale_max_age or read_at < self._light_changes.get(sensor_id, 0):
+            return None
+        return sensor.current(voltage), age
+
+    def sensor(self, sensor_id):
+        """ Returns a sensor given its id.
+
+        :raise KeyError: if the sensor does not exist
+        :rtype: sensors.Sensor
+        """
+        return self._sensors[sensor_id]
 
     def shunt(self, input_id):
         return self._shunts[input_id]
 
     def threshold(self, input_id):
         if input_id == self.LDR_BARRIER:
-            return self._barrier_threshold
+            return self._thresholds.get(self.BARRIER)
         elif input_id == self.LDR_BW:
-            return self._bw_detector_threshold
+            return self._thresholds.get(self.BW_DETECTOR)
         else:
             raise ValueError('no threshold defined for input (%d)' % input_id)
 
+    @property
+    def history(self):
+        """ The recent samples of the sensors, the sensors being identified by their index
+        in :py:attr:`sensor_ids`.
+
+        :rtype: frames.SampleHistory
+        """
+        return self._history
+
+    @property
+    def sample_log(self):
+        """ The log of all the samples of the sensors, if available (see :py:attr:`history`
+        for the sensors identification).
+
+        :rtype: frames.SampleLog
+        """
+        return self._sample_log
+
+    def _record_sample(self, t, sensor_id, current):
+        index = self._sensor_indexes[sensor_id]
+        self._history.append(t, index, current)
+        if self._sample_log:
+            self._sample_log.append(t, index, current)
+
+    def sample_input(self, sensor_id):
+        """ Returns the current (in mA) of a sensor.
+        """
+        sensor = self._sensors[sensor_id]
+        current = sensor.current(self._reader.read_voltage(sensor.channel))
+        self._record_sample(clock.time(), sensor_id, current)
+        return current
+
+    def sample_inputs(self, sensor_ids=None):
+        """ Returns the currents (in mA) of several sensors, their conversions being done
+        in a single pass.
+
+        :param list sensor_ids: the ids of the sensors to be sampled (default: all of them)
+        :return: the sampling time (given by the controller clock), and the currents keyed by
+            sensor id
+        :rtype: tuple
+        """
+        selected = [self._sensors[sensor_id] for sensor_id in sensor_ids] if sensor_ids \
+            else self._sensors.values()
+        voltages = self._reader.read_voltages([sensor.channel for sensor in selected])
+        now = clock.time()
+        currents = {}
+        for sensor, v in zip(selected, voltages):
+            current = currents[sensor.id] = sensor.current(v)
+            self._record_sample(now, sensor.id, current)
+        return now, currents
+
+    def _settle_criterion(self):
+        return {
+            'tolerance': self._system_cfg.settle_tolerance,
+            'abs_tolerance': self._system_cfg.settle_abs_tolerance,
+            'window': self._system_cfg.settle_window,
+            'interval': self._system_cfg.settle_interval,
+            'timeout': self._system_cfg.settle_timeout
+        }
+
+    def _fresh_reader(self, sensor_id):
+        sensor = self._sensors[sensor_id]
+        return lambda: sensor.current(self._reader.read_voltage(sensor.channel, fresh=True))
+
+    def _light_switch(self, sensor_id, color):
+        """ Returns a function switching a sensor light source on and off.
+
+        :param int color: the color used for switching on the color detector light
+        """
+        if self._sensors[sensor_id].analyzer == ANALYZER_COLOR:
+            return lambda on: self.set_color_detector_light(color if on else 0)
+        else:
+            return lambda on: self.set_light(sensor_id, on)
+
+    def sample_synchronous(self, sensor_id):
+        """ Samples a sensor input by synchronous detection.
+
+        The sensor light source is toggled a given number of periods (sync_periods and
+        sync_half_period settings), the input being read at the end of each half period. The
+        readings are then demodulated against this pattern (see sampling.demodulate), which gives
+        the contribution of the light source independently of the ambient light. The half period
+        must be long enough compared to the LDR time constants (see :py:meth:`measure_response`)
+        for the result not to depend on the light history.
+
+        The color detector light source is toggled with its current color (white if it is off).
+        The light source is restored in its initial state afterwards.
+
+        Since the ambient light is rejected, the ADC can be used at a faster, lower resolution
+        setting (sync_adc_bits setting) during the sampling.
+
+        :return: the light source contribution to the current (in mA), the variance of the
+            demodulated readings and the time taken (in seconds)
+        :rtype: dict (see :py:meth:`sample_settled`)
+        """
+        initial = self._lights[sensor_id]
+        switch_light = self._light_switch(sensor_id, initial or self.COLOR_WHITE)
+        read = self._fresh_reader(sensor_id)
+        half_period = self._system_cfg.sync_half_period
+        bits = self._system_cfg.sync_adc_bits
+
+        start = clock.time()
+        readings = []
+        if bits:
+            self._adc.setBitRate(bits)
+        try:
+            # the first period brings the LDR in the periodic regime : its readings are dropped
+            for i in range(2 * self._system_cfg.sync_periods + 3):
+                switch_light(i % 2)
+                with timing.span(timing.SETTLE):
+                    clock.sleep(half_period)
+                if i >= 2:
+                    readings.append(read())
+        finally:
+            if bits:
+                self._adc.setBitRate(self._system_cfg.adc_bits)
+            if self._sensors[sensor_id].analyzer == ANALYZER_COLOR:
+                self.set_color_detector_light(initial)
+            else:
+                self.set_light(sensor_id, initial)
+
+        mean, variance = demodulate(readings)
+        return {
+            'current': mean,
+            'variance': variance,
+            'time': clock.time() - start,
+            'settled': True
+        }
+
+    def sample_for_analysis(self, sensor_id):
+        """ Samples a sensor input for being analyzed, according to the detection mode.
+
+        :return: the current (in mA)
+        """
+        if self._synchronous:
+            return self.sample_synchronous(sensor_id)['current']
+        return self.sample_input(sensor_id)
+
+    def sample_settled(self, sensor_id):
+        """ Samples a sensor input until it has settled (see sampling.sample_until_settled).
+
+        The settling criterion is defined by the "settle_xxx" settings of the system configuration.
+        In synchronous detection mode, the input is sampled synchronously instead.
+
+        :return: the settled current (in mA), the variance of the readings it is computed from,
+            the time taken (in seconds) and whether the input settled before the timeout
+        :rtype: dict
+        """
+        if self._synchronous:
+            return self.sample_synchronous(sensor_id)
+
+        mean, variance, elapsed, settled = sample_until_settled(
+            self._fresh_reader(sensor_id), **self._settle_criterion()
+        )
+        if not settled:
+            self._log.warn('%s input not settled after %.1fs', sensor_id, elapsed)
+        return {
+            'current': mean,
+            'variance': variance,
+            'time': elapsed,
+            'settled': settled
+        }
+
+    def measure_response(self, sensor_id, store=True):
+        """ Measures the rise and fall time constants of a sensor LDR, by switching its light
+        on and off, and stores them in the calibration data.
+
+        The color detector is lit in white for the measure.
+
+        :param bool store: if False, the time constants are only returned (see
+            :py:meth:`set_response`)
+        :return: the rise and fall time constants (in seconds)
+        :rtype: dict
+        :raise ControllerException: if the LDR response could not be characterized, or the
+            sensor light source is not available
+        """
+        sensor = self._sensors[sensor_id]
+        if sensor.analyzer == ANALYZER_COLOR:
+            if not self._blinkm:
+                raise ControllerException('BlinkM not available')
+        elif sensor.led_gpio is None:
+            raise ControllerException('sensor %s has no light' % sensor_id)
+
+        switch_light = self._light_switch(sensor_id, self.COLOR_WHITE)
+        read = self._fresh_reader(sensor_id)
+        criterion = self._settle_criterion()
+        window = criterion['window']
+
+        taus = {}
+        switch_light(False)
+        self.sample_settled(sensor_id)
+        try:
+            for direction, on in (('rise', True), ('fall', False)):
+                switch_light(on)
+                trace, _ = record_until_settled(read, start=self._light_changes[sensor_id], **criterion)
+                final = sum(v for _, v in trace[-window:]) / len(trace[-window:])
+                taus[direction] = fit_time_constant(trace, final)
+        finally:
+            switch_light(False)
+
+        if None in taus.values():
+            raise ControllerException('no step response measured for %s' % sensor_id)
+
+        self._log.info("%s response : rise=%.3fs fall=%.3fs", sensor_id, taus['rise'], taus['fall'])
+        if store:
+            self.set_response(sensor_id, taus)
+        return taus
+
+    def set_response(self, sensor_id, response):
+        """ Sets the LDR time constants of a sensor in the calibration data.
+
+        :param dict response: the rise and fall time constants, as returned by
+            :py:meth:`measure_response`
+        """
+        self._calibration_cfg.set_response(sensor_id, response['rise'], response['fall'])
+
+    def predict_settled(self, sensor_id):
+        """ Estimates the value a sensor input settles to after the last light change, by
+        extrapolating a few early readings with the measured LDR response.
+
+        :return: the estimated current (in mA), or None if the LDR response has not been measured
+        """
+        response = self._calibration_cfg.get_response(sensor_id)
+        changed_at = self._light_changes.get(sensor_id)
+        if not response or changed_at is None:
+            return None
+
+        read = self._fresh_reader(sensor_id)
+        trace = []
+        for i in range(self._system_cfg.prediction_samples):
+            if i:
+                with timing.span(timing.SETTLE):
+                    clock.sleep(self._system_cfg.settle_interval)
+            trace.append((clock.time() - changed_at, read()))
+
+        if trace[0][0] > 5 * max(response.values()):
+            # settled since long
+            return sum(v for _, v in trace) / len(trace)
+
+        tau = response['rise'] if trace[-1][1] > trace[0][1] else response['fall']
+        return extrapolate_final(trace, tau)
+
+    def sample_reference(self, sensor_id):
+        """ Samples a sensor input with its light on once settled, for calibration purpose.
+
+        The light is switched off afterwards.
+
+        :rtype: dict (see :py:meth:`sample_settled`)
+        """
+        self.set_light(sensor_id, True)
+        try:
+            return self.sample_settled(sensor_id)
+        finally:
+            self.set_light(sensor_id, False)
+
+    def set_reference_levels(self, sensor_id, levels):
+        """ Sets the calibration references of a two levels sensor.
+
+        :param list levels: the reference levels, in the order given by sensor.reference_names
+        """
+        sensor = self._sensors[sensor_id]
+        if not sensor.reference_names:
+            raise ValueError('sensor %s has no reference levels' % sensor_id)
+        self._calibration_cfg.set_levels(sensor_id, list(levels))
+        self._thresholds[sensor_id] = sum(levels) / 2.
+
+    def get_reference_levels(self, sensor_id):
+        """ Returns the calibration references of a two levels sensor, if they are set.
+
+        :return: the reference levels, in the order given by sensor.reference_names, or None
+        """
+        if not self._calibration_cfg.levels_are_set(sensor_id):
+            return None
+        return self._calibration_cfg.get_levels(sensor_id)
+
+    def set_light(self, sensor_id, on):
+        sensor = self._sensors[sensor_id]
+        if sensor.led_gpio is None:
+            raise ValueError('sensor %s has no light' % sensor_id)
+        with timing.span(timing.LIGHT):
+            GPIO.output(sensor.led_gpio, 1 if on else 0)
+        self._lights[sensor_id] = bool(on)
+        self._light_changes[sensor_id] = clock.time()
+        self._reader.invalidate(sensor.channel)
+
+    def is_calibrated(self, sensor_id):
+        if self._sensors[sensor_id].analyzer == ANALYZER_COLOR:
+            return self.color_detector_is_calibrated()
+        return sensor_id in self._thresholds
+
+    def analyze_input(self, sensor_id, i_mA):
+        """ Analyzes a sensor reading, according to the sensor analyzer.
+
+        :return: the detection status for the threshold analyzer, the color (BW_BLACK or BW_WHITE)
+            for the B/W one
+        :raise NotCalibrated: if the sensor is not calibrated yet
+        :raise ValueError: if the sensor analyzer does not process single readings
+        """
+        analyzer = self._sensors[sensor_id].analyzer
+        if analyzer not in REFERENCE_NAMES:
+            raise ValueError('sensor %s readings cannot be analyzed' % sensor_id)
+        if not self.is_calibrated(sensor_id):
+            raise NotCalibrated(sensor_id)
+
+        with timing.span(timing.ANALYSIS):
+            below = i_mA < self._thresholds[sensor_id]
+            if analyzer == ANALYZER_THRESHOLD:
+                return below
+            else:
+                return self.BW_BLACK if below else self.BW_WHITE
+
     def sample_barrier_input(self):
-        v = self.adc.readVoltage(self._barrier_adc)
-        i_mA = v / self._shunts[self.LDR_BARRIER] * 1000.
-        return i_mA
+        return self.sample_input(self.BARRIER)
+
+    def sample_barrier_reference(self):
+        return self.sample_reference(self.BARRIER)
 
     def set_barrier_reference_levels(self, level_free, level_occupied):
-        self._calibration_cfg.barrier = [level_free, level_occupied]
-        self._barrier_threshold = (level_free + level_occupied) / 2.
+        self.set_reference_levels(self.BARRIER, [level_free, level_occupied])
 
     def set_barrier_light(self, on):
-        GPIO.output(self._barrier_led_gpio, 1 if on else 0)
+        self.set_light(self.BARRIER, on)
 
     def barrier_is_calibrated(self):
-        return self._barrier_threshold is not None
+        return self.is_calibrated(self.BARRIER)
 
     def analyze_barrier_input(self, i_mA):
-        if not self.barrier_is_calibrated():
-            raise NotCalibrated('barrier')
-
-        detection = i_mA < self._barrier_threshold
-        return detection
+        return self.analyze_input(self.BARRIER, i_mA)
 
     def sample_bw_detector_input(self):
-        v = self.adc.readVoltage(self._bw_detector_adc)
-        i_mA = v / self._shunts[self.LDR_BW] * 1000.
-        return i_mA
+        return self.sample_input(self.BW_DETECTOR)
+
+    def sample_bw_detector_reference(self):
+        return self.sample_reference(self.BW_DETECTOR)
 
     def set_bw_detector_reference_levels(self, level_black, level_white):
-        self._calibration_cfg.bw_detector = [level_black, level_white]
-        self._bw_detector_threshold = (level_black + level_white) / 2.
+        self.set_reference_levels(self.BW_DETECTOR, [level_black, level_white])
 
     def set_bw_detector_light(self, on):
-        GPIO.output(self._bw_detector_led_gpio, 1 if on else 0)
+        self.set_light(self.BW_DETECTOR, on)
 
     def bw_detector_is_calibrated(self):
-        return self._bw_detector_threshold is not None
+        return self.is_calibrated(self.BW_DETECTOR)
 
     def analyze_bw_detector_input(self, i_mA):
-        if not self.bw_detector_is_calibrated():
-            raise NotCalibrated('bw_detector')
-
-        color = self.BW_BLACK if i_mA < self._bw_detector_threshold else self.BW_WHITE
-        return color
+        return self.analyze_input(self.BW_DETECTOR, i_mA)
 
     def sample_color_detector_input(self):
-        v = self.adc.readVoltage(self._color_detector_adc)
-        i_mA = v / self._shunts[self.LDR_COLOR] * 1000.
-        return i_mA
+        return self.sample_input(self.COLOR_DETECTOR)
+
+    def sample_color_detector_component(self, settling_delay=1):
+        """ Samples the color detector input with the current light setting, once the LDR
+        has settled.
+
+        The settled value is predicted from early readings if the LDR response has been
+        measured (see :py:meth:`measure_response`). Otherwise the input is sampled after
+        a fixed delay. In synchronous detection mode, the input is sampled synchronously.
+
+        :param float settling_delay: the LDR settling delay (in seconds) used when the response
+            has not been measured
+        """
+        if self._synchronous:
+            return self.sample_synchronous(self.COLOR_DETECTOR)['current']
+
+        current = self.predict_settled(self.COLOR_DETECTOR)
+        if current is None:
+            with timing.span(timing.SETTLE):
+                clock.sleep(settling_delay)
+            current = self.sample_color_detector_input()
+        return current
+
+    def sample_color_detector_reference(self, color):
+        """ Samples the color detector input lit by a given color once settled, for calibration
+        purpose.
+
+        The light is switched off afterwards.
+
+        :param int color: the light color
+        :rtype: dict (see :py:meth:`sample_settled`)
+        """
+        self.set_color_detector_light(color)
+        try:
+            return self.sample_settled(self.COLOR_DETECTOR)
+        finally:
+            self.set_color_detector_light(0)
 
     def set_color_detector_reference_levels(self, white_or_black, levels):
         if white_or_black == 'b':
@@ -214,10 +785,80 @@ class DemonstratorController(object):
 
     def set_color_detector_light(self, color):
         if self._blinkm:
-            self._blinkm.go_to(*(self.COLOR_COMPONENTS[color]))
+            with timing.span(timing.LIGHT):
+                self._blinkm.go_to(*(self.COLOR_COMPONENTS[color]))
+            self._lights[self.COLOR_DETECTOR] = color
+            self._light_changes[self.COLOR_DETECTOR] = clock.time()
+            self._reader.invalidate(self._sensors[self.COLOR_DETECTOR].channel)
         else:
             self._log.error("BlinkM not available")
 
+    def _load_color_cycle_script(self, ticks):
+        """ Uploads the color cycle light script to the BlinkM, unless it is already there.
+
+        :param int ticks: the duration of the script steps, in script ticks
+        """
+        if ticks == self._cycle_script_ticks:
+            return
+        with timing.span(timing.LIGHT):
+            for line, color in enumerate(self.COLOR_CYCLE):
+                self._blinkm.write_script_line(
+                    self.CYCLE_SCRIPT, line, ticks, self.SCRIPT_GO_TO, *self.COLOR_COMPONENTS[color]
+                )
+            self._blinkm.set_script_length_and_repeats(self.CYCLE_SCRIPT, len(self.COLOR_CYCLE), 1)
+        self._cycle_script_ticks = ticks
+        self._log.info('color cycle script loaded (%d ticks steps)', ticks)
+
+    def sample_color_cycle(self):
+        """ Samples the color detector input lit in turn in red, green and blue, the light being
+        cycled by a script played by the BlinkM.
+
+        The script (see COLOR_CYCLE) is uploaded once, and each cycle is then started by a single
+        command. Its steps last color_cycle_step seconds, and the input is read just before the
+        end of each one, the readings being timed from the script start instead of following
+        separate light commands. The last step switches the light off. In synchronous detection
+        mode, the input is read at its end too, and this ambient reading is subtracted from the
+        other ones.
+
+        :return: the currents (in mA) for the red, green and blue lights
+        :rtype: list
+        :raise ControllerException: if the BlinkM is not available
+        """
+        if not self._blinkm:
+            raise ControllerException('BlinkM not available')
+
+        ticks = min(max(int(round(self._system_cfg.color_cycle_step / self.SCRIPT_TICK)), 1), 255)
+        step = ticks * self.SCRIPT_TICK
+        steps = len(self.COLOR_CYCLE) if self._synchronous else len(self.COLOR_CYCLE) - 1
+        read = self._fresh_reader(self.COLOR_DETECTOR)
+
+        self._load_color_cycle_script(ticks)
+        readings = []
+        try:
+            with timing.span(timing.LIGHT):
+                self._blinkm.play_script(self.CYCLE_SCRIPT, 1, 0)
+            start = clock.time()
+            for i in range(steps):
+                with timing.span(timing.SETTLE):
+                    clock.sleep(max(start + (i + 1) * step - self.CYCLE_READ_MARGIN - clock.time(), 0))
+                readings.append(read())
+            # make sure that the light is off when returning
+            with timing.span(timing.SETTLE):
+                clock.sleep(max(start + (len(self.COLOR_CYCLE) - 1) * step + self.CYCLE_READ_MARGIN - clock.time(), 0))
+        except Exception:
+            self._blinkm.stop_script()
+            self._blinkm.go_to(*self.COLOR_COMPONENTS[self.COLOR_UNDEF])
+            raise
+        finally:
+            self._lights[self.COLOR_DETECTOR] = 0
+            self._light_changes[self.COLOR_DETECTOR] = clock.time()
+            self._reader.invalidate(self._sensors[self.COLOR_DETECTOR].channel)
+
+        if self._synchronous:
+            ambient = readings.pop()
+            readings = [r - ambient for r in readings]
+        return readings
+
     def color_detector_is_calibrated(self):
         return self._calibration_cfg.color_detector_is_set()
 
@@ -225,8 +866,11 @@ class DemonstratorController(object):
         if not self.color_detector_is_calibrated():
             raise NotCalibrated('color_detector')
 
+        with timing.span(timing.ANALYSIS):
+            return self._analyze_color_input(rgb_sample)
+
+    def _analyze_color_input(self, rgb_sample):
         # normalize color components in [0, 1] and in the white-black range
-        self._log.debug("analyze %s", rgb_sample)
         rgb_sample = [float(s) for s in rgb_sample]
         comps = [max((s - b) / (w - b), 0)
                  for w, b, s in zip(
@@ -234,14 +878,12 @@ class DemonstratorController(object):
                 self._calibration_cfg.color_detector_black,
                 rgb_sample
             )]
-        self._log.debug("--> comps=%s", comps)
 
         sum_comps = sum(comps)
         if sum_comps > 0:
             relative_levels = [c / sum_comps for c in comps]
         else:
             relative_levels = [0] * 3
-        self._log.debug("--> relative_levels=%s", relative_levels)
 
         min_comps, max_comps = min(comps), max(comps)
 
@@ -256,7 +898,10 @@ class DemonstratorController(object):
             else:
                 color = self.COLOR_UNDEF
 
-        self._log.debug("--> color=%s", self.COLOR_NAMES[color])
+        self._log.debug(
+            "analyze %s : comps=%s relative_levels=%s --> color=%s",
+            rgb_sample, comps, relative_levels, self.COLOR_NAMES[color]
+        )
         return color, relative_levels
 
     def save_calibration(self):
@@ -265,6 +910,9 @@ class DemonstratorController(object):
     def get_calibration_cfg_as_dict(self):
         return self._calibration_cfg.as_dict()
 
+    def get_calibration_version(self):
+        return self._calibration_cfg.version
+
 
 class ControllerException(Exception):
     pass
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Demand-driven activity of the devices.
+
+The background activity of a device (continuous acquisition, light sources) is only useful
+while somebody uses it. Its users are thus reference-counted: clients (e.g. demo pages) count
+as long as they keep sending requests, and jobs (e.g. recordings) hold an explicit reference
+until they release it. The activity is suspended once the device has had no user for a given
+idle time, and resumed as soon as one comes back.
+"""
+
+__author__ = 'Eric Pascual'
+
+import time
+import logging
+
+from tornado.ioloop import PeriodicCallback
+
+
+class Demand(object):
+    """ The users of a device, suspending and resuming its activity.
+
+    Its methods must be called from the IOLoop thread.
+    """
+    CHECK_INTERVAL = 1.
+
+    def __init__(self, name, on_suspend, on_resume, idle_timeout=300, client_ttl=30):
+        """
+        :param str name: the name of the device, for the log
+        :param on_suspend: the function suspending the activity
+        :param on_resume: the function resuming the activity
+        :param float idle_timeout: the time (in seconds) without users after which the activity
+            is suspended
+        :param float client_ttl: the time (in seconds) a client counts as a user after its
+            last request
+        """
+        self._log = logging.getLogger('%s(%s)' % (self.__class__.__name__, name))
+        self._on_suspend = on_suspend
+        self._on_resume = on_resume
+        self.idle_timeout = idle_timeout
+        self.client_ttl = client_ttl
+
+        self._clients = {}
+        self._holders = {}
+        self._idle_since = time.time()
+        self._suspended = False
+        self._checker = PeriodicCallback(self._check, self.CHECK_INTERVAL * 1000)
+
+    @property
+    def suspended(self):
+        return self._suspended
+
+    @property
+    def users(self):
+        """ The current number of users.
+        """
+        self._expire_clients(time.time())
+        return len(self._clients) + sum(self._holders.itervalues())
+
+    def start(self):
+        self._checker.start()
+
+    def stop(self):
+        self._checker.stop()
+
+    def touch(self, client_id):
+        """ Records the activity of a client.
+
+        :param str client_id: the client identifier
+        """
+        self._clients[client_id] = time.time()
+        self._wake_up()
+
+    def hold(self, holder):
+        """ Adds a reference held by a job, until it is released.
+
+        :param str holder: the job identifier, which can hold several references
+        """
+        self._holders[holder] = self._holders.get(holder, 0) + 1
+        self._wake_up()
+
+    def release(self, holder):
+        """ Releases a reference held by a job.
+        """
+        count = self._holders.get(holder, 0) - 1
+        if count > 0:
+            self._holders[holder] = count
+        else:
+            self._holders.pop(holder, None)
+            if not self.users:
+                self._idle_since = time.time()
+
+    def _wake_up(self):
+        if self._suspended:
+            self._suspended = False
+            self._log.info('resuming activity')
+            self._on_resume()
+
+    def _expire_clients(self, now):
+        expired = [c for c, last_seen in self._clients.iteritems() if now - last_seen > self.client_ttl]
+        for client_id in expired:
+            # the device is idle since the last request of the last client
+            self._idle_since = max(self._idle_since, self._clients.pop(client_id) + self.client_ttl)
+
+    def _check(self):
+        now = time.time()
+        if self._suspended or self.users:
+            return
+        if now - self._idle_since >= self.idle_timeout:
+            self._suspended = True
+            self._log.info('suspending activity after %ds without users', self.idle_timeout)
+            self._on_suspend()
+
+    def status(self):
+        users = self.users
+        return {
+            'suspended': self._suspended,
+            'clients': len(self._clients),
+            'holders': sorted(self._holders),
+            'idle_time': time.time() - self._idle_since if not users else 0
+        }
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Registry of the demonstrator devices served by the application.
+
+Each device (i.e. a demonstrator board, with its ADC, BlinkM and LEDs) is controlled by
+its own controller, and has its own hardware worker so that a slow board does not stall
+the other ones. The exports of the logged samples are read by another worker, so that they
+do not delay the hardware operations.
+
+While the device has users (see the demand module), its sensors are sampled continuously, the
+samples feeding its history and log.
+
+The calibration sequences are run as server-side jobs (see the calibration module).
+"""
+
+__author__ = 'Eric Pascual'
+
+import logging
+import time
+
+from tornado.web import HTTPError
+from tornado.ioloop import PeriodicCallback
+
+import configuration
+from controller import DemonstratorController, replaying
+from worker import HardwareWorker
+from demand import Demand
+from calibration import CalibrationJobs
+
+# the cookie identifying the clients (see wsapi.Arbitrated)
+CLIENT_ID_COOKIE = "demo_client"
+
+
+class Device(object):
+    """ A demonstrator device.
+
+    The controller of the device is created by its hardware worker when the device is
+    started, so that a slow (or stalled) hardware initialization does not delay the
+    application startup. The device is not ready, and has no controller, until then.
+
+    The continuous acquisition (acquisition_period setting) and the light sources are
+    suspended while the device is not used. The acquisition is not done when replaying a
+    hardware trace, since it would consume the replayed readings.
+    """
+    def __init__(self, system_cfg, debug=False, simulation=False, cfg_dir=None):
+        """
+        :param configuration.SystemConfiguration system_cfg: the configuration of the device
+        :param bool debug: debug mode activation
+        :param bool simulation: if True, the hardware is simulated
+        :param str cfg_dir: the configuration files directory
+        """
+        self._system_cfg = system_cfg
+        self._controller_args = {
+            'debug': debug,
+            'simulation': simulation,
+            'cfg_dir': cfg_dir
+        }
+        self._log = logging.getLogger('%s(%s)' % (self.__class__.__name__, self.id))
+
+        self.controller = None
+        self.error = None
+        self.init_time = None
+        self.worker = HardwareWorker('hw-%s' % self.id)
+        self.export_worker = HardwareWorker('export-%s' % self.id)
+
+        self.demand = Demand(
+            self.id, self._suspend, self._resume,
+            idle_timeout=system_cfg.idle_timeout,
+            client_ttl=system_cfg.client_ttl
+        )
+        period = system_cfg.acquisition_period
+        if period and not replaying():
+            self._acquisition = PeriodicCallback(self._acquire, period * 1000)
+        else:
+            self._acquisition = None
+        self._acquiring = False
+        self.calibration_jobs = CalibrationJobs(self)
+
+    @property
+    def id(self):
+        return self._system_cfg.device_id
+
+    @property
+    def ready(self):
+        return self.controller is not None
+
+    def start(self):
+        """ Starts the device worker, and submits the hardware initialization to it.
+        """
+        self.worker.start()
+        self.export_worker.start()
+        self.worker.submit(self._initialize)
+        self.demand.start()
+        if self._acquisition:
+            self._acquisition.start()
+
+    def _initialize(self):
+        start = time.time()
+        try:
+            controller = DemonstratorController(system_cfg=self._system_cfg, **self._controller_args)
+            controller.start()
+        except Exception as e:
+            self._log.exception('hardware initialization failed')
+            self.error = str(e)
+        else:
+            self.init_time = time.time() - start
+            self.controller = controller
+            self._log.info('ready (initialized in %.3fs)', self.init_time)
+
+    def shutdown(self):
+        self.demand.stop()
+        if self._acquisition:
+            self._acquisition.stop()
+        self.worker.stop()
+        self.export_worker.stop()
+        if self.controller:
+            self.controller.shutdown()
+
+    def _acquire(self):
+        """ Samples all the sensors, unless the previous acquisition is not done yet.
+        """
+        if not self.ready or self._acquiring:
+            return
+        self._acquiring = True
+        self.worker.submit(self.controller.sample_inputs).add_done_callback(self._acquired)
+
+    def _acquired(self, future):
+        self._acquiring = False
+        error = future.exception()
+        if error and not isinstance(error, IOError):
+            # hardware errors are already reported by the ADC guard
+            self._log.error('acquisition failed : %s', error)
+
+    def _suspend(self):
+        if self._acquisition:
+            self._acquisition.stop()
+        if self.ready:
+            self.worker.submit(self.controller.suspend)
+
+    def _resume(self):
+        if self.ready:
+            self.worker.submit(self.controller.resume)
+        if self._acquisition:
+            self._acquisition.start()
+            self._acquire()
+
+    def run(self, fn, *args, **kwargs):
+        """ Submits an operation to the device hardware worker.
+
+        :rtype: tornado.concurrent.Future
+        """
+        return self.worker.submit(fn, *args, **kwargs)
+
+    def status(self):
+        return {
+            'id': self.id,
+            'ready': self.ready,
+            'error': self.error,
+            'init_time': self.init_time,
+            'adc': self.controller.breaker.status() if self.controller else None,
+            'demand': self.demand.status()
+        }
+
+
+class DeviceRegistry(object):
+    """ The devices defined in the system configuration.
+    """
+    def __init__(self, debug=False, simulation=False, cfg_dir=None):
+        self._log = logging.getLogger(self.__class__.__name__)
+
+        system_cfg = configuration.SystemConfiguration(
+            cfg_dir=cfg_dir,
+            autoload=True
+        )
+
+        self._devices = []
+        self._devices_by_id = {}
+        for device_cfg in system_cfg.devices():
+            if device_cfg.device_id in self._devices_by_id:
+                raise ValueError('duplicate device id (%s)' % device_cfg.device_id)
+
+            self._log.info('creating device %s', device_cfg.device_id)
+            device = Device(device_cfg, debug=debug, simulation=simulation, cfg_dir=cfg_dir)
+            self._devices.append(device)
+            self._devices_by_id[device.id] = device
+
+    def __iter__(self):
+        return iter(self._devices)
+
+    def __len__(self):
+        return len(self._devices)
+
+    @property
+    def ids(self):
+        return [device.id for device in self._devices]
+
+    @property
+    def default(self):
+        return self._devices[0]
+
+    @property
+    def ready(self):
+        return all(device.ready for device in self._devices)
+
+    def get(self, device_id=None):
+        """ Returns a device given its id, or the default one if no id is provided.
+
+        :raise KeyError: if the device does not exist
+        """
+        if device_id is None:
+            return self.default
+        return self._devices_by_id[device_id]
+
+    def start(self):
+        """ Starts the devices, their hardware being initialized in the background.
+        """
+        for device in self._devices:
+            device.start()
+
+    def shutdown(self):
+        for device in self._devices:
+            device.shutdown()
+
+
+class DeviceBound(object):
+    """ Mixin for request handlers serving a device.
+
+    The device is selected by the "device_id" group of the route pattern, the default device
+    being used by routes without it.
+
+    Handlers using the device controller are answered a 503 with a Retry-After header while
+    the device hardware is not ready, and a 500 if its initialization failed. Overriding
+    implementations of :py:meth:`prepare` must thus return without going further unless
+    :py:attr:`prepared` is set after calling this one.
+    """
+    RETRY_AFTER = 2
+
+    # set to False by handlers which do not use the controller
+    needs_controller = True
+    # set to False by handlers which do not count as a use of the device (see demand.Demand)
+    counts_as_use = True
+
+    device_id = None
+    device = None
+    # set once the request has passed the checks of prepare()
+    prepared = False
+
+    def prepare(self):
+        self.device_id = self.path_kwargs.pop('device_id', None)
+        try:
+            self.device = self.application.devices.get(self.device_id)
+        except KeyError:
+            raise HTTPError(404, reason="unknown device (%s)" % self.device_id)
+
+        if self.counts_as_use:
+            # clients behind the same address (e.g. a NAT) are told apart by their cookie,
+            # the address standing for the ones which have not been given one yet
+            self.device.demand.touch(self.get_cookie(CLIENT_ID_COOKIE) or self.request.remote_ip)
+
+        if self.needs_controller and not self.device.ready:
+            if self.device.error:
+                # nothing will retry the initialization
+                self.set_status(500, reason="device %s initialization failed" % self.device.id)
+            else:
+                self.set_status(503, reason="device %s not ready" % self.device.id)
+                self.set_header('Retry-After', self.RETRY_AFTER)
+            self.finish()
+            return
+
+        super(DeviceBound, self).prepare()
+        self.prepared = True
+
+    @property
+    def controller(self):
+        return self.device.controller
+
+    @property
+    def base_url(self):
+        """ The prefix of the URLs of the device pages and services.
+        """
+        return '/dev/%s' % self.device_id if self.device_id else ''
@@ -1,7 +1,9 @@
 #!/usr/bin/python
 
-import smbus
-import re
+import time
+import errno
+
+from i2cbus import I2CBus
 
 
 # ================================================
@@ -9,6 +11,7 @@ import re
 # Version 1.0 Created 09/05/2014
 #
 # Requires python smbus to be installed
+# (accessed through the shared bus manager of i2cbus)
 #
 # ================================================
 
@@ -24,6 +27,7 @@ class ADCPi :
   __bitrate = 18 # current bitrate
   __pga = 1 # current pga setting
   __signbit = 0 # signed bit checker
+  __timeout = 1.0 # conversion ready polling timeout (in seconds)
 
 
   
@@ -34,20 +38,9 @@ class ADCPi :
   __adcreading.append(0x00)
   __adcreading.append(0x00)
 
-  # detect i2C port number and assign to i2c_bus
-  for line in open('/proc/cpuinfo').readlines():
-    m = re.match('(.*?)\s*:\s*(.*)', line)
-    if m:
-      (name, value) = (m.group(1), m.group(2))
-      if name == "Revision":
-        if value [-4:] in ('0002', '0003'):
-          i2c_bus = 0
-        else:
-          i2c_bus = 1
-        break
-  # Define I2C bus and init        
+  # Define I2C bus and init, the bus being shared with the other devices connected to it
   global bus
-  bus = smbus.SMBus(i2c_bus); 
+  bus = I2CBus.shared()
 
   #local methods    
 
@@ -121,7 +114,16 @@ class ADCPi :
   def readVoltage(self, channel): 
       # returns the voltage from the selected adc channel - channels 1 to 8
       raw = self.readRaw(channel)
-      
+      return self.__tovoltage(raw)
+
+  def readVoltages(self, channels):
+      # returns the voltages from a list of channels, in the same order
+      # the channels are converted one after the other : readRaw writes the configuration
+      # byte on each poll, which would restart a conversion started beforehand
+      return [self.__tovoltage(self.readRaw(c)) for c in channels]
+
+  def __tovoltage(self, raw):
+      # converts a raw value returned by readRaw into a voltage
       if self.__signbit == 1: return 0 # returned a negative voltage so return 0  
 
       pga = self.__pga / 2.048
@@ -145,7 +147,10 @@ class ADCPi :
           config = self.__config2
           address = self.__address2
       
+      deadline = time.time() + self.__timeout
       while 1:  # keep reading the adc data until the conversion result is ready
+          if time.time() > deadline:
+              raise IOError(errno.ETIMEDOUT, 'conversion not ready on 0x%.2x channel %d' % (address, channel))
           __adcreading = bus.read_i2c_block_data(address,config)
           if self.__bitrate == 18:
               h = __adcreading[0]
@@ -185,6 +190,10 @@ class ADCPi :
       return t
 
 
+  def setConversionTimeout(self, timeout):
+      # sets the maximum time (in seconds) waited for a conversion result
+      self.__timeout = timeout
+
   def setPGA(self, gain):
       # PGA gain selection
       #1 = 1x
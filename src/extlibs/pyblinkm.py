@@ -51,14 +51,14 @@ class I2C:
     """
     def __init__(self, bus=1, addr=0x09):
         # import on top makes readthedocs build fail
-        import smbus
-        self.bus = smbus.SMBus(bus)
+        from i2cbus import I2CBus
+        # the bus is shared with the other devices connected to it (e.g. the ADC)
+        self.bus = I2CBus.shared(bus)
         self.addr = addr
 
     def _write_bytes(self, *bytes):
-        """Write bytes at I2C address."""
-        for byte in bytes:
-            self.bus.write_byte(self.addr, byte)
+        """Write bytes at I2C address, as a single transaction (command and arguments)."""
+        self.bus.write_bytes(self.addr, bytes)
 
     def _read_bytes(self, nb_bytes=1):
         """Read bytes at I2C address
@@ -155,8 +155,9 @@ class BlinkM(I2C):
         """Get Current RGB Color.
 
         Returns current red, green and blue channels."""
-        self._write_bytes(GET_CURRENT_RGB)
-        r, g, b = self._read_bytes(3)
+        with self.bus.transaction():
+            self._write_bytes(GET_CURRENT_RGB)
+            r, g, b = self._read_bytes(3)
         return r, g ,b
 
     def write_script_line(self, script_number, line_number, duration, command, value1=0, value2=0, value3=0):
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Compact binary encoding of the sensor samples.
+
+A sample is encoded as a fixed layout frame made of its time (seconds since the epoch, as a
+little-endian double), the index of its sensor in the device sensors list (unsigned short)
+and its value (float), i.e. 14 bytes instead of about 50 in JSON. Frames are packed directly
+from the samples, without building intermediate objects.
+
+The sample history is kept in preallocated arrays used as a ring buffer, so that recording
+a sample does not allocate memory either.
+
+The samples are also appended as frames to a log file, from which they can be exported
+afterwards. The log is read in fixed size chunks, so that exporting a large time range does
+not use more memory than a small one.
+"""
+
+__author__ = 'Eric Pascual'
+
+import os
+import struct
+import threading
+import logging
+from array import array
+
+FRAME = struct.Struct('<dHf')
+
+CONTENT_TYPE = 'application/octet-stream'
+
+
+def encode(samples):
+    """ Encodes samples as frames.
+
+    :param samples: the samples, as (time, sensor index, value) tuples
+    :rtype: str
+    """
+    samples = list(samples)
+    buf = bytearray(len(samples) * FRAME.size)
+    offset = 0
+    for t, index, value in samples:
+        FRAME.pack_into(buf, offset, t, index, value)
+        offset += FRAME.size
+    return str(buf)
+
+
+def decode(data):
+    """ Decodes frames.
+
+    :param str data: the frames
+    :return: the samples, as (time, sensor index, value) tuples
+    :rtype: list
+    """
+    return [FRAME.unpack_from(data, offset) for offset in xrange(0, len(data) - FRAME.size + 1, FRAME.size)]
+
+
+class SampleHistory(object):
+    """ The most recent samples of a device sensors.
+    """
+    def __init__(self, capacity=2000):
+        self._lock = threading.Lock()
+        self._capacity = capacity
+        self._times = array('d', [0.]) * capacity
+        self._indexes = array('H', [0]) * capacity
+        self._values = array('f', [0.]) * capacity
+        self._count = 0
+
+    def __len__(self):
+        return min(self._count, self._capacity)
+
+    def append(self, t, index, value):
+        with self._lock:
+            i = self._count % self._capacity
+            self._times[i] = t
+            self._indexes[i] = index
+            self._values[i] = value
+            self._count += 1
+
+    def _positions(self, since):
+        """ Returns the positions of the kept samples more recent than a given time, oldest first.
+        """
+        first = max(self._count - self._capacity, 0)
+        positions = [i % self._capacity for i in xrange(first, self._count)]
+        if since is not None:
+            positions = [i for i in positions if self._times[i] > since]
+        return positions
+
+    def samples(self, since=None):
+        """ Returns the kept samples, oldest first.
+
+        :param float since: if provided, only the samples more recent than this time are returned
+        :return: the samples, as (time, sensor index, value) tuples
+        :rtype: list
+        """
+        with self._lock:
+            return [(self._times[i], self._indexes[i], self._values[i]) for i in self._positions(since)]
+
+    def encode(self, since=None):
+        """ Returns the kept samples encoded as frames (see :py:meth:`samples`).
+
+        :rtype: str
+        """
+        with self._lock:
+            positions = self._positions(since)
+            buf = bytearray(len(positions) * FRAME.size)
+            offset = 0
+            for i in positions:
+                FRAME.pack_into(buf, offset, self._times[i], self._indexes[i], self._values[i])
+                offset += FRAME.size
+        return str(buf)
+
+
+class SampleLog(object):
+    """ Persistent log of the samples of a device sensors, as frames appended to a file.
+
+    When the file reaches its maximum size, it is renamed with a ".1" suffix (replacing the
+    previous one) and a new one is started, so that the disk usage stays bounded.
+    """
+    CHUNK_FRAMES = 4096
+
+    def __init__(self, path, max_size=16 * 1024 * 1024):
+        """
+        :param str path: the path of the log file, its directory being created if needed
+        :param int max_size: the size (in bytes) of the file triggering its rotation
+        """
+        self._log = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._fp = open(path, 'ab')
+        self._size = os.path.getsize(path)
+        if self._size % FRAME.size:
+            # discard the partial frame left by an interrupted write
+            self._size -= self._size % FRAME.size
+            self._fp.truncate(self._size)
+        self._log.info('logging samples to %s', path)
+
+    def append(self, t, index, value):
+        with self._lock:
+            if not self._fp:
+                return
+            self._fp.write(FRAME.pack(t, index, value))
+            self._size += FRAME.size
+            if self._size >= self.max_size:
+                self._fp.close()
+                os.rename(self.path, self.path + '.1')
+                self._fp = open(self.path, 'ab')
+                self._size = 0
+
+    def close(self):
+        with self._lock:
+            if self._fp:
+                self._fp.close()
+                self._fp = None
+
+    def _open_files(self):
+        """ Returns the log files opened for reading, oldest first, with their current size.
+        """
+        with self._lock:
+            if self._fp:
+                self._fp.flush()
+            files = []
+            for path in (self.path + '.1', self.path):
+                try:
+                    fp = open(path, 'rb')
+                except IOError:
+                    continue
+                size = os.fstat(fp.fileno()).st_size
+                files.append((fp, size - size % FRAME.size))
+            return files
+
+    @staticmethod
+    def _first_frame_after(fp, size, since):
+        """ Returns the offset of the first frame not older than a given time, the frames of
+        a file being in time order.
+        """
+        lo, hi = 0, size // FRAME.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            fp.seek(mid * FRAME.size)
+            if FRAME.unpack(fp.read(FRAME.size))[0] < since:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo * FRAME.size
+
+    def export(self, index=None, since=None, until=None):
+        """ Reads the logged samples of a time range, by chunks.
+
+        The samples logged after the call are not included. The returned iterator can be
+        consumed from another thread than the one appending the samples.
+
+        :param int index: the index of the sensor which samples are returned (default: all)
+        :param float since: the start of the time range (default: the oldest logged sample)
+        :param float until: the end of the time range (default: the last logged sample)
+        :return: an iterator of non-empty lists of (time, sensor index, value) tuples
+        """
+        files = self._open_files()
+        try:
+            for fp, size in files:
+                offset = self._first_frame_after(fp, size, since) if since is not None else 0
+                fp.seek(offset)
+                while offset < size:
+                    data = fp.read(min(self.CHUNK_FRAMES * FRAME.size, size - offset))
+                    if not data:
+                        break
+                    offset += len(data)
+                    chunk = [
+                        sample for sample in (
+                            FRAME.unpack_from(data, pos) for pos in xrange(0, len(data), FRAME.size)
+                        )
+                        if index is None or sample[1] == index
+                    ]
+                    if until is not None and FRAME.unpack_from(data, len(data) - FRAME.size)[0] > until:
+                        chunk = [sample for sample in chunk if sample[0] <= until]
+                        if chunk:
+                            yield chunk
+                        return
+                    if chunk:
+                        yield chunk
+        finally:
+            for fp, _ in files:
+                fp.close()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Shared I2C bus access.
+
+The ADC and the BlinkM drivers share the same physical bus. They access it through a single
+manager per bus, which serializes the transactions, retries the transient errors and keeps
+timing statistics, so that the bus contention can be observed.
+"""
+
+__author__ = 'Eric Pascual'
+
+import threading
+import time
+import re
+import logging
+from contextlib import contextmanager
+
+import timing
+
+
+def default_bus_number():
+    """ Returns the number of the I2C bus of the GPIO header, which depends on the board revision.
+    """
+    with open('/proc/cpuinfo') as fp:
+        for line in fp:
+            m = re.match(r'(.*?)\s*:\s*(.*)', line)
+            if m and m.group(1) == 'Revision':
+                return 0 if m.group(2)[-4:] in ('0002', '0003') else 1
+    return 1
+
+
+class _TransactionStats(object):
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_time = 0.
+        self.max_time = 0.
+        self.total_wait = 0.
+        self.max_wait = 0.
+
+    def record(self, duration, wait, retries, failed):
+        self.count += 1
+        self.retries += retries
+        if failed:
+            self.errors += 1
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'retries': self.retries,
+            'mean_ms': self.total_time / self.count * 1000. if self.count else 0,
+            'max_ms': self.max_time * 1000.,
+            'mean_wait_ms': self.total_wait / self.count * 1000. if self.count else 0,
+            'max_wait_ms': self.max_wait * 1000.,
+        }
+
+
+class I2CBus(object):
+    """ Manager of an I2C bus, shared by all its users.
+
+    The instance of a given bus is obtained with :py:meth:`shared`. Transactions are
+    serialized, and the ones failing with an IOError are retried after an exponentially
+    increasing delay. Sequences of transactions which must not be interleaved with other ones
+    (e.g. a command followed by a read) are grouped with :py:meth:`transaction`.
+
+    Timing statistics (duration and time spent waiting for the bus) are kept per device
+    address and transaction type.
+    """
+    RETRIES = 3
+    BACKOFF = 0.002
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, bus_number):
+        # import here so that the module can be loaded on systems without smbus (e.g. simulation)
+        import smbus
+
+        self.bus_number = bus_number
+        self._log = logging.getLogger('%s(%d)' % (self.__class__.__name__, bus_number))
+        self._bus = smbus.SMBus(bus_number)
+        self._lock = threading.RLock()
+        self._stats = {}
+
+    @classmethod
+    def shared(cls, bus_number=None):
+        """ Returns the manager of a bus, creating it if needed.
+
+        :param int bus_number: the bus number (default: the one of the GPIO header)
+        :rtype: I2CBus
+        """
+        if bus_number is None:
+            bus_number = default_bus_number()
+        with cls._instances_lock:
+            try:
+                return cls._instances[bus_number]
+            except KeyError:
+                bus = cls._instances[bus_number] = cls(bus_number)
+                return bus
+
+    @classmethod
+    def all_stats(cls):
+        """ Returns the statistics of all the buses in use.
+
+        :rtype: list of dict
+        """
+        with cls._instances_lock:
+            buses = cls._instances.values()
+        return [bus.stats() for bus in buses]
+
+    @contextmanager
+    def transaction(self):
+        """ Context manager giving an exclusive access to the bus for a sequence of transactions.
+        """
+        with self._lock:
+            yield self
+
+    def _execute(self, kind, addr, fn, *args):
+        requested = time.time()
+        with self._lock:
+            start = time.time()
+            timings = timing.current()
+            if timings:
+                timings.add(timing.BUS_WAIT, start - requested)
+            retries = 0
+            failed = True
+            try:
+                while True:
+                    try:
+                        result = fn(*args)
+                        failed = False
+                        return result
+                    except IOError as e:
+                        if retries == self.RETRIES:
+                            raise
+                        self._log.warn('%s error on 0x%.2x (%s) - retrying', kind, addr, e)
+                        time.sleep(self.BACKOFF * 2 ** retries)
+                        retries += 1
+            finally:
+                stats = self._stats.setdefault((addr, kind), _TransactionStats())
+                stats.record(time.time() - start, start - requested, retries, failed)
+
+    def write_byte(self, addr, byte):
+        return self._execute('write', addr, self._bus.write_byte, addr, byte)
+
+    def write_bytes(self, addr, data):
+        """ Writes a sequence of bytes, merged in a single transaction.
+        """
+        if len(data) == 1:
+            return self.write_byte(addr, data[0])
+        return self._execute('write', addr, self._bus.write_i2c_block_data, addr, data[0], list(data[1:]))
+
+    def read_byte(self, addr):
+        return self._execute('read', addr, self._bus.read_byte, addr)
+
+    def read_i2c_block_data(self, addr, cmd):
+        return self._execute('read', addr, self._bus.read_i2c_block_data, addr, cmd)
+
+    def stats(self):
+        """ Returns the transactions statistics of the bus.
+
+        :rtype: dict
+        """
+        with self._lock:
+            items = [(key, stats.as_dict()) for key, stats in self._stats.iteritems()]
+        return {
+            'bus': self.bus_number,
+            'transactions': [
+                dict(stats, addr='0x%.2x' % addr, type=kind)
+                for (addr, kind), stats in sorted(items)
+            ]
+        }
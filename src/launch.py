@@ -10,7 +10,9 @@ import logging
 import sys
 
 from webapp import DemoColorApp
-from controller import DemonstratorController
+from devices import DeviceRegistry
+from logsupport import AsyncLogging
+import controller
 
 _CONFIG_FILE_NAME = "demo-color.cfg"
 
@@ -34,6 +36,7 @@ if __name__ == '__main__':
             '-p', '--port',
             help='HTTP server listening port',
             dest='listen_port',
+            type=int,
             default=8080)
         parser.add_argument(
             '-D', '--debug',
@@ -50,6 +53,22 @@ if __name__ == '__main__':
             help='simulates hardware',
             dest='simulation',
             action='store_true')
+        parser.add_argument(
+            '--record',
+            help='records the hardware trace to the given file',
+            dest='record',
+            default=None)
+        parser.add_argument(
+            '--replay',
+            help='replays the given hardware trace file instead of using the hardware',
+            dest='replay',
+            default=None)
+        parser.add_argument(
+            '--log-buffer',
+            help='number of log records kept in memory',
+            dest='log_buffer',
+            type=int,
+            default=500)
 
         cli_args = parser.parse_args()
 
@@ -58,10 +77,18 @@ if __name__ == '__main__':
 
         log.info("command line arguments : %s", cli_args)
 
-        ctrl = DemonstratorController(debug=cli_args.debug, simulation=cli_args.simulation, cfg_dir=cli_args.cfg_dir)
-
-        app = DemoColorApp(ctrl, debug=cli_args.debug)
-        app.start(listen_port=cli_args.listen_port)
+        async_logging = AsyncLogging(capacity=cli_args.log_buffer)
+        async_logging.start()
+        try:
+            controller.set_simulation_mode(cli_args.simulation, record=cli_args.record, replay=cli_args.replay)
+            devices = DeviceRegistry(debug=cli_args.debug, simulation=cli_args.simulation, cfg_dir=cli_args.cfg_dir)
+
+            app = DemoColorApp(devices, debug=cli_args.debug, log_buffer=async_logging.ring_buffer)
+            app.start(listen_port=cli_args.listen_port)
+        finally:
+            controller.release_gpio()
+            controller.stop_recording()
+            async_logging.stop()
 
     except Exception as e:
         log.exception('unexpected error - aborting')
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Load test of the demonstrator web application.
+
+Simulated clients send requests in a loop, picked at random in the mix of the tested scenario,
+for a given duration. The throughput, the latency percentiles and the server IOLoop lag are
+reported per scenario as JSON. The clients random generators are seeded, so that runs with the
+same settings send the same requests.
+
+Unless the URL of a running server is given, the application is started with simulated hardware
+for the time of the test. Its configuration is then made of the distributed system settings and
+of arbitrary calibration levels, unless a configuration directory is given.
+"""
+
+__author__ = 'Eric Pascual (for POBOT)'
+
+import os
+import sys
+import time
+import json
+import random
+import signal
+import logging
+import subprocess
+import tempfile
+import shutil
+import Cookie
+
+from tornado.ioloop import IOLoop
+from tornado.httpclient import AsyncHTTPClient
+from tornado import gen
+
+from loopmonitor import percentile
+from configuration import SystemConfiguration, CalibrationConfiguration
+
+_here = os.path.dirname(os.path.abspath(__file__))
+_dist_cfg_dir = os.path.join(_here, '..', 'dist', 'etc', 'pobot-demo-color')
+
+# calibration levels used when the server configuration is not provided, so that the analyses succeed
+_TEST_CALIBRATION = {
+    'barrier': [0.3, 0.2],
+    'bw_detector': [0.2, 0.4],
+    'color_detector': {
+        'b': [0.2, 0.2, 0.2],
+        'w': [0.5, 0.4, 0.5]
+    }
+}
+
+# the requests mixes, as (weight, method, path) tuples
+SCENARIOS = {
+    'pages': [
+        (4, 'GET', '/'),
+        (2, 'GET', '/barrier'),
+        (2, 'GET', '/bw_detector'),
+        (2, 'GET', '/color_detector'),
+        (4, 'GET', '/js/demo-color.js'),
+        (4, 'GET', '/css/demo-color.css'),
+        (2, 'GET', '/js/jquery.min.js'),
+    ],
+    'barrier': [
+        (1, 'GET', '/barrier/analyze'),
+    ],
+    'bw_detector': [
+        (1, 'GET', '/bw_detector/analyze'),
+    ],
+    'color_detector': [
+        (8, 'GET', '/color_detector/sample'),
+        (4, 'GET', '/color_detector/analyze?r=0.3&g=0.25&b=0.3'),
+        (2, 'GET', '/color_detector/status'),
+        (2, 'POST', '/color_detector/light/0'),
+        (1, 'GET', '/color_detector/cycle'),
+    ],
+    'mixed': [
+        (6, 'GET', '/barrier/analyze'),
+        (6, 'GET', '/bw_detector/analyze'),
+        (4, 'GET', '/color_detector/sample'),
+        (1, 'GET', '/color_detector/cycle'),
+        (2, 'GET', '/sensors/sample'),
+        (1, 'GET', '/health'),
+        (1, 'GET', '/'),
+        (2, 'GET', '/js/demo-color.js'),
+    ],
+}
+
+DEMONSTRATORS = ('barrier', 'bw_detector', 'color_detector')
+
+
+class ScenarioResults(object):
+    """ The replies statistics of a scenario run.
+    """
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.endpoints = {}
+
+    def add(self, path, code, latency):
+        self.latencies.append(latency)
+        self.statuses[code] = self.statuses.get(code, 0) + 1
+        self.endpoints.setdefault(path, []).append(latency)
+
+    @staticmethod
+    def _latency_stats(latencies):
+        latencies = sorted(latencies)
+        return dict(
+            [('p%d_ms' % pct, percentile(latencies, pct) * 1000.) for pct in (50, 90, 99)],
+            mean_ms=sum(latencies) / len(latencies) * 1000.,
+            max_ms=latencies[-1] * 1000.
+        ) if latencies else {}
+
+    def as_dict(self, elapsed):
+        errors = sum(count for code, count in self.statuses.iteritems() if code >= 500)
+        return {
+            'requests': len(self.latencies),
+            'errors': errors,
+            'throughput_rps': len(self.latencies) / elapsed,
+            'statuses': dict((str(code), count) for code, count in self.statuses.iteritems()),
+            'latency': self._latency_stats(self.latencies),
+            'endpoints': dict(
+                (path, dict(self._latency_stats(latencies), requests=len(latencies)))
+                for path, latencies in self.endpoints.iteritems()
+            ),
+        }
+
+
+class LoadTest(object):
+    def __init__(self, base_url, clients=10, duration=10., think_time=0., seed=0):
+        """
+        :param str base_url: the URL of the tested server
+        :param int clients: the number of simulated clients
+        :param float duration: the duration (in seconds) of each scenario
+        :param float think_time: the mean pause (in seconds) of the clients between requests
+        :param int seed: the seed of the clients random generators
+        """
+        self._log = logging.getLogger(self.__class__.__name__)
+        self.base_url = base_url.rstrip('/')
+        self.clients = clients
+        self.duration = duration
+        self.think_time = think_time
+        self.seed = seed
+        self._http = AsyncHTTPClient(force_instance=True, max_clients=clients)
+
+    def _fetch(self, path, method='GET', cookie=None):
+        return self._http.fetch(
+            self.base_url + path,
+            method=method,
+            body='' if method == 'POST' else None,
+            headers={'Cookie': cookie} if cookie else None,
+            request_timeout=30,
+            raise_error=False
+        )
+
+    @gen.coroutine
+    def wait_ready(self, timeout=30.):
+        """ Waits for the server devices to be ready.
+
+        :raise RuntimeError: if they are not ready in time
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            response = yield self._fetch('/health')
+            if response.code == 200:
+                return
+            yield gen.sleep(0.2)
+        raise RuntimeError('server not ready after %ds' % timeout)
+
+    @gen.coroutine
+    def _client(self, rnd, mix, deadline, results):
+        requests = [(method, path) for weight, method, path in mix for _ in range(weight)]
+        cookie = None
+        while time.time() < deadline:
+            method, path = rnd.choice(requests)
+            start = time.time()
+            response = yield self._fetch(path, method, cookie)
+            results.add(path, response.code, time.time() - start)
+
+            if 'Set-Cookie' in response.headers:
+                cookies = Cookie.SimpleCookie(response.headers['Set-Cookie'])
+                cookie = '; '.join('%s=%s' % (name, morsel.value) for name, morsel in cookies.iteritems())
+            if self.think_time:
+                yield gen.sleep(rnd.uniform(0.5, 1.5) * self.think_time)
+
+        # release the leases, so that the next scenario starts in the same conditions
+        if cookie:
+            for demonstrator in DEMONSTRATORS:
+                if any(path.startswith('/' + demonstrator + '/') for _, _, path in mix):
+                    yield self._fetch('/%s/lease' % demonstrator, 'DELETE', cookie)
+
+    @gen.coroutine
+    def run_scenario(self, name):
+        """ Runs a scenario.
+
+        :param str name: the scenario name (see SCENARIOS)
+        :return: the scenario statistics
+        :rtype: dict
+        """
+        self._log.info('running scenario "%s" with %d clients for %.1fs', name, self.clients, self.duration)
+        mix = SCENARIOS[name]
+        results = ScenarioResults()
+        start = time.time()
+        yield [
+            self._client(random.Random('%s-%s-%d' % (self.seed, name, i)), mix, start + self.duration, results)
+            for i in range(self.clients)
+        ]
+        elapsed = time.time() - start
+
+        reply = yield self._fetch('/health?lag_since=%f' % start)
+        stats = results.as_dict(elapsed)
+        stats['ioloop_lag'] = json.loads(reply.body)['ioloop'] if reply.code in (200, 503) else None
+        self._log.info(
+            '%d requests, %.1f req/s, p99 %.1fms',
+            stats['requests'], stats['throughput_rps'], stats['latency'].get('p99_ms', 0)
+        )
+        raise gen.Return(stats)
+
+    @gen.coroutine
+    def run(self, scenarios):
+        yield self.wait_ready()
+        results = {}
+        for name in scenarios:
+            results[name] = yield self.run_scenario(name)
+        raise gen.Return({
+            'settings': {
+                'clients': self.clients,
+                'duration': self.duration,
+                'think_time': self.think_time,
+                'seed': self.seed
+            },
+            'scenarios': results
+        })
+
+
+def make_test_configuration():
+    """ Creates a temporary configuration directory, with the distributed system settings
+    and the test calibration levels. The samples log is written in it too.
+
+    :return: the directory path
+    :rtype: str
+    """
+    cfg_dir = tempfile.mkdtemp(prefix='loadtest-')
+    with open(os.path.join(_dist_cfg_dir, SystemConfiguration.CONFIG_FILE_NAME)) as fp:
+        system_cfg = json.load(fp)
+    system_cfg['samples_dir'] = cfg_dir
+    with open(os.path.join(cfg_dir, SystemConfiguration.CONFIG_FILE_NAME), 'wt') as fp:
+        json.dump(system_cfg, fp, indent=4)
+    with open(os.path.join(cfg_dir, CalibrationConfiguration.CONFIG_FILE_NAME), 'wt') as fp:
+        json.dump(_TEST_CALIBRATION, fp, indent=4)
+    return cfg_dir
+
+
+def start_server(port, cfg_dir=None, log_path=os.devnull):
+    """ Starts the application with simulated hardware, in a separate process.
+
+    :rtype: subprocess.Popen
+    """
+    args = [sys.executable, os.path.join(_here, 'launch.py'), '-S', '-p', str(port)]
+    if cfg_dir:
+        args += ['-c', cfg_dir]
+    log_file = open(log_path, 'w')
+    return subprocess.Popen(args, cwd=_here, stdout=log_file, stderr=subprocess.STDOUT)
+
+
+def stop_server(server, timeout=10):
+    """ Stops the server process, killing it if it does not terminate in time.
+    """
+    server.send_signal(signal.SIGINT)
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        deadline = time.time() + timeout
+        while server.poll() is None and time.time() < deadline:
+            time.sleep(0.1)
+        if server.poll() is not None:
+            return
+        logging.getLogger('loadtest').warning('server not stopped, sending signal %d', sig)
+        server.send_signal(sig)
+    server.wait()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    logging.basicConfig(
+        format="%(asctime)s.%(msecs).3d [%(levelname).1s] %(name)s > %(message)s",
+        datefmt='%H:%M:%S'
+    )
+
+    log = logging.getLogger()
+    log.setLevel(logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        'scenarios',
+        help='the scenarios to be run (%s)' % ', '.join(sorted(SCENARIOS)),
+        nargs='*',
+        default=['pages', 'barrier', 'bw_detector', 'color_detector', 'mixed'])
+    parser.add_argument(
+        '-n', '--clients',
+        help='number of simulated clients',
+        dest='clients',
+        type=int,
+        default=10)
+    parser.add_argument(
+        '-d', '--duration',
+        help='duration of each scenario (in seconds)',
+        dest='duration',
+        type=float,
+        default=10.)
+    parser.add_argument(
+        '-t', '--think-time',
+        help='mean pause of the clients between requests (in seconds)',
+        dest='think_time',
+        type=float,
+        default=0.)
+    parser.add_argument(
+        '--seed',
+        help='seed of the clients random generators',
+        dest='seed',
+        type=int,
+        default=0)
+    parser.add_argument(
+        '-u', '--url',
+        help='URL of an already running server to be tested',
+        dest='url',
+        default=None)
+    parser.add_argument(
+        '-p', '--port',
+        help='listening port of the started server',
+        dest='port',
+        type=int,
+        default=8090)
+    parser.add_argument(
+        '-c', '--cfgdir',
+        help='configuration files directory path of the started server',
+        dest='cfg_dir',
+        default=None)
+    parser.add_argument(
+        '--server-log',
+        help='file the started server output is written to',
+        dest='server_log',
+        default=os.devnull)
+    parser.add_argument(
+        '-o', '--output',
+        help='file the JSON results are written to (default: stdout)',
+        dest='output',
+        default=None)
+
+    cli_args = parser.parse_args()
+
+    unknown = [name for name in cli_args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error('unknown scenario(s) : %s' % ', '.join(unknown))
+
+    server = None
+    test_cfg_dir = None
+    if not cli_args.url:
+        cfg_dir = cli_args.cfg_dir
+        if not cfg_dir:
+            cfg_dir = test_cfg_dir = make_test_configuration()
+        server = start_server(cli_args.port, cfg_dir=cfg_dir, log_path=cli_args.server_log)
+    try:
+        test = LoadTest(
+            cli_args.url or 'http://localhost:%d' % cli_args.port,
+            clients=cli_args.clients,
+            duration=cli_args.duration,
+            think_time=cli_args.think_time,
+            seed=cli_args.seed
+        )
+        results = IOLoop.current().run_sync(lambda: test.run(cli_args.scenarios))
+    finally:
+        if server:
+            stop_server(server)
+        if test_cfg_dir:
+            shutil.rmtree(test_cfg_dir)
+
+    output = json.dumps(results, indent=4, sort_keys=True)
+    if cli_args.output:
+        with open(cli_args.output, 'wt') as fp:
+            fp.write(output + '\n')
+    else:
+        print(output)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Non-blocking logging.
+
+Log records are queued by the logging calls, with their message already rendered, and
+formatted and written by a background thread, so that the latency of the log output (e.g. a
+file on a SD card) is not paid by the code which logs. The most recent records are kept in memory, for being consulted remotely.
+"""
+
+__author__ = 'Eric Pascual'
+
+import logging
+import threading
+import Queue
+import collections
+
+
+class QueueHandler(logging.Handler):
+    """ Handler queuing the records for the writer thread.
+
+    Records are dropped if the queue is full, since blocking the caller is what we try
+    to avoid. The count of dropped records is kept, and reported when logging is stopped.
+    """
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+
+    def prepare(self, record):
+        """ Renders the record message, so that its arguments are not rendered later, when
+        they may have changed, and that the traceback of its exception is not kept alive.
+        """
+        message = self.format(record)
+        record.msg = record.message = message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            self.dropped += 1
+
+
+class QueueListener(object):
+    """ The writer thread, dispatching the queued records to the output handlers.
+    """
+    def __init__(self, queue, handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self._thread = threading.Thread(target=self._run, name='log-writer')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """ Stops the thread after the already queued records have been written.
+        """
+        if self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+
+class RingBufferHandler(logging.Handler):
+    """ Handler keeping the most recent records in memory.
+    """
+    def __init__(self, capacity=500):
+        logging.Handler.__init__(self)
+        self._records = collections.deque(maxlen=capacity)
+
+    def emit(self, record):
+        self._records.append((
+            record.created,
+            record.levelno,
+            record.name,
+            self.format(record)
+        ))
+
+    def records(self, level=logging.NOTSET, limit=None):
+        """ Returns the kept records, oldest first.
+
+        :param int level: the minimal level of the returned records
+        :param int limit: the maximum number of returned records (the most recent ones are kept)
+        :return: the records as dictionaries
+        :rtype: list of dict
+        """
+        result = [
+            {"time": created, "level": logging.getLevelName(levelno), "name": name, "message": message}
+            for created, levelno, name, message in list(self._records)
+            if levelno >= level
+        ]
+        return result[-limit:] if limit else result
+
+
+class AsyncLogging(object):
+    """ Moves the output of the root logger handlers to a writer thread.
+
+    The root logger handlers are replaced by a queue handler, and are served by the writer
+    thread, together with a ring buffer keeping the most recent records.
+    """
+    def __init__(self, capacity=500, queue_size=10000):
+        """
+        :param int capacity: the number of records kept in memory
+        :param int queue_size: the maximum number of records waiting for being written
+        """
+        root = logging.getLogger()
+        queue = Queue.Queue(queue_size)
+
+        self.ring_buffer = RingBufferHandler(capacity)
+        self._handlers = root.handlers[:]
+
+        self._queue_handler = QueueHandler(queue)
+        self._listener = QueueListener(queue, self._handlers + [self.ring_buffer])
+
+        for handler in self._handlers:
+            root.removeHandler(handler)
+        root.addHandler(self._queue_handler)
+
+    @property
+    def dropped(self):
+        return self._queue_handler.dropped
+
+    def start(self):
+        self._listener.start()
+
+    def stop(self):
+        """ Flushes the pending records, and restores the direct output to the handlers.
+        """
+        root = logging.getLogger()
+        root.removeHandler(self._queue_handler)
+        self._listener.stop()
+        for handler in self._handlers:
+            root.addHandler(handler)
+        if self.dropped:
+            root.warn('%d log records dropped', self.dropped)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Monitoring of the IOLoop responsiveness.
+
+The IOLoop lag is the delay with which the callbacks are run after they are due. It grows
+when some code blocks the IOLoop thread, or when the server is overloaded, and is thus a direct
+measure of the latency added to all the requests.
+"""
+
+__author__ = 'Eric Pascual'
+
+import time
+import collections
+
+from tornado.ioloop import IOLoop
+
+
+def percentile(values, pct):
+    """ Returns a percentile of sorted values, by the nearest rank method.
+
+    :param list values: the values, in ascending order
+    :param float pct: the percentile (in [0, 100])
+    """
+    if not values:
+        return None
+    rank = int(round(pct / 100. * (len(values) - 1)))
+    return values[rank]
+
+
+class LoopLagMonitor(object):
+    """ Measures the IOLoop lag with a callback scheduled at a fixed interval.
+
+    The measures are kept with their time for a bounded number of intervals (5 minutes with the
+    default settings), so that statistics can be obtained for a given period. They are made and
+    consulted in the IOLoop thread.
+    """
+    def __init__(self, interval=0.1, capacity=3000, io_loop=None):
+        """
+        :param float interval: the measures interval (in seconds)
+        :param int capacity: the number of measures kept
+        :param io_loop: the monitored IOLoop (default: the current one when started)
+        """
+        self.interval = interval
+        self._io_loop = io_loop
+        self._lags = collections.deque(maxlen=capacity)
+        self._due = None
+        self._timeout = None
+
+    def start(self):
+        if not self._io_loop:
+            self._io_loop = IOLoop.current()
+        self._schedule()
+
+    def stop(self):
+        if self._timeout:
+            self._io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+
+    def _schedule(self):
+        self._due = self._io_loop.time() + self.interval
+        self._timeout = self._io_loop.call_at(self._due, self._measure)
+
+    def _measure(self):
+        self._lags.append((time.time(), self._io_loop.time() - self._due))
+        self._schedule()
+
+    def stats(self, since=None):
+        """ Returns the lag statistics (in milliseconds).
+
+        :param float since: the time (in seconds since the epoch) of the oldest measure taken
+            into account (default: all the kept measures)
+        :rtype: dict
+        """
+        window = [lag for t, lag in self._lags if since is None or t >= since]
+        if not window:
+            return {'samples': 0}
+        lags = sorted(window)
+        return {
+            'samples': len(lags),
+            'last_ms': window[-1] * 1000.,
+            'mean_ms': sum(lags) / len(lags) * 1000.,
+            'p99_ms': percentile(lags, 99) * 1000.,
+            'max_ms': lags[-1] * 1000.,
+        }
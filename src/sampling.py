@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Sensor sampling helpers.
+"""
+
+__author__ = 'Eric Pascual'
+
+import time
+import math
+
+import timing
+
+# the time source, replaced by a virtual clock when replaying a hardware trace
+clock = time
+
+
+class CachingReader(object):
+    """ ADC front-end sharing recent readings between the clients of a channel.
+
+    A read issued within the freshness window following a conversion of the same channel
+    returns its result directly, so that the bus load stays the same whatever the number of
+    clients polling a given sensor. The reads are all made by the device hardware worker, and
+    are thus never concurrent.
+
+    Since the ambient light of a sensor changes as soon as its light source is switched, the
+    controller must call :py:meth:`invalidate` for its channel after each light change so that
+    no reading taken before it is served afterwards.
+
+    The freshness is measured with the real clock, since it relates to the pace of the clients,
+    which the replay clock does not follow between the replayed readings.
+    """
+    def __init__(self, adc, freshness=0.2):
+        """
+        :param adc: the ADC driver, providing the readVoltages(channels) method
+        :param float freshness: the delay (in seconds) during which a reading is shared
+        """
+        self._adc = adc
+        self.freshness = freshness
+        self._last = {}
+
+    def read_voltage(self, channel, fresh=False):
+        """ Returns the voltage of a given ADC channel, using the last reading if recent enough.
+        """
+        return self.read_voltages([channel], fresh)[0]
+
+    def read_voltages(self, channels, fresh=False):
+        """ Returns the voltages of a list of ADC channels, in the same order.
+
+        The channels which cannot be served from the recent readings are converted in a
+        single pass of the ADC driver.
+
+        :param bool fresh: if True, readings obtained before the call are not used
+        """
+        now = time.time()
+        values = {}
+        for channel in set(channels):
+            last = self._last.get(channel)
+            if not fresh and last and now - last[0] <= self.freshness:
+                values[channel] = last[1]
+
+        to_read = sorted(set(channels) - set(values))
+        if to_read:
+            with timing.span(timing.ADC):
+                voltages = self._adc.readVoltages(to_read)
+            now = time.time()
+            for channel, value in zip(to_read, voltages):
+                self._last[channel] = (now, value)
+                values[channel] = value
+
+        return [values[channel] for channel in channels]
+
+    def invalidate(self, channel=None):
+        """ Discards the recent readings, either of a given channel or of all of them.
+        """
+        if channel is None:
+            self._last.clear()
+        else:
+            self._last.pop(channel, None)
+
+
+class FlickerFilter(object):
+    """ ADC front-end rejecting the flicker of the ambient light powered by the mains.
+
+    The light of fluorescent or LED lamps carries a ripple at twice the mains frequency, which
+    fast conversions pick up. Each read is made of N passes of the ADC driver (taps), spaced by
+    a whole number of ripple periods plus 1/N of it, and the readings are averaged. The taps thus
+    see the ripple at N phases evenly spread over its period, and this comb filter cancels its
+    harmonics up to the (N-1)th.
+
+    The spacing is the shortest one not shorter than the first pass, so that it adapts to the
+    conversion time (i.e. the ADC bit rate) and to the number of channels read.
+    """
+    def __init__(self, adc, mains_frequency=50, taps=4):
+        """
+        :param adc: the ADC driver, providing the readVoltages(channels) method
+        :param float mains_frequency: the mains frequency (in Hz)
+        :param int taps: the number of passes of a read (at least 2)
+        """
+        self._adc = adc
+        self.ripple_period = 1. / (2 * mains_frequency)
+        self.taps = max(taps, 2)
+
+    def readVoltages(self, channels):
+        # the first pass is timed with the real clock, since the replay clock jumps over the
+        # idle time preceding the first replayed reading
+        began = time.time()
+        sums = list(self._adc.readVoltages(channels))
+        elapsed = time.time() - began
+        start = clock.time() - elapsed
+        phase = 1. / self.taps
+        periods = math.ceil(max(elapsed / self.ripple_period - phase, 0))
+        spacing = (periods + phase) * self.ripple_period
+
+        for tap in range(1, self.taps):
+            clock.sleep(max(start + tap * spacing - clock.time(), 0))
+            for i, voltage in enumerate(self._adc.readVoltages(channels)):
+                sums[i] += voltage
+        return [s / self.taps for s in sums]
+
+    def readVoltage(self, channel):
+        return self.readVoltages([channel])[0]
+
+    def __getattr__(self, name):
+        return getattr(self._adc, name)
+
+
+def record_until_settled(read, start=None, tolerance=0.02, abs_tolerance=0.001, window=8, interval=0.05,
+                         timeout=5):
+    """ Samples a signal until it has settled, and returns the readings.
+
+    The signal is considered as settled when the means of the older and newer halves of the
+    last readings differ by less than the tolerance, i.e. when no drift stands out of the noise.
+
+    :param read: the function returning a reading of the signal
+    :param float start: the origin of the readings time (default: now), for instance the time
+        of the change the signal responds to
+    :param float tolerance: the tolerated drift, relative to the mean of the readings
+    :param float abs_tolerance: the minimal tolerated drift, so that readings close to zero
+        (e.g. in the dark) can settle too
+    :param int window: the number of readings the criterion is evaluated on
+    :param float interval: the delay (in seconds) between readings
+    :param float timeout: the maximum sampling duration (in seconds)
+    :return: the readings as (time, value) pairs, and whether the signal settled before the timeout
+    :rtype: tuple
+    """
+    half = max(window // 2, 1)
+    trace = []
+    start = start or clock.time()
+    deadline = clock.time() + timeout
+
+    while True:
+        value = read()
+        now = clock.time()
+        trace.append((now - start, value))
+        if len(trace) >= 2 * half:
+            older = [v for _, v in trace[-2 * half:-half]]
+            newer = [v for _, v in trace[-half:]]
+            drift = abs(sum(newer) - sum(older)) / half
+            if drift <= max(tolerance * abs(sum(older + newer) / (2 * half)), abs_tolerance):
+                return trace, True
+        if now >= deadline:
+            return trace, False
+        with timing.span(timing.SETTLE):
+            clock.sleep(interval)
+
+
+def sample_until_settled(read, tolerance=0.02, abs_tolerance=0.001, window=8, interval=0.05, timeout=5):
+    """ Samples a signal until it has settled (see :py:func:`record_until_settled`).
+
+    :return: the mean and the variance of the last readings, the time taken (in seconds), and
+        whether the signal settled before the timeout
+    :rtype: tuple
+    """
+    trace, settled = record_until_settled(
+        read, tolerance=tolerance, abs_tolerance=abs_tolerance, window=window, interval=interval,
+        timeout=timeout
+    )
+    readings = [v for _, v in trace[-window:]]
+    mean = sum(readings) / len(readings)
+    variance = sum((r - mean) ** 2 for r in readings) / len(readings)
+    return mean, variance, trace[-1][0], settled
+
+
+def fit_time_constant(trace, final):
+    """ Estimates the time constant of a first order step response.
+
+    The readings too close to the final value (i.e. within 10% of the step amplitude) are
+    ignored, since they are dominated by the noise.
+
+    :param list trace: the response readings, as (time since the step, value) pairs
+    :param float final: the settled value
+    :return: the time constant (in seconds), or None if the trace does not show a step response
+    """
+    amplitude = max(abs(v - final) for _, v in trace)
+    points = [(t, math.log(abs(v - final))) for t, v in trace if abs(v - final) > 0.1 * amplitude]
+    if len(points) < 3:
+        return None
+
+    n = len(points)
+    mean_t = sum(t for t, _ in points) / n
+    mean_l = sum(l for _, l in points) / n
+    var_t = sum((t - mean_t) ** 2 for t, _ in points)
+    if var_t == 0:
+        return None
+    slope = sum((t - mean_t) * (l - mean_l) for t, l in points) / var_t
+    return -1. / slope if slope < 0 else None
+
+
+def extrapolate_final(trace, tau):
+    """ Estimates the final value of a first order step response from its first readings.
+
+    With a known time constant, the response v(t) = vf + (v0 - vf).exp(-t/tau) is linear in the
+    initial and final values, which are thus obtained by a least squares fit.
+
+    :param list trace: the readings, as (time since the step, value) pairs
+    :param float tau: the response time constant (in seconds)
+    :return: the estimated final value
+    """
+    # v = vf.(1 - e) + v0.e
+    a = [(1 - math.exp(-t / tau), math.exp(-t / tau), v) for t, v in trace]
+    s11 = sum(x1 * x1 for x1, _, _ in a)
+    s12 = sum(x1 * x2 for x1, x2, _ in a)
+    s22 = sum(x2 * x2 for _, x2, _ in a)
+    s1v = sum(x1 * v for x1, _, v in a)
+    s2v = sum(x2 * v for _, x2, v in a)
+    det = s11 * s22 - s12 * s12
+    if abs(det) < 1e-12:
+        # the response is already settled (or the readings are taken at the same time)
+        return sum(v for _, _, v in a) / len(a)
+    return (s1v * s22 - s2v * s12) / det
+
+
+def demodulate(readings):
+    """ Demodulates the readings of a synchronous detection.
+
+    The readings are taken alternately with the light source off and on, starting and ending
+    with it off. Subtracting from each "on" reading the mean of the surrounding "off" ones removes
+    the ambient light contribution, including its slow drifts.
+
+    :param list readings: the readings, in acquisition order
+    :return: the mean and the variance of the light source contribution
+    :rtype: tuple
+    """
+    if len(readings) < 3 or not len(readings) % 2:
+        raise ValueError('invalid synchronous readings count (%d)' % len(readings))
+
+    diffs = [
+        readings[i] - (readings[i - 1] + readings[i + 1]) / 2.
+        for i in range(1, len(readings) - 1, 2)
+    ]
+    mean = sum(diffs) / len(diffs)
+    variance = sum((d - mean) ** 2 for d in diffs) / len(diffs)
+    return mean, variance
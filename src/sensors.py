@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Light sensors definitions.
+
+Sensors are defined as data in the system configuration. Each one is a LDR read on an ADC
+channel through a shunt resistor, optionally lit by a LED driven by a GPIO, and processed
+by a given type of analyzer.
+"""
+
+__author__ = 'Eric Pascual'
+
+# the detection is signaled when the current is below the threshold (e.g. optical barrier)
+ANALYZER_THRESHOLD = 'threshold'
+# black/white discrimination
+ANALYZER_BW = 'bw'
+# color analysis, based on R, G and B samples obtained with the BlinkM
+ANALYZER_COLOR = 'color'
+
+ANALYZERS = (None, ANALYZER_THRESHOLD, ANALYZER_BW, ANALYZER_COLOR)
+
+# names of the calibration references of the analyzers using two levels, in storage order
+REFERENCE_NAMES = {
+    ANALYZER_THRESHOLD: ('free', 'occupied'),
+    ANALYZER_BW: ('b', 'w'),
+}
+
+
+class Sensor(object):
+    def __init__(self, sensor_id, channel, shunt=10000, led_gpio=None, analyzer=None):
+        """
+        :param str sensor_id: the sensor identifier, also used as the key of its calibration data
+        :param int channel: the ADC channel (1 to 8)
+        :param float shunt: the shunt resistor value (in Ohms)
+        :param int led_gpio: the GPIO (board numbering) driving the LED lighting the sensor, if any
+        :param str analyzer: the type of analyzer processing the sensor readings (see ANALYZERS)
+        """
+        if not 1 <= channel <= 8:
+            raise ValueError('invalid ADC channel for sensor %s (%s)' % (sensor_id, channel))
+        if analyzer not in ANALYZERS:
+            raise ValueError('invalid analyzer for sensor %s (%s)' % (sensor_id, analyzer))
+
+        self.id = sensor_id
+        self.channel = channel
+        self.shunt = float(shunt)
+        self.led_gpio = led_gpio
+        self.analyzer = analyzer
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(
+            d['id'], d['channel'],
+            shunt=d.get('shunt', 10000),
+            led_gpio=d.get('led_gpio'),
+            analyzer=d.get('analyzer')
+        )
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'channel': self.channel,
+            'shunt': self.shunt,
+            'led_gpio': self.led_gpio,
+            'analyzer': self.analyzer
+        }
+
+    @property
+    def reference_names(self):
+        """ The names of the calibration references of the sensor analyzer, if it uses some.
+        """
+        return REFERENCE_NAMES.get(self.analyzer)
+
+    def current(self, voltage):
+        """ Converts a voltage read on the sensor shunt into the LDR current (in mA).
+        """
+        return voltage / self.shunt * 1000.
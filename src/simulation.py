@@ -4,28 +4,139 @@
 __author__ = 'Eric Pascual'
 
 import logging
+import threading
+import time
+import math
 from random import gauss
 
 
+class _Scene(object):
+    """ The light seen by the simulated LDRs.
+
+    The light level is the sum of the levels of the light sources (ambient light, LEDs,
+    BlinkM), and the LDRs follow its changes with a first order response, slower when the
+    light decreases than when it increases, as real ones do.
+
+    The scene is shared by all the simulated devices.
+    """
+    TAU_RISE = 0.15
+    TAU_FALL = 0.4
+
+    V_DARK = 1.
+    V_LIT = 4.2
+    NOISE = 0.01
+
+    AMBIENT = 0.3
+    # relative amplitude of the ambient light ripple (e.g. 0.2 under fluorescent lamps), and
+    # mains frequency
+    FLICKER = 0.
+    MAINS_FREQUENCY = 50
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sources = {'ambient': self.AMBIENT}
+        self._level_from = self._level_to = self.AMBIENT
+        self._since = time.time()
+
+    def _level_at(self, t):
+        tau = self.TAU_RISE if self._level_to > self._level_from else self.TAU_FALL
+        return self._level_to + (self._level_from - self._level_to) * math.exp(-(t - self._since) / tau)
+
+    def set_source(self, name, level):
+        with self._lock:
+            now = time.time()
+            self._level_from = self._level_at(now)
+            self._sources[name] = level
+            self._level_to = min(sum(self._sources.values()), 1.)
+            self._since = now
+
+    def voltage(self):
+        now = time.time()
+        with self._lock:
+            level = self._level_at(now)
+        if self.FLICKER:
+            level += self.AMBIENT * self.FLICKER * (abs(math.sin(2 * math.pi * self.MAINS_FREQUENCY * now)) * 2 - 4 / math.pi)
+        return gauss(self.V_DARK + (self.V_LIT - self.V_DARK) * level, self.NOISE)
+
+
+_scene = _Scene()
+
+
 class ADCPi(object):
     def __init__(self, address=0x68, address2=0x69, rate=18):
         self._log = logging.getLogger('ADCPi')
         self._log.info('creating with address=0x%.2x, address2=0x%.2x, rate=%d', address, address2, rate)
+        self.setBitRate(rate)
+
+    def setBitRate(self, rate):
+        self._log.debug('bit rate set to %d', rate)
+        self._lsb = 2.048 / (1 << rate) * 2.448579823702253
+
+    def setConversionTimeout(self, timeout):
+        pass
 
     def readVoltage(self, input_id):
-        return gauss(4.2, 0.1)
+        # quantized as a real conversion with the current bit rate
+        return round(_scene.voltage() / self._lsb) * self._lsb
+
+    def readVoltages(self, channels):
+        return [self.readVoltage(c) for c in channels]
 
 
 class BlinkM(object):
+    """ Simulated BlinkM, playing the light scripts made of "go to" and "fade to" RGB commands,
+    the latter being executed as the former.
+    """
+    SCRIPT_TICK = 1 / 30.
+    _COLOR_COMMANDS = (ord('n'), ord('c'))
+
     def __init__(self, bus=1, addr=0x09):
         self._log = logging.getLogger('BlinkM')
         self._log.info('created with bus=%d addr=0x%.2x', bus, addr)
+        self._scripts = {}
+        self._stop_player = None
 
     def go_to(self, r, g, b):
-        self._log.info('color changed to R=%d G=%d B=%d', r, g, b)
+        self._log.debug('color changed to R=%d G=%d B=%d', r, g, b)
+        _scene.set_source('blinkm', (r + g + b) / 765.)
 
     def reset(self):
-        self._log.info('reset')
+        self._log.debug('reset')
+        self.stop_script()
+
+    def write_script_line(self, script_number, line_number, duration, command, value1=0, value2=0, value3=0):
+        self._scripts.setdefault(script_number, {})[line_number] = (duration, command, (value1, value2, value3))
+
+    def set_script_length_and_repeats(self, script_number, length, repeats):
+        # the repeats count is superseded by the one given when playing the script
+        lines = self._scripts.get(script_number, {})
+        self._scripts[script_number] = dict((n, line) for n, line in lines.iteritems() if n < length)
+
+    def play_script(self, script_number, repeat=0, start_line=0):
+        self._log.debug('playing script %d', script_number)
+        self.stop_script()
+        lines = self._scripts.get(script_number, {})
+        lines = [lines[n] for n in sorted(lines) if n >= start_line]
+        self._stop_player = threading.Event()
+        player = threading.Thread(target=self._play, args=(lines, repeat, self._stop_player))
+        player.daemon = True
+        player.start()
+
+    def stop_script(self):
+        if self._stop_player:
+            self._stop_player.set()
+            self._stop_player = None
+
+    def _play(self, lines, repeat, stop):
+        played = 0
+        while lines and not stop.is_set() and (repeat == 0 or played < repeat):
+            for duration, command, args in lines:
+                if stop.is_set():
+                    return
+                if command in self._COLOR_COMMANDS:
+                    self.go_to(*args)
+                stop.wait(duration * self.SCRIPT_TICK)
+            played += 1
 
 
 class GPIO(object):
@@ -38,13 +149,14 @@ class GPIO(object):
         self._log = logging.getLogger('GPIO')
 
     def setmode(self, mode):
-        self._log.info('setting mode to "%s"' % mode)
+        self._log.debug('setting mode to "%s"', mode)
 
     def setup(self, pin, mode):
-        self._log.info('setup pin %d to mode "%s"', pin, mode)
+        self._log.debug('setup pin %d to mode "%s"', pin, mode)
 
     def output(self, pin, state):
-        self._log.info('setting pin %d to %d', pin, state)
+        self._log.debug('setting pin %d to %d', pin, state)
+        _scene.set_source('gpio%d' % pin, 0.5 if state else 0)
 
     def cleanup(self, ):
         self._log.info('cleanup')
\ No newline at end of file
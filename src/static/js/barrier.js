@@ -15,8 +15,8 @@ $(document).ready(function() {
     }
 
     function set_light_source(status) {
-        $.post(
-            document.location.href + "/light", {"status": status ? "1" : "0"}
+        DemoColor.client.post(
+            DemoColor.api_url("/light"), {"status": status ? "1" : "0"}
         ).done(function() {
             update_bulb(status);
             if (status) {
@@ -40,7 +40,7 @@ $(document).ready(function() {
         if (sampler) {
             $(".animated").fadeOut();
             update_meter(0);
-            clearInterval(sampler);
+            sampler.stop();
             sampler = null;
             $("button.exp-control").toggleClass('disabled');
             set_light_source(false);
@@ -48,8 +48,8 @@ $(document).ready(function() {
     }
 
     function get_sample(analyze_sample) {
-        $.getJSON(
-            document.location.href + (analyze_sample ? "/analyze" : "/sample")
+        return DemoColor.client.get_json(
+            DemoColor.api_url(analyze_sample ? "/analyze" : "/sample")
         ).done(function(data) {
             update_meter(data.current);
             if (analyze_sample) {
@@ -60,6 +60,11 @@ $(document).ready(function() {
                 }
             }
         }).fail(function(jqXHR, textStatus, errorThrown) {
+            if (jqXHR.status === 409 || jqXHR.status === 503) {
+                // demonstrator used by another client, and no result shared yet,
+                // or hardware still initializing : the sampling is retried by the client
+                return;
+            }
             jError(
                 "Erreur mesure : <br>" + errorThrown,
                 {
@@ -72,8 +77,8 @@ $(document).ready(function() {
 
     function activate_sampler() {
         if (!sampler) {
-            sampler = setInterval(function() {
-                get_sample(false);
+            sampler = DemoColor.client.poll(function() {
+                return get_sample(false);
             }, 1000);
             $("button.exp-control").toggleClass('disabled');
         }
@@ -81,12 +86,12 @@ $(document).ready(function() {
 
     function activate_analyzer() {
         if (!sampler) {
-            $.getJSON(document.location.href + "/status")
+            DemoColor.client.get_json(DemoColor.api_url("/status"))
             .done(function(result) {
                 if (result.calibrated) {
                     set_light_source(true);
-                    sampler = setInterval(function () {
-                        get_sample(true);
+                    sampler = DemoColor.client.poll(function () {
+                        return get_sample(true);
                     }, 1000);
                     $("button.exp-control").toggleClass('disabled');
                 } else {
@@ -117,7 +122,8 @@ $(document).ready(function() {
     $(window).unload(function() {
         stop_sampling();
         // ensure light is turned off
-        set_light_source(false);
+        DemoColor.send_now(DemoColor.api_url("/light"), "POST", {"status": "0"});
+        DemoColor.send_now(DemoColor.api_url("/lease"), "DELETE");
     });
 
     update_meter(0);
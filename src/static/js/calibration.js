@@ -1,10 +1,7 @@
 $(document).ready(function() {
     'use strict';
 
-    var current_free = 0, current_occupied = 0;
-    var current_white = 0, current_black = 0;
     var color_done_w = false, color_done_b = false;
-    var current_r, current_g, current_b;
 
     var calibration_data = {
         barrier: [0, 0],
@@ -31,7 +28,7 @@ $(document).ready(function() {
 
     set_calibrated($("div.calibration-status"), false);
 
-    $.getJSON(document.location.href + "/data").done(
+    DemoColor.client.get_json(DemoColor.api_url("/data")).done(
         function(data) {
             calibration_data = data;
 
@@ -45,11 +42,6 @@ $(document).ready(function() {
                     $(parent_id + " span#value").text(value.toFixed(3));
                     $(parent_id + " span#level").removeClass("invisible");
                     $(parent_id + " span#status-led").addClass("done");
-                    if (step == 0) {
-                        current_free = value;
-                    } else {
-                        current_occupied = value;
-                    }
                     done++;
                 }
             }
@@ -64,11 +56,6 @@ $(document).ready(function() {
                     $(parent_id + " span#value").text(value.toFixed(3));
                     $(parent_id + " span#level").removeClass("invisible");
                     $(parent_id + " span#status-led").addClass("done");
-                    if (step == 0) {
-                        current_black = value;
-                    } else {
-                        current_white = value;
-                    }
                     done++;
                 }
             }
@@ -144,7 +131,77 @@ $(document).ready(function() {
         jError(msg, {ShowOverlay: false});
     }
 
-    function calibrate_barrier(occupied) {
+    var jobs_url = DemoColor.api_url("/jobs");
+
+    // Runs a calibration job on the server (see calibration.py), or follows an already
+    // running one, and returns a promise resolved with its final state. The step callback
+    // is given the steps of the job as they are done.
+    //
+    // The job goes on even if the page is closed meanwhile, and its state is followed by
+    // long polling, the server replying as soon as it has changed since the version we know.
+    function run_job(sensor, reference, on_step, job) {
+        var deferred = $.Deferred();
+        var reported = 0;
+
+        function update(state) {
+            while (reported < state.steps.length && state.steps[reported].state === "done") {
+                on_step(state.steps[reported]);
+                reported++;
+            }
+        }
+
+        function follow(state) {
+            var version = -1;
+            DemoColor.client.poll(function() {
+                return DemoColor.client.get_json(jobs_url + "/" + state.id, {version: version}).then(
+                    function(state) {
+                        version = state.version;
+                        update(state);
+                        if (state.state === "running") {
+                            return 0;
+                        }
+                        if (state.state === "done") {
+                            deferred.resolve(state);
+                        } else {
+                            deferred.reject(null, "error", state.error);
+                        }
+                        return false;
+                    },
+                    function(jqXHR, textStatus, errorThrown) {
+                        if (!jqXHR || jqXHR.status !== 503) {
+                            // not retried by the client : the job is not followed any more
+                            deferred.reject(jqXHR, textStatus, errorThrown);
+                        }
+                        return $.Deferred().reject(jqXHR, textStatus, errorThrown);
+                    }
+                );
+            }, 0);
+        }
+
+        if (job) {
+            follow(job);
+        } else {
+            DemoColor.client.request({
+                url: jobs_url,
+                type: "POST",
+                dataType: "json",
+                data: {sensor: sensor, reference: reference}
+            }).done(follow).fail(deferred.reject);
+        }
+        return deferred.promise();
+    }
+
+    function show_step_value(div_step, current) {
+        $(div_step + "span#value").text(current.toFixed(3));
+        $(div_step + "span#level").removeClass("invisible");
+        $(div_step + "span.status").addClass("done");
+    }
+
+    function job_failed(jqXHR, textStatus, errorThrown) {
+        error("Erreur traitement : <br>" + errorThrown);
+    }
+
+    function calibrate_barrier(occupied, job) {
         var div = "div#barrier_" + occupied + " ";
 
         calibration_started("Calibrage barrière lumineuse démarré.");
@@ -153,45 +210,22 @@ $(document).ready(function() {
         $(div + "li span.status").removeClass("done");
         $(div + "span#level").addClass("invisible");
 
-        $.getJSON(document.location.href + "/barrier/sample").then(
-            function(result) {
-                var current = result.current;
-                var div_step = div + "li#step-1 ";
-
-                $(div_step + "span#value").text(current.toFixed(3));
-                $(div_step + "span#level").removeClass("invisible");
-                $(div_step + "span.status").addClass("done");
-
-                if (occupied === "1") {
-                    current_occupied = current;
-                } else {
-                    current_free = current;
-                }
-
-                if (current_free !== 0 && current_occupied !== 0) {
-                    return $.post(
-                        document.location.href + "/barrier/store",
-                        {"free": current_free, "occupied": current_occupied}
-                    );
-                }
-            }
-        ).done(
-            function(result) {
-                if (current_free !== 0 && current_occupied !== 0) {
-                    set_calibrated($("div#barrier div.calibration-status"), true);
-                }
-                success("Calibrage terminé.");
-            }
-        ).fail(
-            function(jqXHR, textStatus, errorThrown) {
-                error("Erreur traitement : <br>" + errorThrown);
+        run_job("barrier", occupied === "1" ? "occupied" : "free", function(step) {
+            show_step_value(div + "li#step-1 ", step.value.current);
+        }, job).done(function(job) {
+            // the references are stored once both levels are known
+            if (job.references) {
+                set_calibrated($("div#barrier div.calibration-status"), true);
             }
+            success("Calibrage terminé.");
+        }).fail(
+            job_failed
         ).always(
             calibration_ended
         );
     }
 
-    function calibrate_bw_detector(color) {
+    function calibrate_bw_detector(color, job) {
         var div = "div#bw_" + color + " ";
 
         calibration_started("Calibrage détecteur noir/blanc démarré.");
@@ -200,46 +234,25 @@ $(document).ready(function() {
         $(div +"li span.status").removeClass("done");
         $(div + "li#step-1 span#level").addClass("invisible");
 
-        $.getJSON(document.location.href + "/bw_detector/sample").then(
-            function(result){
-                var current = result.current;
-                var div_step = div + "li#step-1 ";
-
-                $(div_step + "span#value").text(current.toFixed(3));
-                $(div_step + "span#level").removeClass("invisible");
-                $(div_step + "span.status").addClass("done");
-
-                if (color === 'w') {
-                    current_white = current;
-                } else {
-                    current_black = current;
-                }
-
-                if (current_black !== 0 && current_white !== 0) {
-                    return $.post(
-                        document.location.href + "/bw_detector/store",
-                        {"w" : current_white, "b" : current_black}
-                    );
-                }
-            }
-        ).done(
-            function() {
-                if (current_black !== 0 && current_white !== 0) {
-                    set_calibrated($("div#bw_detector div.calibration-status"), true);
-                }
-                success("Calibrage terminé.");
-            }
-        ).fail(
-            function(jqXHR, textStatus, errorThrown) {
-                error("Erreur traitement : <br>" + errorThrown);
+        run_job("bw_detector", color, function(step) {
+            show_step_value(div + "li#step-1 ", step.value.current);
+        }, job).done(function(job) {
+            // the references are stored once both levels are known
+            if (job.references) {
+                set_calibrated($("div#bw_detector div.calibration-status"), true);
             }
+            success("Calibrage terminé.");
+        }).fail(
+            job_failed
         ).always(
             calibration_ended
         );
     }
 
-    function calibrate_color_detector(w_or_b) {
+    function calibrate_color_detector(w_or_b, job) {
         var div = "div#" + (w_or_b == 'w' ? "white_balance" : "black_levels") + " ";
+        // the list items of the sampling steps
+        var STEP_ITEMS = {r: "li#step-1 ", g: "li#step-2 ", b: "li#step-3 "};
 
         calibration_started("Balance des blancs démarrée.");
 
@@ -247,50 +260,12 @@ $(document).ready(function() {
         $(div + "li span.status").removeClass("done");
         $(div + "span#level").addClass("invisible");
 
-        $.getJSON(
-            document.location.href + "/color_detector/sample",
-            {"color" : "r"}
-
-        ).then(function(result) {
-            current_r = result.current;
-            var div_step = div + "li#step-1 ";
-
-            $(div_step + "span#value").text(result.current.toFixed(3));
-            $(div_step + "span#level").removeClass("invisible");
-            $(div_step + "span.status").addClass("done");
-
-            return $.getJSON(
-                document.location.href + "/color_detector/sample",
-                {"color" : "g"}
-            );
-
-        }).then(function(result) {
-            var div_step = div + "li#step-2 ";
-
-            current_g = result.current;
-            $(div_step + "span#value").text(result.current.toFixed(3));
-            $(div_step + "span#level").removeClass("invisible");
-            $(div_step + "span.status").addClass("done");
-
-            return $.getJSON(
-                document.location.href + "/color_detector/sample",
-                {"color" : "b"}
-            );
-
-        }).then(function(result) {
-            var div_step = div + "li#step-3 ";
-
-            current_b = result.current;
-            $(div_step + "span#value").text(result.current.toFixed(3));
-            $(div_step + "span#level").removeClass("invisible");
-            $(div_step + "span.status").addClass("done");
-
-            return $.post(
-                document.location.href + "/color_detector/store/" + w_or_b,
-                {"r" : current_r, "g" : current_g, "b" : current_b}
-            );
-
-        }).done(function() {
+        // the white balance job also characterizes the LDR response, for the fast color analysis
+        run_job("color_detector", w_or_b, function(step) {
+            if (STEP_ITEMS[step.name]) {
+                show_step_value(div + STEP_ITEMS[step.name], step.value.current);
+            }
+        }, job).done(function(state) {
             if (w_or_b === 'w') {
                 color_done_w = true;
             } else {
@@ -299,16 +274,36 @@ $(document).ready(function() {
             if (color_done_w && color_done_b) {
                 set_calibrated($("div#color div.calibration-status"), true);
             }
-            success("Calibrage terminé.");
-
-        }).fail(function(jqXHR, textStatus, errorThrown) {
-            error("Erreur traitement : <br>" + errorThrown);
-
-        }).always(
+            // the levels are calibrated even if the LDR response could not be measured
+            var failed = $.grep(state.steps, function(step) { return step.state === "failed"; });
+            if (failed.length) {
+                notify("Calibrage terminé, mais la réponse du capteur n'a pas pu être mesurée : <br>" + failed[0].error);
+            } else {
+                success("Calibrage terminé.");
+            }
+        }).fail(
+            job_failed
+        ).always(
             calibration_ended
         );
     }
 
+    // follows the job started before the page was (re)loaded, if still running
+    DemoColor.client.get_json(jobs_url).done(function(reply) {
+        $.each(reply.jobs, function(i, job) {
+            if (job.state !== "running") {
+                return;
+            }
+            if (job.sensor === "barrier") {
+                calibrate_barrier(job.reference === "occupied" ? "1" : "0", job);
+            } else if (job.sensor === "bw_detector") {
+                calibrate_bw_detector(job.reference, job);
+            } else if (job.sensor === "color_detector") {
+                calibrate_color_detector(job.reference, job);
+            }
+        });
+    });
+
     $("div.panel-heading button").click(function(){
         $("div.panel-body").hide();
         $("div.panel-body", $(this).parents(".panel")).show();
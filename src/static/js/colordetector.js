@@ -5,8 +5,6 @@ $(document).ready(function() {
     var RED = 1;
     var GREEN = 2;
     var BLUE = 3;
-    var CYCLE_START = RED;
-    var CYCLE_END = BLUE;
 
     var LIGHT_COLOR_CODES = ['0', 'r', 'g', 'b']
     var COLOR_NAMES = ["off", "red", "green", "blue"];
@@ -26,9 +24,8 @@ $(document).ready(function() {
         $("div#decomp-blue")
     ];
 
-    var sampler_timer = null;
-    var analyzer_timer = null;
-    var stop_requested = false;
+    var sampler = null;
+    var analyzer = null;
 
     function update_meter(value) {
         measure.text(value.toFixed(3));
@@ -57,8 +54,8 @@ $(document).ready(function() {
     }
 
     function set_light_source(color_id) {
-        $.post(
-            document.location.href + "/light/" + LIGHT_COLOR_CODES[color_id]
+        DemoColor.client.post(
+            DemoColor.api_url("/light/" + LIGHT_COLOR_CODES[color_id])
 
         ).done(function() {
             update_bulb(color_id);
@@ -78,8 +75,15 @@ $(document).ready(function() {
     }
 
     function stop_sampling() {
-        if (sampler_timer || analyzer_timer) {
-            stop_requested = true;
+        if (sampler || analyzer) {
+            if (sampler) {
+                sampler.stop();
+                sampler = null;
+            }
+            if (analyzer) {
+                analyzer.stop();
+                analyzer = null;
+            }
 
             img_ball.attr("src", "/img/ball-none.png");
             bar_graphs_container.addClass("invisible");
@@ -90,27 +94,19 @@ $(document).ready(function() {
         }
     }
 
-    function get_sample(repeat) {
-        $.getJSON(
-            document.location.href + "/sample"
+    function get_sample() {
+        return DemoColor.client.get_json(
+            DemoColor.api_url("/sample")
 
         ).done(function(data) {
             update_meter(data.current);
 
-            if (repeat && !stop_requested) {
-                sampler_timer = setTimeout(
-                    function() {
-                        return get_sample(repeat);
-                    },
-                    1000
-                );
-            } else {
-                sampler_timer = null;
-                enable_activation_buttons(true);
-                stop_requested = false;
-            }
-
         }).fail(function(jqXHR, textStatus, errorThrown) {
+            if (jqXHR.status === 409 || jqXHR.status === 503) {
+                // demonstrator used by another client, and no result shared yet,
+                // or hardware still initializing : the sampling is retried by the client
+                return;
+            }
             jError(
                 "Erreur mesure : <br>" + errorThrown,
                 {
@@ -122,95 +118,54 @@ $(document).ready(function() {
     }
 
     function activate_sampler() {
-        if (!analyzer_timer && !sampler_timer) {
+        if (!analyzer && !sampler) {
             enable_activation_buttons(false);
             measure_display_simple.removeClass("invisible");
             measure_display_rgb.addClass("invisible");
             bar_graphs_container.addClass("invisible");
 
-            get_sample(true);
-        }
-    }
-
-    var analyzed_color = OFF
-    var component_levels = [0, 0, 0];
-
-    function max_index(elements) {
-        var i = 1;
-        var mi = 0;
-        while (i < elements.length) {
-            if (!(elements[i] < elements[mi])) {
-                mi = i;
-            }
-            i += 1;
+            sampler = DemoColor.client.poll(get_sample, 1000);
         }
-        return mi;
     }
 
+    // one analysis cycle, the light being cycled by a script played by the BlinkM : returns
+    // the delay before the next cycle, or false if not repeated
     function sample_and_analyze(repeat) {
-        analyzed_color = (analyzed_color % 3) + 1;
+        return DemoColor.client.get_json(
+            DemoColor.api_url("/cycle")
 
-        $.post(
-            document.location.href + "/light/" + LIGHT_COLOR_CODES[analyzed_color]
-
-        ).then(function() {
-            update_bulb(analyzed_color);
-            $("button.bulb-control.disabled").removeClass("disabled");
-            $("button#bulb-" + COLOR_NAMES[analyzed_color]).addClass("disabled");
-
-            return $.getJSON(document.location.href + "/sample");
-
-        }).then(function(data) {
-            update_rgb_meter(COLOR_NAMES[analyzed_color], data.current);
-            component_levels[analyzed_color - 1] = data.current;
-
-            if (analyzed_color === CYCLE_END) {
-                return $.getJSON(
-                    document.location.href + "/analyze",
-                    {
-                        "r" : component_levels[RED-1],
-                        "g" : component_levels[GREEN-1],
-                        "b" : component_levels[BLUE-1]
-                    }
-                );
-            } else {
-                return false;
+        ).then(function(data) {
+            for (var i=0; i<3; i++) {
+                update_rgb_meter(COLOR_NAMES[RED + i], data.components[i]);
             }
-
-        }).done(function(data) {
-            var end_of_cycle = false;
-            var delay = 0;
+            update_bulb(OFF);
+            $("button.bulb-control.disabled").removeClass("disabled");
+            $("button#bulb-" + COLOR_NAMES[OFF]).addClass("disabled");
 
             if (data.color) {
                 img_ball.attr("src", "/img/ball-" + data.color + ".png");
 
                 bar_graphs_container.removeClass("invisible");
-                for (var i=0; i<3; i++) {
+                for (i=0; i<3; i++) {
                     var pct = Math.round(data.decomp[i]) + "%";
                     bar_graphs[i].width(pct).text(pct);
                 }
-                end_of_cycle = true;
-                set_light_source(OFF);
-                // make a pause at the end of the cycle when repeat is active
-                if (repeat)
-                    delay = 1000;
             }
 
-            if (stop_requested || (end_of_cycle && !repeat)) {
-                stop_requested = false;
-                analyzer_timer = null;
+            if (!repeat) {
+                analyzer = null;
                 enable_activation_buttons(true);
-
-            } else {
-                analyzer_timer = setTimeout(
-                    function() {
-                        return sample_and_analyze(repeat);
-                    },
-                    delay
-                );
+                return false;
             }
+            // make a pause at the end of the cycle when repeat is active
+            return 1000;
 
         }).fail(function(jqXHR, textStatus, errorThrown) {
+            if (jqXHR.status === 409 || jqXHR.status === 503) {
+                // demonstrator used by another client, and no result shared yet,
+                // or hardware still initializing : the cycle is retried by the client
+                return;
+            }
             jError(
                 "Erreur mesure : <br>" + errorThrown,
                 {
@@ -222,16 +177,17 @@ $(document).ready(function() {
     }
 
     function activate_analyzer(repeat) {
-        if (!analyzer_timer && !sampler_timer) {
-            $.getJSON(document.location.href + "/status")
+        if (!analyzer && !sampler) {
+            DemoColor.client.get_json(DemoColor.api_url("/status"))
             .done(function(result) {
                 if (result.calibrated) {
                     enable_activation_buttons(false);
                     measure_display_simple.addClass("invisible");
                     measure_display_rgb.removeClass("invisible");
 
-                    analyzed_color = OFF;
-                    sample_and_analyze(repeat);
+                    analyzer = DemoColor.client.poll(function() {
+                        return sample_and_analyze(repeat);
+                    }, 0);
                 } else {
                     jError("Le détecteur doit avoir été calibré avant.");
                 }
@@ -270,7 +226,8 @@ $(document).ready(function() {
     $(window).unload(function(){
         stop_sampling();
         // ensure LED is off
-        set_light_source(OFF);
+        DemoColor.send_now(DemoColor.api_url("/light/" + LIGHT_COLOR_CODES[OFF]), "POST");
+        DemoColor.send_now(DemoColor.api_url("/lease"), "DELETE");
     });
 
     update_meter(0);
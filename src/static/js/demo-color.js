@@ -1,3 +1,223 @@
+var DemoColor = window.DemoColor || {};
+
+// Decoding of the binary sample frames (see frames.py) : each frame is made of the sample time
+// (seconds since the epoch, float64), the sensor index (uint16) and the value (float32),
+// all little-endian.
+DemoColor.FRAME_SIZE = 14;
+
+DemoColor.decode_frames = function(buffer, sensor_ids) {
+    var view = new DataView(buffer);
+    var samples = [];
+    for (var offset = 0; offset + DemoColor.FRAME_SIZE <= buffer.byteLength; offset += DemoColor.FRAME_SIZE) {
+        var index = view.getUint16(offset + 8, true);
+        samples.push({
+            time: view.getFloat64(offset, true),
+            sensor: sensor_ids ? sensor_ids[index] : index,
+            value: view.getFloat32(offset + 10, true)
+        });
+    }
+    return samples;
+};
+
+// Gets samples in binary format, and passes them decoded to the done callback. The URL
+// must be one of a service accepting the "format=binary" argument.
+DemoColor.get_frames = function(url, done, fail) {
+    var xhr = new XMLHttpRequest();
+    xhr.open("GET", url + (url.indexOf("?") < 0 ? "?" : "&") + "format=binary");
+    xhr.responseType = "arraybuffer";
+    xhr.onload = function() {
+        if (xhr.status === 200) {
+            var header = xhr.getResponseHeader("X-Sensors");
+            done(DemoColor.decode_frames(xhr.response, header ? header.split(",") : null));
+        } else if (fail) {
+            fail(xhr);
+        }
+    };
+    if (fail) {
+        xhr.onerror = function() {
+            fail(xhr);
+        };
+    }
+    xhr.send();
+};
+
+// Returns the URL of an API service of the page demonstrator, given its path relative to the
+// page (e.g. "/sample"). The page URL query and fragment (e.g. "?timing") are left out.
+DemoColor.api_url = function(path) {
+    return document.location.pathname.replace(/\/?$/, "") + path;
+};
+
+// Shared data client of the page.
+//
+// All the requests of the page go through it. They are sent one at a time, so that a page
+// uses a single connection, and identical GET requests pending at the same time are sent
+// only once.
+//
+// Periodic sampling is done by tasks registered with poll(). A task is run again once the
+// previous run is complete, after its period or more if the server is slow to answer (the
+// delay is adapted to the measured latency). Tasks are suspended while the page is hidden,
+// so that background tabs do not load the server.
+DemoColor.Client = function() {
+    this.queue = [];
+    this.in_flight = null;
+    this.pending = {};
+    this.latency = 0;
+    this.tasks = [];
+
+    var self = this;
+    $(document).on("visibilitychange", function() {
+        if (!document.hidden) {
+            $.each(self.tasks.slice(), function(i, task) {
+                if (task.suspended) {
+                    task.suspended = false;
+                    self._run(task);
+                }
+            });
+        }
+    });
+};
+
+// the smoothing factor of the latency average
+DemoColor.Client.LATENCY_SMOOTHING = 0.3;
+// the minimal ratio between the polling delay and the latency
+DemoColor.Client.LATENCY_FACTOR = 2;
+// the delay before retrying a task when the demonstrator is busy or unavailable
+DemoColor.Client.RETRY_DELAY = 1000;
+
+DemoColor.Client.prototype = {
+    // Sends a request (same options as $.ajax), and returns its promise.
+    request: function(options) {
+        options = $.extend({type: "GET"}, options);
+        var key = null;
+        if (options.type === "GET") {
+            key = options.url + "?" + $.param(options.data || {});
+            if (this.pending[key]) {
+                return this.pending[key];
+            }
+        }
+
+        var self = this;
+        var deferred = $.Deferred();
+        var promise = deferred.promise();
+        if (key) {
+            this.pending[key] = promise;
+            promise.always(function() {
+                delete self.pending[key];
+            });
+        }
+        this.queue.push({options: options, deferred: deferred});
+        this._next();
+        return promise;
+    },
+
+    get_json: function(url, data) {
+        return this.request({url: url, data: data, dataType: "json"});
+    },
+
+    post: function(url, data) {
+        return this.request({url: url, type: "POST", data: data});
+    },
+
+    _next: function() {
+        if (this.in_flight || !this.queue.length) {
+            return;
+        }
+        var self = this;
+        var job = this.in_flight = this.queue.shift();
+        var start = Date.now();
+
+        $.ajax(job.options).done(function(data, textStatus, jqXHR) {
+            job.deferred.resolve(data, textStatus, jqXHR);
+        }).fail(function(jqXHR, textStatus, errorThrown) {
+            job.deferred.reject(jqXHR, textStatus, errorThrown);
+        }).always(function() {
+            var k = DemoColor.Client.LATENCY_SMOOTHING;
+            self.latency = self.latency ? (1 - k) * self.latency + k * (Date.now() - start) : Date.now() - start;
+            self.in_flight = null;
+            self._next();
+        });
+    },
+
+    // Registers a periodic task, and returns a handle for stopping it.
+    //
+    // The task function must return a promise. If it resolves to a number, this number
+    // is used as the delay before the next run instead of the (latency adapted) period,
+    // e.g. for running a sequence of steps, and if it resolves to
+    // false, the task is stopped. The task is stopped too if the promise is rejected, unless
+    // the demonstrator is in use by another client or unavailable (409 and 503 statuses),
+    // in which case the task is run again later.
+    poll: function(fn, period) {
+        var self = this;
+        var task = {fn: fn, period: period, timer: null, suspended: false, stopped: false};
+        task.stop = function() {
+            task.stopped = true;
+            clearTimeout(task.timer);
+            self.tasks = $.grep(self.tasks, function(t) { return t !== task; });
+        };
+        this.tasks.push(task);
+        this._run(task);
+        return task;
+    },
+
+    _schedule: function(task, delay) {
+        var self = this;
+        if (task.stopped) {
+            return;
+        }
+        task.timer = setTimeout(function() {
+            self._run(task);
+        }, delay);
+    },
+
+    _period: function(task) {
+        // slow down when the server is slow to answer
+        return Math.max(task.period, DemoColor.Client.LATENCY_FACTOR * this.latency);
+    },
+
+    _run: function(task) {
+        var self = this;
+        task.timer = null;
+        if (task.stopped) {
+            return;
+        }
+        if (document.hidden) {
+            task.suspended = true;
+            return;
+        }
+
+        $.when(task.fn()).done(function(result) {
+            if (result === false) {
+                task.stop();
+            } else {
+                self._schedule(task, typeof result === "number" ? result : self._period(task));
+            }
+        }).fail(function(jqXHR) {
+            if (jqXHR && (jqXHR.status === 409 || jqXHR.status === 503)) {
+                var retry_after = parseInt(jqXHR.getResponseHeader("Retry-After"), 10) * 1000;
+                self._schedule(task, Math.max(self._period(task), retry_after || DemoColor.Client.RETRY_DELAY));
+            } else {
+                task.stop();
+            }
+        });
+    },
+
+    // Stops all the periodic tasks.
+    stop_all: function() {
+        $.each(this.tasks.slice(), function(i, task) {
+            task.stop();
+        });
+    }
+};
+
+DemoColor.client = new DemoColor.Client();
+
+// Sends a request at once, bypassing the client queue, for the last requests of a page
+// sent when it is unloaded (the queued ones would never be sent). The request is synchronous,
+// so that the requests are sent in order and before the page is gone.
+DemoColor.send_now = function(url, type, data) {
+    $.ajax({url: url, type: type, data: data, async: false});
+};
+
 $(document).ready(function() {
     Date.prototype.toHHMMSS = function () {
         var hours   = this.getHours();
@@ -33,5 +253,43 @@ $(document).ready(function() {
         errorElement: 'span'
     });
 
+    // debug overlay showing the server timings of the API requests, activated by adding
+    // "timing" to the page URL query (e.g. /color_detector?timing)
+    if (/[?&]timing\b/.test(document.location.search)) {
+        var MAX_TIMING_ROWS = 8;
+        var overlay = $('<div id="timing-overlay"><table></table></div>').appendTo("body");
+        var rows = overlay.find("table");
+
+        $(document).ajaxSend(function(event, jqXHR, settings) {
+            settings.timing_start = Date.now();
+
+        }).ajaxComplete(function(event, jqXHR, settings) {
+            var header = jqXHR.getResponseHeader("Server-Timing");
+            if (!header) {
+                return;
+            }
+            var elapsed = Date.now() - settings.timing_start;
+            var stages = [];
+            var server_total = 0;
+            $.each(header.split(","), function(i, metric) {
+                var m = /^\s*([\w-]+);dur=([\d.]+)/.exec(metric);
+                if (m) {
+                    if (m[1] === "total") {
+                        server_total = parseFloat(m[2]);
+                    } else {
+                        stages.push(m[1] + " " + m[2]);
+                    }
+                }
+            });
+            stages.push("network " + Math.max(elapsed - server_total, 0).toFixed(1));
+
+            $("<tr>")
+                .append($("<td>").text(settings.url.replace(/^https?:\/\/[^\/]+/, "").split("?")[0]))
+                .append($("<td>").text(elapsed + " ms"))
+                .append($("<td>").text(stages.join(" | ")))
+                .prependTo(rows);
+            rows.find("tr").slice(MAX_TIMING_ROWS).remove();
+        });
+    }
 
 });
\ No newline at end of file
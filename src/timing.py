@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Per-request timing breakdown.
+
+The durations of the stages of a request processing (light command, settling wait, ADC
+conversions,...) are collected by spans placed in the controller and the drivers, and
+accumulated in the timings of the request being processed by the current thread. They are
+reported to the client in a Server-Timing header.
+
+Spans executed while no timings are collected by the current thread (e.g. background
+operations) cost a thread-local lookup only.
+"""
+
+__author__ = 'Eric Pascual'
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# the stages names and descriptions, in reporting order
+LIGHT = 'light'
+SETTLE = 'settle'
+ADC = 'adc'
+BUS_WAIT = 'bus'
+QUEUE = 'queue'
+ANALYSIS = 'analysis'
+JSON = 'json'
+TOTAL = 'total'
+
+DESCRIPTIONS = {
+    LIGHT: 'light command',
+    SETTLE: 'settling wait',
+    ADC: 'ADC conversion',
+    BUS_WAIT: 'I2C bus wait',
+    QUEUE: 'worker queue',
+    ANALYSIS: 'analysis',
+    JSON: 'serialization',
+    TOTAL: 'total',
+}
+
+_local = threading.local()
+
+
+class Timings(object):
+    """ The accumulated durations of the stages of a request processing.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = OrderedDict()
+
+    def add(self, stage, duration):
+        with self._lock:
+            self._stages[stage] = self._stages.get(stage, 0) + duration
+
+    def span(self, stage):
+        """ Returns a context manager adding its duration to a stage.
+
+        :param str stage: the stage name
+        """
+        return _Span(stage, self)
+
+    def as_dict(self):
+        """ Returns the stages durations (in seconds).
+
+        :rtype: dict
+        """
+        with self._lock:
+            return dict(self._stages)
+
+    def header(self):
+        """ Returns the Server-Timing header value (durations in milliseconds).
+
+        :rtype: str
+        """
+        with self._lock:
+            return ', '.join(
+                '%s;dur=%.1f;desc="%s"' % (stage, duration * 1000., DESCRIPTIONS.get(stage, stage))
+                for stage, duration in self._stages.iteritems()
+            )
+
+
+def current():
+    """ Returns the timings collected by the current thread, if any.
+
+    :rtype: Timings
+    """
+    return getattr(_local, 'timings', None)
+
+
+class _Span(object):
+    def __init__(self, stage, timings):
+        self._stage = stage
+        self._timings = timings
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._timings.add(self._stage, time.time() - self._start)
+
+
+class _NoSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+_no_span = _NoSpan()
+
+
+def span(stage):
+    """ Returns a context manager adding its duration to a stage of the current timings.
+
+    :param str stage: the stage name
+    """
+    timings = current()
+    return _Span(stage, timings) if timings else _no_span
+
+
+@contextmanager
+def collecting(timings):
+    """ Context manager collecting the spans of the current thread in given timings.
+
+    :param Timings timings: the timings to collect in
+    """
+    previous = current()
+    _local.timings = timings
+    try:
+        yield timings
+    finally:
+        _local.timings = previous
+
+
+def collected(timings, fn):
+    """ Wraps an operation so that its spans are collected in given timings, whatever the
+    thread executing it is.
+
+    The time elapsed before the operation execution starts is accounted as the queue stage.
+
+    :param Timings timings: the timings to collect in
+    :param fn: the operation
+    :return: the wrapped operation
+    """
+    submitted = time.time()
+
+    def run(*args, **kwargs):
+        timings.add(QUEUE, time.time() - submitted)
+        with collecting(timings):
+            return fn(*args, **kwargs)
+    return run
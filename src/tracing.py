@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Hardware trace recording and replay.
+
+The recording wraps the hardware drivers (real or simulated ones) and writes every ADC
+reading, GPIO write and BlinkM command to a trace file, with its time.
+
+The replay provides drivers which play a recorded trace back. The time is then given by a
+virtual clock, so that the controller algorithms run deterministically, and faster than real
+time since the delays they wait for are skipped.
+
+The trace file starts with a header (the magic string and the recording start time),
+followed by fixed size records made of the time offset, the event kind, the id of the device
+the event belongs to, the chip address, 4 argument bytes and a value. The devices of a
+process have their own events, even when their chips have the same addresses.
+"""
+
+__author__ = 'Eric Pascual'
+
+import struct
+import threading
+import time
+import logging
+import bisect
+
+MAGIC = 'DCTRACE2'
+_HEADER = struct.Struct('<8sd')
+_RECORD = struct.Struct('<dc16sB4Bd')
+
+KIND_ADC = 'A'
+KIND_GPIO = 'G'
+KIND_BLINKM = 'B'
+
+# the BlinkM commands codes, as defined by the BlinkM protocol
+_BLINKM_COMMANDS = {
+    'go_to': 0x6e,
+    'fade_to': 0x63,
+    'stop_script': 0x6f,
+    'play_script': 0x70,
+    'write_script_line': 0x57,
+    'set_script_length_and_repeats': 0x4c,
+}
+
+
+class TraceExhausted(Exception):
+    """ Raised when the replay is requested a reading past the end of the trace.
+    """
+
+
+class Recorder(object):
+    """ Writer of a trace file, shared by the recording drivers.
+    """
+    def __init__(self, path):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self._fp = open(path, 'wb')
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._count = 0
+        self._fp.write(_HEADER.pack(MAGIC, self._start))
+        self._log.info('recording hardware trace to %s', path)
+
+    def record(self, kind, device_id='', addr=0, args=(), value=0.):
+        # commands with more arguments (e.g. script lines) are recorded with the first ones only
+        args = (tuple(args) + (0,) * 4)[:4]
+        with self._lock:
+            if self._fp:
+                self._fp.write(_RECORD.pack(
+                    time.time() - self._start, kind, device_id, addr, *args + (value,)
+                ))
+                self._count += 1
+
+    def close(self):
+        with self._lock:
+            if self._fp:
+                self._fp.close()
+                self._fp = None
+                self._log.info('%d events recorded', self._count)
+
+    def adc_factory(self, adc_class):
+        def create(address=0x68, address2=0x69, rate=18, device_id=''):
+            return _RecordingADC(self, adc_class(address, address2, rate), device_id, address)
+        return create
+
+    def blinkm_factory(self, blinkm_class):
+        def create(bus=1, addr=0x09, device_id=''):
+            return _RecordingBlinkM(self, blinkm_class(bus=bus, addr=addr), device_id, addr)
+        return create
+
+    def gpio(self, gpio):
+        return _RecordingGPIO(self, gpio)
+
+
+class _RecordingADC(object):
+    def __init__(self, recorder, adc, device_id, address):
+        self._recorder = recorder
+        self._adc = adc
+        self._device_id = device_id
+        self._address = address
+
+    def readVoltage(self, channel):
+        voltage = self._adc.readVoltage(channel)
+        self._recorder.record(KIND_ADC, self._device_id, self._address, (channel,), voltage)
+        return voltage
+
+    def readVoltages(self, channels):
+        voltages = self._adc.readVoltages(channels)
+        for channel, voltage in zip(channels, voltages):
+            self._recorder.record(KIND_ADC, self._device_id, self._address, (channel,), voltage)
+        return voltages
+
+    def __getattr__(self, name):
+        return getattr(self._adc, name)
+
+
+class _RecordingBlinkM(object):
+    def __init__(self, recorder, blinkm, device_id, address):
+        self._recorder = recorder
+        self._blinkm = blinkm
+        self._device_id = device_id
+        self._address = address
+
+    def reset(self):
+        self._blinkm.reset()
+        # the reset is made of a script stop and a fade to black
+        for command in ('stop_script', 'fade_to'):
+            self._recorder.record(KIND_BLINKM, self._device_id, self._address, (_BLINKM_COMMANDS[command],))
+
+    def __getattr__(self, name):
+        method = getattr(self._blinkm, name)
+        if name not in _BLINKM_COMMANDS:
+            return method
+
+        def recorded(*args):
+            result = method(*args)
+            self._recorder.record(KIND_BLINKM, self._device_id, self._address, (_BLINKM_COMMANDS[name],) + args)
+            return result
+        return recorded
+
+
+class _RecordingGPIO(object):
+    def __init__(self, recorder, gpio):
+        self._recorder = recorder
+        self._gpio = gpio
+
+    def output(self, pin, state):
+        self._gpio.output(pin, state)
+        self._recorder.record(KIND_GPIO, args=(pin, 1 if state else 0))
+
+    def __getattr__(self, name):
+        return getattr(self._gpio, name)
+
+
+def read_trace(path):
+    """ Reads a trace file.
+
+    :return: the recording start time, and the list of the events, as
+        (time offset, kind, device id, address, args, value) tuples
+    :rtype: tuple
+    """
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    magic, start = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('not a trace file : %s' % path)
+
+    events = []
+    for offset in xrange(_HEADER.size, len(data) - _RECORD.size + 1, _RECORD.size):
+        t, kind, device_id, addr, a0, a1, a2, a3, value = _RECORD.unpack_from(data, offset)
+        events.append((t, kind, device_id.rstrip('\0'), addr, (a0, a1, a2, a3), value))
+    return start, events
+
+
+class VirtualClock(object):
+    """ The replay time, advancing with the replayed readings and the delays waited for.
+
+    It provides the subset of the time module interface used by the controller.
+    """
+    def __init__(self, start):
+        self._lock = threading.Lock()
+        self._now = start
+
+    def time(self):
+        with self._lock:
+            return self._now
+
+    def sleep(self, delay):
+        with self._lock:
+            self._now += max(delay, 0)
+
+    def advance_to(self, t):
+        with self._lock:
+            self._now = max(self._now, t)
+
+
+class Replay(object):
+    """ Source of the replay drivers.
+
+    An ADC reading returns the first not yet replayed reading of the channel which is not
+    older than the virtual clock, and advances the clock to its time. Readings are thus
+    replayed in sequence as long as the controller reads the same way it did while recording,
+    and stay aligned with time if it waits longer. GPIO writes and BlinkM commands advance the
+    clock the same way to the time of the matching recorded event, so that the idle periods
+    of the recording (e.g. between requests) are skipped.
+    """
+    def __init__(self, path):
+        self._log = logging.getLogger(self.__class__.__name__)
+        start, events = read_trace(path)
+        self.clock = VirtualClock(start)
+        self._lock = threading.Lock()
+        # event key -> (times, values), the key being (kind, device id, address, channel) for
+        # the ADC readings, (kind, device id, address) for the BlinkM commands and (kind, pin)
+        # for the GPIO writes, the pins being shared by all the devices
+        self._events = {}
+        for t, kind, device_id, addr, args, value in events:
+            if kind == KIND_ADC:
+                key = (kind, device_id, addr, args[0])
+            elif kind == KIND_GPIO:
+                key = (kind, args[0])
+            else:
+                key = (kind, device_id, addr)
+            times, values = self._events.setdefault(key, ([], []))
+            times.append(start + t)
+            values.append(value)
+        self._next = dict((key, 0) for key in self._events)
+        self._log.info('replaying %d events from %s', len(events), path)
+
+    def _replay(self, key):
+        """ Returns the value of the next event of a given key, or None if there is none.
+        """
+        with self._lock:
+            try:
+                times, values = self._events[key]
+            except KeyError:
+                return None
+            i = max(self._next[key], bisect.bisect_left(times, self.clock.time()))
+            if i >= len(times):
+                return None
+            self._next[key] = i + 1
+            self.clock.advance_to(times[i])
+            return values[i]
+
+    def read(self, device_id, address, channel):
+        value = self._replay((KIND_ADC, device_id, address, channel))
+        if value is None:
+            raise TraceExhausted('end of trace reached for channel %d of ADC 0x%.2x (device %s)' % (
+                channel, address, device_id
+            ))
+        return value
+
+    def command(self, device_id, address):
+        self._replay((KIND_BLINKM, device_id, address))
+
+    def output(self, pin):
+        self._replay((KIND_GPIO, pin))
+
+    def adc_factory(self):
+        def create(address=0x68, address2=0x69, rate=18, device_id=''):
+            return _ReplayADC(self, device_id, address)
+        return create
+
+    def blinkm_factory(self):
+        def create(bus=1, addr=0x09, device_id=''):
+            return _ReplayBlinkM(self, device_id, addr)
+        return create
+
+    def gpio(self):
+        return _ReplayGPIO(self)
+
+
+class _ReplayADC(object):
+    def __init__(self, replay, device_id, address):
+        self._replay = replay
+        self._device_id = device_id
+        self._address = address
+
+    def setBitRate(self, rate):
+        pass
+
+    def setConversionTimeout(self, timeout):
+        pass
+
+    def readVoltage(self, channel):
+        return self._replay.read(self._device_id, self._address, channel)
+
+    def readVoltages(self, channels):
+        return [self.readVoltage(c) for c in channels]
+
+
+class _ReplayBlinkM(object):
+    """ BlinkM accepting the commands used by the controller, since the light is in the
+    replayed readings.
+    """
+    def __init__(self, replay, device_id, address):
+        self._replay = replay
+        self._device_id = device_id
+        self._address = address
+
+    def _command(self):
+        self._replay.command(self._device_id, self._address)
+
+    def reset(self):
+        # recorded as two commands (see _RecordingBlinkM.reset)
+        self._command()
+        self._command()
+
+    def go_to(self, r=0, g=0, b=0):
+        self._command()
+
+    def fade_to(self, r=0, g=0, b=0):
+        self._command()
+
+    def stop_script(self):
+        self._command()
+
+    def play_script(self, script_number, repeat=0, start_line=0):
+        self._command()
+
+    def write_script_line(self, script_number, line_number, duration, command, value1=0, value2=0, value3=0):
+        self._command()
+
+    def set_script_length_and_repeats(self, script_number, length, repeats):
+        self._command()
+
+
+class _ReplayGPIO(object):
+    BOARD = 'board'
+    OUT = 'out'
+    HIGH = 1
+    LOW = 0
+
+    def __init__(self, replay):
+        self._replay = replay
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, mode):
+        pass
+
+    def output(self, pin, state):
+        self._replay.output(pin)
+
+    def cleanup(self):
+        pass
@@ -13,9 +13,14 @@ class UIModuleBase(UIModule):
 
     Shares the rendering process common operations so that concrete module implementations
     have no boiler plate code to repeat over and over.
+
+    Since modules output only depends on their arguments, it is cached (except in debug mode).
     """
     TEMPLATE_DIRECTORY = "uimodules"
 
+    # rendered modules cache, keyed by the template path and the rendering arguments
+    _render_cache = {}
+
     @property
     def template_name(self):
         """ Returns the name (without extension and path) of the body template.
@@ -37,6 +42,20 @@ class UIModuleBase(UIModule):
             name += '.html'
         return os.path.join(self.TEMPLATE_DIRECTORY, name)
 
+    def render_string(self, path, **kwargs):
+        if self.handler.application.settings.get('debug'):
+            return super(UIModuleBase, self).render_string(path, **kwargs)
+
+        key = (path, tuple(sorted(kwargs.items())))
+        try:
+            return self._render_cache[key]
+        except KeyError:
+            html = self._render_cache[key] = super(UIModuleBase, self).render_string(path, **kwargs)
+            return html
+        except TypeError:
+            # unhashable arguments : the rendering cannot be cached
+            return super(UIModuleBase, self).render_string(path, **kwargs)
+
     def render(self, application, *args, **kwargs):
         return self.render_string(
             self.make_template_path(),
@@ -11,15 +11,49 @@ from tornado.web import HTTPError
 
 import os
 import logging
+import signal
+import mimetypes
 
 import uimodules
 import wsapi
 import webui
+import assets
+from loopmonitor import LoopLagMonitor
 
 
 _here = os.path.dirname(__file__)
 
 
+class AssetFileHandler(tornado.web.StaticFileHandler):
+    """ Static file handler for the fingerprinted bundles.
+
+    Since their name changes with their content, the files are cached forever by clients.
+    The gzip'ed version of a file is served instead of it if the client accepts it.
+    """
+    CACHE_MAX_AGE = 365 * 24 * 3600
+
+    _gzipped = False
+
+    def get(self, path, include_body=True):
+        if 'gzip' in self.request.headers.get('Accept-Encoding', '') \
+                and os.path.exists(os.path.join(self.root, path + '.gz')):
+            self._gzipped = True
+            self._content_path = path
+            path += '.gz'
+        return super(AssetFileHandler, self).get(path, include_body)
+
+    def get_content_type(self):
+        if self._gzipped:
+            return mimetypes.guess_type(self._content_path)[0] or 'application/octet-stream'
+        return super(AssetFileHandler, self).get_content_type()
+
+    def set_extra_headers(self, path):
+        self.set_header('Cache-Control', 'public, max-age=%d, immutable' % self.CACHE_MAX_AGE)
+        self.set_header('Vary', 'Accept-Encoding')
+        if self._gzipped:
+            self.set_header('Content-Encoding', 'gzip')
+
+
 class DemoColorApp(tornado.web.Application):
     """ The Web application
     """
@@ -33,10 +67,19 @@ class DemoColorApp(tornado.web.Application):
     }
 
     handlers = [
+        (r"/assets/(.*)", AssetFileHandler, {"path": os.path.join(_res_home, assets.ASSETS_DIR)}),
         (r"/css/(.*)", tornado.web.StaticFileHandler, {"path": os.path.join(_res_home, 'css')}),
         (r"/js/(.*)", tornado.web.StaticFileHandler, {"path": os.path.join(_res_home, 'js')}),
         (r"/img/(.*)", tornado.web.StaticFileHandler, {"path": os.path.join(_res_home, 'img')}),
 
+        (r"/api/devices", wsapi.WSDevices),
+        (r"/health", wsapi.WSHealth),
+        (r"/logs", wsapi.WSLogs),
+        (r"/i2c/stats", wsapi.WSI2CStats),
+    ]
+
+    # the routes of the pages and services of a device
+    device_handlers = [
         # user interface
 
         (r"/", webui.UIHome),
@@ -48,35 +91,61 @@ class DemoColorApp(tornado.web.Application):
         # API wWeb services
 
         (r"/calibration/data", wsapi.WSCalibrationData),
-
-        (r"/barrier/sample", wsapi.WSBarrierSample),
-        (r"/barrier/analyze", wsapi.WSBarrierSampleAndAnalyze),
-        (r"/barrier/light", wsapi.WSBarrierLight),
-        (r"/barrier/status", wsapi.WSBarrierCalibrationStatus),
-        (r"/calibration/barrier/sample", wsapi.WSBarrierCalibrationSample),
-        (r"/calibration/barrier/store", wsapi.WSBarrierCalibrationStore),
-
-        (r"/bw_detector/sample", wsapi.WSBWDetectorSample),
-        (r"/bw_detector/analyze", wsapi.WSBWDetectorSampleAndAnalyze),
-        (r"/bw_detector/light", wsapi.WSBWDetectorLight),
-        (r"/bw_detector/status", wsapi.WSBWDetectorCalibrationStatus),
-        (r"/calibration/bw_detector/sample", wsapi.WSBWDetectorCalibrationSample),
-        (r"/calibration/bw_detector/store", wsapi.WSBWDetectorCalibrationStore),
+        (r"/calibration/jobs", wsapi.WSCalibrationJobs),
+        (r"/calibration/jobs/(?P<job_id>\w+)", wsapi.WSCalibrationJob),
+
+        (r"/barrier/sample", wsapi.WSSensorSample, {"sensor_id": "barrier"}),
+        (r"/barrier/analyze", wsapi.WSSensorSampleAndAnalyze, {"sensor_id": "barrier"}),
+        (r"/barrier/light", wsapi.WSSensorLight, {"sensor_id": "barrier"}),
+        (r"/barrier/status", wsapi.WSSensorCalibrationStatus, {"sensor_id": "barrier"}),
+        (r"/calibration/barrier/sample", wsapi.WSSensorCalibrationSample, {"sensor_id": "barrier"}),
+        (r"/calibration/barrier/store", wsapi.WSSensorCalibrationStore, {"sensor_id": "barrier"}),
+
+        (r"/bw_detector/sample", wsapi.WSSensorSample, {"sensor_id": "bw_detector"}),
+        (r"/bw_detector/analyze", wsapi.WSSensorSampleAndAnalyze, {"sensor_id": "bw_detector"}),
+        (r"/bw_detector/light", wsapi.WSSensorLight, {"sensor_id": "bw_detector"}),
+        (r"/bw_detector/status", wsapi.WSSensorCalibrationStatus, {"sensor_id": "bw_detector"}),
+        (r"/calibration/bw_detector/sample", wsapi.WSSensorCalibrationSample, {"sensor_id": "bw_detector"}),
+        (r"/calibration/bw_detector/store", wsapi.WSSensorCalibrationStore, {"sensor_id": "bw_detector"}),
 
         (r"/color_detector/sample", wsapi.WSColorDetectorSample),
         (r"/color_detector/analyze", wsapi.WSColorDetectorAnalyze),
+        (r"/color_detector/cycle", wsapi.WSColorDetectorCycle),
         (r"/color_detector/light/(?P<color>[0rgb])", wsapi.WSColorDetectorLight),
         (r"/color_detector/status", wsapi.WSColorDetectorCalibrationStatus),
         (r"/calibration/color_detector/sample", wsapi.WSColorDetectorSample),
         (r"/calibration/color_detector/store/(?P<color>[wb])", wsapi.WSColorDetectorCalibrationStore),
+        (r"/calibration/color_detector/response", wsapi.WSSensorResponseMeasure, {"sensor_id": "color_detector"}),
+
+        (r"/sensors", wsapi.WSSensors),
+        (r"/sensors/sample", wsapi.WSSensorsSample),
+        (r"/sensors/history", wsapi.WSSensorsHistory),
+        (r"/export/(?P<sensor_id>\w+)\.(?P<export_format>csv|bin)", wsapi.WSSensorExport),
+        (r"/sensors/(?P<sensor_id>\w+)/sample", wsapi.WSSensorSample),
+        (r"/sensors/(?P<sensor_id>\w+)/analyze", wsapi.WSSensorSampleAndAnalyze),
+        (r"/sensors/(?P<sensor_id>\w+)/light", wsapi.WSSensorLight),
+        (r"/sensors/(?P<sensor_id>\w+)/status", wsapi.WSSensorCalibrationStatus),
+        (r"/sensors/(?P<sensor_id>\w+)/calibration/sample", wsapi.WSSensorCalibrationSample),
+        (r"/sensors/(?P<sensor_id>\w+)/calibration/store", wsapi.WSSensorCalibrationStore),
+        (r"/sensors/(?P<sensor_id>\w+)/calibration/response", wsapi.WSSensorResponseMeasure),
+
+        (r"/(?P<demonstrator>\w+)/lease", wsapi.WSLease),
+
+        (r"/api/batch", wsapi.WSBatch),
     ]
 
-    def __init__(self, controller, debug=False):
+    def __init__(self, devices, debug=False, log_buffer=None):
+        """
+        :param devices.DeviceRegistry devices: the served devices
+        :param bool debug: debug mode activation
+        :param logsupport.RingBufferHandler log_buffer: the in-memory log records, if kept
+        """
         self.log = logging.getLogger(self.__class__.__name__)
         self.log.setLevel(logging.INFO)
         self.log.info('starting')
 
-        self._controller = controller
+        self._devices = devices
+        self._log_buffer = log_buffer
 
         self.debug = debug
         if self.debug:
@@ -85,32 +154,73 @@ class DemoColorApp(tornado.web.Application):
             # avoid Tornado logging all access requests if not in debug mode
             logging.getLogger("tornado.access").setLevel(logging.WARN)
 
+        self._assets = assets.AssetResolver(static_home=self._res_home, use_sources=debug)
+        self._loop_monitor = LoopLagMonitor()
+
         self.settings['debug'] = debug
-        super(DemoColorApp, self).__init__(self.handlers, **self.settings)
+        # the devices are served under /dev/<id>/, the default one being served at the root too
+        handlers = self.handlers[:]
+        for route in self.device_handlers:
+            handlers.append((r"/dev/(?P<device_id>[\w-]+)" + route[0],) + route[1:])
+        handlers.extend(self.device_handlers)
+
+        super(DemoColorApp, self).__init__(handlers, **self.settings)
 
     @property
     def template_home(self):
         return self._templates_home
 
+    @property
+    def devices(self):
+        return self._devices
+
     @property
     def controller(self):
-        return self._controller
+        """ The controller of the default device (None until its hardware is ready).
+        """
+        return self._devices.default.controller
+
+    @property
+    def log_buffer(self):
+        return self._log_buffer
+
+    @property
+    def assets(self):
+        return self._assets
+
+    @property
+    def loop_monitor(self):
+        return self._loop_monitor
 
     def start(self, listen_port=8080, ):
         """ Starts the application
+
+        The devices hardware is initialized in the background, the server accepting requests
+        in the meantime.
         """
-        self._controller.start()
+        self._devices.start()
+
+        io_loop = tornado.ioloop.IOLoop.instance()
+
+        def stop(signum, frame):
+            # the IOLoop is stopped from its own thread, whatever the request being served
+            # when the signal is received
+            io_loop.add_callback_from_signal(self._stop, signum)
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, stop)
 
         self.listen(listen_port)
+        self._loop_monitor.start()
         try:
             self.log.info('listening on port %d', listen_port)
-            tornado.ioloop.IOLoop.instance().start()
-
-        except KeyboardInterrupt:
-            print # cosmetic to keep log messages nicely aligned
-            self.log.info('SIGTERM caught')
+            io_loop.start()
 
         finally:
-            self._controller.shutdown()
+            self._devices.shutdown()
+
+    def _stop(self, signum):
+        self.log.info('%s caught', 'SIGINT' if signum == signal.SIGINT else 'SIGTERM')
+        tornado.ioloop.IOLoop.instance().stop()
 
 
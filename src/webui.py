@@ -5,28 +5,106 @@ __author__ = 'Eric Pascual'
 
 from tornado.web import RequestHandler
 import os
+import hashlib
+
+from devices import DeviceBound
+
+
+class UIHandler(DeviceBound, RequestHandler):
+    """ Base class for pages handlers.
+
+    Pages are served for the device selected by the request URL (see devices.DeviceBound).
+
+    Since the pages content depends on nothing but the application state, their rendering
+    is cached in memory (except in debug mode, so that templates modifications are taken
+    into account) and served with an ETag, allowing clients to revalidate them for free.
+    """
+    # pages only depending on the device identity can be served before its hardware is ready
+    needs_controller = False
+
+    # rendered pages cache, keyed by the handler class and the device, and storing
+    # (version, html, etag) tuples
+    _page_cache = {}
+
+    _cache_key = None
+    _cache_version = None
+    _etag = None
+
+    def get_template_namespace(self):
+        namespace = super(UIHandler, self).get_template_namespace()
+        namespace['asset_urls'] = self.application.assets.urls
+        return namespace
 
-class UIHandler(RequestHandler):
     def get_template_args(self):
         return {
-            'app_title':"Capteurs de lumière et de couleur"
+            'app_title':"Capteurs de lumière et de couleur",
+            'base_url': self.base_url,
+            'device_id': self.device.id,
+            'device_ids': self.application.devices.ids
         }
 
-    def get(self, *args, **kwargs):
-        """ By default, the get method displays the "Not yet implemented message".
+    def get_cache_version(self):
+        """ Returns the version of the data the page content depends on.
+
+        The cached rendering of the page is discarded when this version changes. To be
+        overridden by pages embedding mutable data.
+        """
+        return None
+
+    def send_cached_page(self):
+        """ Sends the cached rendering of the page if still valid.
+
+        Pages with costly template arguments can call it before building them.
+
+        :return: True if the page was sent
+        :rtype: bool
         """
+        if self.application.settings.get('debug'):
+            return False
+
+        self._cache_key = (self.__class__, self.device_id)
+        self._cache_version = self.get_cache_version()
+        try:
+            version, html, etag = self._page_cache[self._cache_key]
+        except KeyError:
+            return False
+        if version != self._cache_version:
+            return False
+
+        self._etag = etag
+        self.finish(html)
+        return True
+
+    def render_page(self, template_name, **kwargs):
+        """ Renders a page template, or sends its cached rendering if still valid.
+        """
+        if self.send_cached_page():
+            return
+
         self.render(
-            os.path.join(self.application.template_home, "nyi.html"),
-            **self.get_template_args()
+            os.path.join(self.application.template_home, template_name),
+            **kwargs
         )
 
+    def finish(self, chunk=None):
+        if self._cache_key and self._etag is None and chunk is not None and self.get_status() == 200:
+            self._etag = '"%s"' % hashlib.sha1(chunk).hexdigest()
+            self._page_cache[self._cache_key] = (self._cache_version, chunk, self._etag)
+        return super(UIHandler, self).finish(chunk)
+
+    def compute_etag(self):
+        # avoid hashing the cached page again
+        return self._etag or super(UIHandler, self).compute_etag()
+
+    def get(self, *args, **kwargs):
+        """ By default, the get method displays the "Not yet implemented message".
+        """
+        self.render_page("nyi.html", **self.get_template_args())
+
 
 class UIHome(UIHandler):
     def get(self, *args, **kwargs):
-        self.render(
-            os.path.join(self.application.template_home, "home.html"),
-            **self.get_template_args()
-        )
+        self.render_page("home.html", **self.get_template_args())
 
 
 class UIHBarrier(UIHandler):
@@ -34,10 +112,7 @@ class UIHBarrier(UIHandler):
         template_args = self.get_template_args()
         template_args['demo_title'] = "Barrière optique"
 
-        self.render(
-            os.path.join(self.application.template_home, "barrier.html"),
-            **template_args
-        )
+        self.render_page("barrier.html", **template_args)
 
 
 class UIWBDetector(UIHandler):
@@ -45,10 +120,7 @@ class UIWBDetector(UIHandler):
         template_args = self.get_template_args()
         template_args['demo_title'] = "Détecteur noir/blanc"
 
-        self.render(
-            os.path.join(self.application.template_home, "bwdetector.html"),
-            **template_args
-        )
+        self.render_page("bwdetector.html", **template_args)
 
 
 class UIColorDetector(UIHandler):
@@ -56,19 +128,19 @@ class UIColorDetector(UIHandler):
         template_args = self.get_template_args()
         template_args['demo_title'] = "Analyseur de couleur"
 
-        self.render(
-            os.path.join(self.application.template_home, "colordetector.html"),
-            **template_args
-        )
+        self.render_page("colordetector.html", **template_args)
 
 
 class UICalibration(UIHandler):
-    def get(self, *args, **kwargs):
-        template_args = self.get_template_args()
-        template_args["calibration_cfg"] = self.application.controller.get_calibration_cfg_as_dict()
-        self.render(
-            os.path.join(self.application.template_home, "calibration.html"),
-            **template_args
-        )
+    needs_controller = True
+
+    def get_cache_version(self):
+        return self.controller.get_calibration_version()
 
+    def get(self, *args, **kwargs):
+        if self.send_cached_page():
+            return
 
+        template_args = self.get_template_args()
+        template_args["calibration_cfg"] = self.controller.get_calibration_cfg_as_dict()
+        self.render_page("calibration.html", **template_args)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Execution of the hardware operations outside of the IOLoop thread.
+"""
+
+__author__ = 'Eric Pascual'
+
+import threading
+import Queue
+import sys
+import logging
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+
+class HardwareWorker(object):
+    """ Executes the hardware operations of a device in a dedicated thread.
+
+    Operations are executed one at a time, in the order of their submission. Since the
+    operations of a device never overlap, a sequence submitted as a single operation (e.g.
+    light change, settling and sampling) cannot be interleaved with other ones.
+
+    Operations are submitted from the IOLoop thread, and their results are returned as
+    futures resolved in this thread, so that request handlers can wait for them without
+    stalling the server.
+    """
+    def __init__(self, name, io_loop=None):
+        self._log = logging.getLogger('%s(%s)' % (self.__class__.__name__, name))
+        self._io_loop = io_loop or IOLoop.instance()
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """ Stops the worker after the completion of the already submitted operations.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def submit(self, fn, *args, **kwargs):
+        """ Submits an operation.
+
+        :param fn: the callable implementing the operation
+        :return: a future resolved with the operation result
+        :rtype: tornado.concurrent.Future
+        """
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+
+            future, fn, args, kwargs = job
+            try:
+                result = fn(*args, **kwargs)
+            except Exception:
+                self._io_loop.add_callback(future.set_exc_info, sys.exc_info())
+            else:
+                self._io_loop.add_callback(future.set_result, result)
+
+        self._log.info('terminated')
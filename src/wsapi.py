@@ -5,14 +5,29 @@ __author__ = 'Eric Pascual'
 
 import json
 import time
+import math
 import logging
+import uuid
+import gzip
+from cStringIO import StringIO
 
-from tornado.web import RequestHandler
+from tornado.web import RequestHandler, HTTPError
+from tornado.iostream import StreamClosedError
+from tornado import gen
 
-from controller import DemonstratorController
+from controller import DemonstratorController, ControllerException
+import sensors
+import frames
+import sampling
+from devices import DeviceBound, CLIENT_ID_COOKIE
+from i2cbus import I2CBus
+from breaker import CircuitOpen
+from calibration import JobConflict
+import timing
 
-BARRIER_LDR_INPUT_ID = 1
-BW_DETECTOR_LDR_INPUT_ID = 2
+
+# makes the versioned ETags unique across server restarts, since versions are not persistent
+_BOOT_ID = '%x' % int(time.time())
 
 
 class Logged(object):
@@ -20,174 +35,958 @@ class Logged(object):
         self.logger = logging.getLogger(self.__class__.__name__)
 
 
-class WSBarrierSample(RequestHandler, Logged):
-    def get(self):
-        try:
-            current_mA = self.application.controller.sample_barrier_input()
-        except IOError as e:
-            self.set_status(status_code=404, reason="IOError (barrier sensor)")
-            self.finish()
-        else:
-            self.finish(json.dumps({
-                "current": current_mA,
-            }))
+class WSHandler(DeviceBound, RequestHandler, Logged):
+    """ Base class for the API handlers.
 
+    Handlers serve the device selected by the request URL (see devices.DeviceBound). Hardware
+    operations must be run through :py:meth:`run_on_device` so that they are executed by the
+    device hardware worker, and not in the IOLoop thread.
 
-class WSBarrierSampleAndAnalyze(RequestHandler, Logged):
-    def get(self):
+    Provides the JSON replies, which are gzip'ed when large enough and accepted by the client.
+    Replies derived from a versioned state (e.g. the calibration data) are given an ETag built
+    from this version, so that an unchanged result costs a 304 reply without even being
+    serialized.
+
+    The replies carry a Server-Timing header, giving the durations of the request processing
+    stages (see the timing module).
+    """
+    GZIP_MIN_LENGTH = 512
+
+    timings = None
+
+    def prepare(self):
+        self.timings = timing.Timings()
+        super(WSHandler, self).prepare()
+
+    def get_number_argument(self, name, default=None, convert=float):
+        """ Returns a numeric argument of the request.
+
+        :param convert: the type of the number
+        :raise HTTPError: 400 if the argument is not a valid number
+        """
+        value = self.get_argument(name, None)
+        if not value:
+            return default
         try:
-            current_mA = self.application.controller.sample_barrier_input()
-        except IOError as e:
-            self.set_status(status_code=404, reason="IOError (barrier sensor)")
-            self.finish()
+            return convert(value)
+        except ValueError:
+            raise HTTPError(400, reason="invalid %s argument (%s)" % (name, value))
+
+    def run_on_device(self, fn, *args, **kwargs):
+        """ Runs a hardware operation on the device worker.
+
+        :return: a future resolved with the operation result
+        """
+        return self.device.run(timing.collected(self.timings, fn), *args, **kwargs)
+
+    def finish(self, chunk=None):
+        if self.timings and not self._headers_written:
+            self.timings.add(timing.TOTAL, self.request.request_time())
+            self.set_header('Server-Timing', self.timings.header())
+        return super(WSHandler, self).finish(chunk)
+
+    def reply_hardware_error(self, error, what):
+        """ Replies to a request failed because of a hardware error, with a 503 status, and
+        the delay after which the hardware will be tried again if it is disabled.
+
+        :param IOError error: the error
+        :param str what: the failed hardware, for the reply reason
+        """
+        if not isinstance(error, CircuitOpen):
+            self.logger.error("%s hardware error : %s", what, error)
+        self.set_status(status_code=503, reason="hardware error (%s)" % what)
+        retry_after = self.controller.breaker.retry_after()
+        if retry_after:
+            self.set_header('Retry-After', int(math.ceil(retry_after)))
+        self.finish()
+
+    def finish_frames(self, samples=None, data=None):
+        """ Sends samples as binary frames (see the frames module).
+
+        The ids of the sensors, which the frames refer to by index, are given in the
+        X-Sensors header as a comma separated list.
+
+        :param samples: the samples, as (time, sensor index, value) tuples
+        :param str data: the already encoded frames, as an alternative to the samples
+        """
+        with self.timings.span(timing.JSON):
+            if data is None:
+                data = frames.encode(samples)
+        self.set_header('Content-Type', frames.CONTENT_TYPE)
+        self.set_header('X-Sensors', ','.join(self.controller.sensor_ids))
+        self.finish(data)
+
+    def compute_etag(self):
+        # replies without a version (e.g. samples) change at each call : don't waste time hashing them
+        return None
+
+    def finish_json(self, data, version=None):
+        """ Sends a JSON reply.
+
+        :param data: the reply content
+        :param version: the version of the state the reply is derived from, if any
+        """
+        if version is not None:
+            self.set_header('Etag', 'W/"%s-%s-%s"' % (self.__class__.__name__, _BOOT_ID, version))
+            if self.check_etag_header():
+                self.set_status(304)
+                self.finish()
+                return
+
+        with self.timings.span(timing.JSON):
+            body = json.dumps(data)
+            self.set_header('Content-Type', 'application/json; charset=UTF-8')
+
+            if len(body) >= self.GZIP_MIN_LENGTH and 'gzip' in self.request.headers.get('Accept-Encoding', ''):
+                buf = StringIO()
+                gz = gzip.GzipFile(mode='wb', fileobj=buf, compresslevel=6)
+                try:
+                    gz.write(body)
+                finally:
+                    gz.close()
+                body = buf.getvalue()
+                self.set_header('Content-Encoding', 'gzip')
+
+        self.add_header('Vary', 'Accept-Encoding')
+        self.finish(body)
+
+
+class Arbitrated(object):
+    """ Mixin for handlers using the hardware of a demonstrator, which must go through
+    its arbiter.
+
+    Clients are identified by a cookie. The hardware is only driven on behalf of the client
+    holding the lease on the demonstrator. Other clients are viewers, and get the results
+    published for the lease holder.
+    """
+    demonstrator = None
+    _client_id = None
+
+    @property
+    def arbiter(self):
+        return self.controller.arbiter(self.demonstrator)
+
+    @property
+    def client_id(self):
+        if not self._client_id:
+            self._client_id = self.get_cookie(CLIENT_ID_COOKIE)
+            if not self._client_id:
+                self._client_id = uuid.uuid4().hex
+                self.set_cookie(CLIENT_ID_COOKIE, self._client_id)
+        return self._client_id
+
+    def claim_lease(self):
+        return self.arbiter.claim(self.client_id)
+
+    def reply_and_publish(self, kind, result):
+        """ Sends the result of an operation done for the lease holder, and publishes it
+        for the viewers, keyed by the light source setting in effect.
+        """
+        light = self.controller.light_state(self.demonstrator)
+        self.arbiter.publish((kind, light), result)
+        self.finish_json(result)
+
+    def reply_as_viewer(self, kind):
+        """ Sends the last result published for the lease holder in the light source setting
+        the viewer asked for.
+        """
+        light = self.arbiter.viewer_state(
+            self.client_id,
+            default=self.controller.light_state(self.demonstrator)
+        )
+        result = self.arbiter.last_result((kind, light))
+        if result is None:
+            self.reply_in_use()
         else:
-            detection = self.application.controller.analyze_barrier_input(current_mA)
-            self.finish(json.dumps({
-                "current": current_mA,
-                "detection": detection
-            }))
+            result = dict(result)
+            result['viewer'] = 1
+            self.finish_json(result)
 
+    def reply_in_use(self):
+        self.set_status(status_code=409, reason="demonstrator in use")
+        self.finish()
 
-class WSBarrierLight(RequestHandler, Logged):
-    def post(self):
-        status = self.get_argument("status") == '1'
-        self.application.controller.set_barrier_light(status);
 
+class SensorBound(object):
+    """ Mixin for handlers serving a sensor of the device.
 
-class WSBarrierCalibrationSample(WSBarrierSample):
-    def get(self):
-        self.application.controller.set_barrier_light(True);
-        time.sleep(2)
-        super(WSBarrierCalibrationSample, self).get()
-        self.application.controller.set_barrier_light(False);
+    The sensor is selected by the "sensor_id" group of the route pattern, or by the
+    "sensor_id" initialization argument for the routes dedicated to a given sensor.
+    """
+    sensor_id = None
+    sensor = None
+
+    def initialize(self, sensor_id=None):
+        self.sensor_id = sensor_id
 
+    def prepare(self):
+        super(SensorBound, self).prepare()
+        if not self.prepared:
+            return
 
-class WSBarrierCalibrationStatus(RequestHandler, Logged):
+        self.sensor_id = self.path_kwargs.pop('sensor_id', self.sensor_id)
+        try:
+            self.sensor = self.controller.sensor(self.sensor_id)
+        except KeyError:
+            raise HTTPError(404, reason="unknown sensor (%s)" % self.sensor_id)
+
+    @property
+    def demonstrator(self):
+        # each sensor has its own arbiter
+        return self.sensor_id
+
+    def reply_stale_or_error(self, error, make_reply=None):
+        """ Replies to a sampling failed because of a hardware error with the last good value
+        of the sensor, flagged as stale, if there is a usable one (see
+        controller.last_good_input). A 503 is replied otherwise.
+
+        :param IOError error: the error
+        :param make_reply: the function building the reply from the current, if not the plain current
+        """
+        last = self.controller.last_good_input(self.sensor_id)
+        if not last:
+            self.reply_hardware_error(error, '%s sensor' % self.sensor_id)
+            return
+
+        current_mA, age = last
+        reply = make_reply(current_mA) if make_reply else {"current": current_mA}
+        reply.update(stale=1, age=age)
+        self.finish_json(reply)
+
+
+class WSSensors(WSHandler):
     def get(self):
-        self.finish(json.dumps({
-            "calibrated": 1 if self.application.controller.barrier_is_calibrated() else 0
-        }))
+        controller = self.controller
+        self.finish_json({
+            "sensors": [
+                dict(sensor.as_dict(), calibrated=1 if controller.is_calibrated(sensor.id) else 0)
+                for sensor in controller.sensors
+            ]
+        }, version=controller.get_calibration_version())
 
 
-class WSBarrierCalibrationStore(RequestHandler, Logged):
-    def post(self):
-        free, occupied = (float(self.get_argument(a)) for a in ('free', 'occupied'))
-        self.logger.info("storing references : free=%f occupied=%f", free, occupied)
-        self.application.controller.set_barrier_reference_levels(free, occupied)
-        self.application.controller.save_calibration()
+class WSSensorsSample(WSHandler):
+    """ Samples all the sensors of the device (or those listed by the "ids" argument) at once.
 
+    The sampling does not change the light sources, and the conversions are shared with
+    the other readers of the sensors, so that no lease is required.
 
-class WSBWDetectorSample(RequestHandler, Logged):
+    With the "format=binary" argument, the samples are replied as binary frames (see
+    :py:meth:`WSHandler.finish_frames`).
+    """
+    @gen.coroutine
     def get(self):
+        ids = self.get_argument('ids', None)
+        ids = ids.split(',') if ids else None
+        unknown = [sensor_id for sensor_id in ids or [] if sensor_id not in self.controller.sensor_ids]
+        if unknown:
+            self.set_status(status_code=404, reason="unknown sensor(s) (%s)" % ', '.join(unknown))
+            self.finish()
+            return
+
         try:
-            current_mA = self.application.controller.sample_bw_detector_input()
+            sampled_at, currents = yield self.run_on_device(self.controller.sample_inputs, ids)
         except IOError as e:
-            self.set_status(status_code=404, reason="IOError (B/W detector sensor)")
+            stale = dict(
+                (sensor_id, self.controller.last_good_input(sensor_id))
+                for sensor_id in ids or self.controller.sensor_ids
+            )
+            if None in stale.values():
+                self.reply_hardware_error(e, 'sensors')
+            else:
+                self.finish_json({
+                    "currents": dict((sensor_id, current) for sensor_id, (current, _) in stale.iteritems()),
+                    "stale": 1,
+                    "age": max(age for _, age in stale.itervalues())
+                })
+        else:
+            if self.get_argument('format', None) == 'binary':
+                # same time base as the history and the sample log (virtual while replaying)
+                self.finish_frames(
+                    (sampled_at, self.controller.sensor_ids.index(sensor_id), current)
+                    for sensor_id, current in currents.iteritems()
+                )
+            else:
+                self.finish_json({
+                    "currents": currents
+                })
+
+
+class WSSensorsHistory(WSHandler):
+    """ The recent samples of the device sensors.
+
+    The optional "since" argument gives the time (in seconds since the epoch) after which the
+    returned samples have been taken. The samples are replied as binary frames with the
+    "format=binary" argument (see :py:meth:`WSHandler.finish_frames`), and as a JSON list of
+    [time, sensor index, value] triplets otherwise, together with the sensor ids.
+    """
+    def get(self):
+        since = self.get_number_argument('since')
+        history = self.controller.history
+
+        if self.get_argument('format', None) == 'binary':
+            self.finish_frames(data=history.encode(since))
+        else:
+            self.finish_json({
+                "sensors": self.controller.sensor_ids,
+                "samples": history.samples(since)
+            })
+
+
+class WSSensorExport(SensorBound, WSHandler):
+    """ Export of the logged samples of a sensor, as CSV or as binary frames (see
+    :py:meth:`WSHandler.finish_frames`).
+
+    The optional "since" and "until" arguments give the time range (in seconds since the epoch)
+    of the exported samples. The samples are read from the log by chunks in the device export
+    worker, and each chunk is sent before the next one is read, so that the memory used does not
+    depend on the size of the export, and the reading is paced by the client download.
+    """
+    def _csv(self, samples):
+        return ''.join('%.3f,%.4f\r\n' % (t, value) for t, _, value in samples)
+
+    @gen.coroutine
+    def get(self, export_format):
+        log = self.controller.sample_log
+        if not log:
+            self.set_status(status_code=404, reason="samples are not logged")
             self.finish()
+            return
+
+        since = self.get_number_argument('since')
+        until = self.get_number_argument('until')
+
+        if export_format == 'csv':
+            self.set_header('Content-Type', 'text/csv; charset=UTF-8')
+            self.write('time,current\r\n')
+            encode = self._csv
         else:
-            self.finish(json.dumps({
-                "current": current_mA
-            }))
+            self.set_header('Content-Type', frames.CONTENT_TYPE)
+            self.set_header('X-Sensors', ','.join(self.controller.sensor_ids))
+            encode = frames.encode
+        self.set_header(
+            'Content-Disposition',
+            'attachment; filename="%s-%s.%s"' % (self.device.id, self.sensor_id, export_format)
+        )
 
+        chunks = log.export(self.controller.sensor_ids.index(self.sensor_id), since, until)
 
-class WSBWDetectorSampleAndAnalyze(RequestHandler, Logged):
+        def read_chunk():
+            chunk = next(chunks, None)
+            return encode(chunk) if chunk else None
+
+        try:
+            while True:
+                data = yield self.device.export_worker.submit(read_chunk)
+                if data is None:
+                    break
+                self.write(data)
+                yield self.flush()
+        except StreamClosedError:
+            self.logger.info('export of %s samples aborted by the client', self.sensor_id)
+            return
+        finally:
+            chunks.close()
+        self.finish()
+
+
+class WSSensorSample(SensorBound, Arbitrated, WSHandler):
+    @gen.coroutine
     def get(self):
+        if not self.claim_lease():
+            self.reply_as_viewer('sample')
+            return
+
         try:
-            current_mA = self.application.controller.sample_bw_detector_input()
+            current_mA = yield self.run_on_device(self.controller.sample_input, self.sensor_id)
         except IOError as e:
-            self.set_status(status_code=404, reason="IOError (B/W detector sensor)")
-            self.finish()
+            self.reply_stale_or_error(e)
         else:
-            color = self.application.controller.analyze_bw_detector_input(current_mA)
-            self.finish(json.dumps({
+            self.reply_and_publish('sample', {
                 "current": current_mA,
-                "color": "white" if color == self.application.controller.BW_WHITE else "black"
-            }))
+            })
+
+
+class WSSensorSampleAndAnalyze(SensorBound, Arbitrated, WSHandler):
+    @gen.coroutine
+    def get(self):
+        if self.sensor.analyzer not in sensors.REFERENCE_NAMES:
+            self.set_status(status_code=400, reason="sensor %s cannot be analyzed" % self.sensor_id)
+            self.finish()
+            return
+
+        if not self.claim_lease():
+            self.reply_as_viewer('analyze')
+            return
+
+        try:
+            current_mA = yield self.run_on_device(self.controller.sample_for_analysis, self.sensor_id)
+        except IOError as e:
+            self.reply_stale_or_error(e, self._analyze)
+        else:
+            self.reply_and_publish('analyze', self._analyze(current_mA))
+
+    def _analyze(self, current_mA):
+        with timing.collecting(self.timings):
+            result = self.controller.analyze_input(self.sensor_id, current_mA)
+        reply = {"current": current_mA}
+        if self.sensor.analyzer == sensors.ANALYZER_THRESHOLD:
+            reply["detection"] = result
+        else:
+            reply["color"] = _bw_color_name(self.controller, result)
+        return reply
 
 
-class WSBWDetectorLight(RequestHandler, Logged):
+class WSSensorLight(SensorBound, Arbitrated, WSHandler):
+    @gen.coroutine
     def post(self):
+        if self.sensor.led_gpio is None:
+            self.set_status(status_code=400, reason="sensor %s has no light" % self.sensor_id)
+            self.finish()
+            return
+
         status = self.get_argument("status") == '1'
-        self.application.controller.set_bw_detector_light(status);
+        if self.claim_lease():
+            yield self.run_on_device(self.controller.set_light, self.sensor_id, status)
+        else:
+            self.arbiter.set_viewer_state(self.client_id, status)
 
 
-class WSBWDetectorCalibrationSample(WSBWDetectorSample):
+class WSSensorCalibrationSample(SensorBound, Arbitrated, WSHandler):
+    @gen.coroutine
     def get(self):
-        self.application.controller.set_bw_detector_light(True);
-        time.sleep(2)
-        super(WSBWDetectorCalibrationSample, self).get()
-        self.application.controller.set_bw_detector_light(False);
+        if self.sensor.led_gpio is None:
+            self.set_status(status_code=400, reason="sensor %s has no light" % self.sensor_id)
+            self.finish()
+            return
 
+        if not self.claim_lease():
+            self.reply_in_use()
+            return
 
-class WSBWDetectorCalibrationStatus(RequestHandler, Logged):
+        try:
+            reply = yield self.run_on_device(self.controller.sample_reference, self.sensor_id)
+        except IOError as e:
+            self.reply_hardware_error(e, '%s sensor' % self.sensor_id)
+        else:
+            self.finish_json(reply)
+
+
+class WSSensorCalibrationStatus(SensorBound, WSHandler):
     def get(self):
-        self.finish(json.dumps({
-            "calibrated": 1 if self.application.controller.bw_detector_is_calibrated() else 0
-        }))
+        controller = self.controller
+        self.finish_json({
+            "calibrated": 1 if controller.is_calibrated(self.sensor_id) else 0
+        }, version=controller.get_calibration_version())
 
 
-class WSBWDetectorCalibrationStore(RequestHandler, Logged):
+class WSSensorCalibrationStore(SensorBound, Arbitrated, WSHandler):
+    @gen.coroutine
     def post(self):
-        black, white = (float(self.get_argument(a)) for a in ('b', 'w'))
-        self.logger.info("storing references : black=%f white=%f", black, white)
-        self.application.controller.set_bw_detector_reference_levels(black, white)
-        self.application.controller.save_calibration()
+        names = self.sensor.reference_names
+        if not names:
+            self.set_status(status_code=400, reason="sensor %s has no reference levels" % self.sensor_id)
+            self.finish()
+            return
 
+        if not self.claim_lease():
+            self.reply_in_use()
+            return
 
-class WSColorDetectorSample(RequestHandler, Logged):
-    def get(self):
-        color = self.get_argument('color', None)
-        if color and color in '0rgb':
-            self.application.controller.set_color_detector_light('0rgb'.index(color))
-        time.sleep(1)
+        levels = [float(self.get_argument(a)) for a in names]
+        self.logger.info(
+            "storing %s references : %s", self.sensor_id,
+            ' '.join('%s=%f' % (name, level) for name, level in zip(names, levels))
+        )
+
+        def store():
+            self.controller.set_reference_levels(self.sensor_id, levels)
+            self.controller.save_calibration()
+
+        yield self.run_on_device(store)
+
+
+class WSSensorResponseMeasure(SensorBound, Arbitrated, WSHandler):
+    """ Measures the step response of a sensor LDR, and stores it with the calibration data.
+    """
+    @gen.coroutine
+    def post(self):
+        if not self.claim_lease():
+            self.reply_in_use()
+            return
 
         try:
-            current_mA = self.application.controller.sample_color_detector_input()
+            reply = yield self.run_on_device(self.controller.measure_response, self.sensor_id)
         except IOError as e:
-            self.set_status(status_code=404, reason="IOError (color_detector)")
+            self.reply_hardware_error(e, '%s sensor' % self.sensor_id)
+        except ControllerException as e:
+            self.set_status(status_code=422, reason=str(e))
             self.finish()
         else:
-            self.finish(json.dumps({
-                "current": current_mA
-            }))
-        finally:
+            self.controller.save_calibration()
+            self.finish_json(reply)
+
+
+class WSColorDetectorSample(Arbitrated, WSHandler):
+    demonstrator = DemonstratorController.COLOR_DETECTOR
+
+    # the colors of the "color" argument, in light color order
+    COLORS = ('0', 'r', 'g', 'b')
+
+    @gen.coroutine
+    def get(self):
+        color = self.get_argument('color', None)
+
+        if not self.claim_lease():
+            # viewers can only follow the lease holder cycle, not run calibration sequences
             if color:
-                self.application.controller.set_color_detector_light(0)
+                self.reply_in_use()
+            else:
+                self.reply_as_viewer('sample')
+            return
+
+        try:
+            if color in self.COLORS:
+                # calibration sampling (the light is off for color "0")
+                reply = yield self.run_on_device(
+                    self.controller.sample_color_detector_reference, self.COLORS.index(color)
+                )
+            else:
+                current_mA = yield self.run_on_device(self.controller.sample_color_detector_component)
+        except IOError as e:
+            self.reply_hardware_error(e, 'color_detector')
+        else:
+            if color in self.COLORS:
+                self.finish_json(reply)
+            else:
+                self.reply_and_publish('sample', {
+                    "current": current_mA
+                })
 
 
-class WSColorDetectorAnalyze(RequestHandler):
+class WSColorDetectorAnalyze(WSHandler):
     def get(self):
         sample = [self.get_argument(comp) for comp in ('r', 'g', 'b')]
-        color, decomp = self.application.controller.analyze_color_input(sample)
-        self.finish(json.dumps({
+        with timing.collecting(self.timings):
+            color, decomp = self.controller.analyze_color_input(sample)
+        self.finish_json({
             "color": DemonstratorController.COLOR_NAMES[color],
             "decomp": [d * 100 for d in decomp]
-        }))
+        })
+
+
+class WSColorDetectorCycle(Arbitrated, WSHandler):
+    """ Samples the color detector lit in red, green and blue by the BlinkM color cycle script
+    (see controller.sample_color_cycle), and analyzes the result if the detector is calibrated.
+    """
+    demonstrator = DemonstratorController.COLOR_DETECTOR
+
+    @gen.coroutine
+    def get(self):
+        if not self.claim_lease():
+            self.reply_as_viewer('cycle')
+            return
+
+        try:
+            components = yield self.run_on_device(self.controller.sample_color_cycle)
+        except IOError as e:
+            self.reply_hardware_error(e, 'color_detector')
+            return
+        except ControllerException as e:
+            self.set_status(status_code=422, reason=str(e))
+            self.finish()
+            return
+
+        reply = {"components": components}
+        if self.controller.color_detector_is_calibrated():
+            with timing.collecting(self.timings):
+                color, decomp = self.controller.analyze_color_input(components)
+            reply.update(
+                color=DemonstratorController.COLOR_NAMES[color],
+                decomp=[d * 100 for d in decomp]
+            )
+        self.reply_and_publish('cycle', reply)
 
 
-class WSColorDetectorLight(RequestHandler, Logged):
+class WSColorDetectorLight(Arbitrated, WSHandler):
+    demonstrator = DemonstratorController.COLOR_DETECTOR
+
+    @gen.coroutine
     def post(self, color):
-        self.application.controller.set_color_detector_light('0rgb'.index(color));
+        color = '0rgb'.index(color)
+        if self.claim_lease():
+            yield self.run_on_device(self.controller.set_color_detector_light, color)
+        else:
+            self.arbiter.set_viewer_state(self.client_id, color)
 
 
-class WSColorDetectorCalibrationStore(RequestHandler, Logged):
+class WSColorDetectorCalibrationStore(Arbitrated, WSHandler):
+    demonstrator = DemonstratorController.COLOR_DETECTOR
+
+    @gen.coroutine
     def post(self, color):
         if color not in ('w', 'b'):
             raise ValueError("invalid color parameter : %s" % color)
 
+        if not self.claim_lease():
+            self.reply_in_use()
+            return
+
         r, g, b = (float(self.get_argument(a)) for a in ('r', 'g', 'b'))
         self.logger.info("storing references : R=%f G=%f B=%f", r, g, b)
-        self.application.controller.set_color_detector_reference_levels(color, (r, g, b))
-        self.application.controller.save_calibration()
+
+        def store():
+            self.controller.set_color_detector_reference_levels(color, (r, g, b))
+            self.controller.save_calibration()
+
+        yield self.run_on_device(store)
+
+
+class WSColorDetectorCalibrationStatus(WSHandler):
+    def get(self):
+        controller = self.controller
+        self.finish_json({
+            "calibrated": 1 if controller.color_detector_is_calibrated() else 0
+        }, version=controller.get_calibration_version())
+
+
+class WSCalibrationData(WSHandler):
+    def get(self):
+        controller = self.controller
+        self.finish_json(
+            controller.get_calibration_cfg_as_dict(),
+            version=controller.get_calibration_version()
+        )
+
+
+class WSCalibrationJobs(Arbitrated, WSHandler):
+    """ Server-side calibration jobs (see the calibration module).
+
+    GET lists the last jobs of the device. POST starts a job sampling the reference given by the
+    "reference" argument (e.g. "free", or "w" for the color detector white balance) of the
+    sensor given by the "sensor" one, on behalf of the client holding the lease on the sensor
+    demonstrator. The reply is the initial state of the job, which URL is given by the
+    Location header.
+    """
+    def get(self):
+        self.finish_json({
+            "jobs": [job.as_dict() for job in self.device.calibration_jobs.list()]
+        })
+
+    def post(self):
+        sensor_id = self.get_argument('sensor')
+        reference = self.get_argument('reference')
+        if sensor_id not in self.controller.sensor_ids:
+            raise HTTPError(404, reason="unknown sensor (%s)" % sensor_id)
+
+        self.demonstrator = sensor_id
+        if not self.claim_lease():
+            self.reply_in_use()
+            return
+
+        try:
+            job = self.device.calibration_jobs.start(sensor_id, reference)
+        except ValueError as e:
+            self.set_status(status_code=400, reason=str(e))
+            self.finish()
+        except JobConflict as e:
+            self.set_status(status_code=409, reason=str(e))
+            self.finish()
+        else:
+            self.set_status(202)
+            self.set_header('Location', '%s/%s' % (self.request.path.rstrip('/'), job.id))
+            self.finish_json(job.as_dict())
 
 
-class WSColorDetectorCalibrationStatus(RequestHandler, Logged):
+class WSCalibrationJob(WSHandler):
+    """ The state of a calibration job.
+
+    If the "version" argument is given, the reply is delayed until the state has changed
+    since this version, the job is over, or MAX_WAIT seconds have elapsed, so that the
+    progress is followed without polling delays.
+    """
+    MAX_WAIT = 10
+
+    @gen.coroutine
+    def get(self, job_id):
+        job = self.device.calibration_jobs.get(job_id)
+        if not job:
+            raise HTTPError(404, reason="unknown calibration job (%s)" % job_id)
+
+        version = self.get_number_argument('version', convert=int)
+        if version is not None:
+            yield job.wait_change(version, self.MAX_WAIT)
+        self.finish_json(job.as_dict())
+
+
+class WSLease(Arbitrated, WSHandler):
+    """ Explicit management of the lease on a demonstrator.
+
+    GET returns the lease status of the client, POST claims (or renews) it and DELETE releases it.
+    """
+    def prepare(self):
+        super(WSLease, self).prepare()
+        if not self.prepared:
+            return
+
+        if self.path_kwargs['demonstrator'] not in self.controller.sensor_ids:
+            raise HTTPError(404, reason="unknown demonstrator (%s)" % self.path_kwargs['demonstrator'])
+
+    def get(self, demonstrator):
+        self.demonstrator = demonstrator
+        self.finish_json(self.arbiter.status(self.client_id))
+
+    def post(self, demonstrator):
+        self.demonstrator = demonstrator
+        self.claim_lease()
+        self.finish_json(self.arbiter.status(self.client_id))
+
+    def delete(self, demonstrator):
+        self.demonstrator = demonstrator
+        self.arbiter.release(self.client_id)
+        self.finish()
+
+
+class WSDevices(WSHandler):
+    needs_controller = False
+    counts_as_use = False
+
     def get(self):
-        self.finish(json.dumps({
-            "calibrated": 1 if self.application.controller.color_detector_is_calibrated() else 0
-        }))
+        self.finish_json({
+            "devices": self.application.devices.ids
+        })
+
 
+class WSHealth(WSHandler):
+    """ The readiness of the devices, and the IOLoop lag statistics (see loopmonitor).
+
+    The reply status is 503 until all the devices are ready. The optional "lag_since" argument
+    gives the time (in seconds since the epoch) from which the lag statistics are computed.
+    """
+    needs_controller = False
+    counts_as_use = False
 
-class WSCalibrationData(RequestHandler, Logged):
     def get(self):
-        self.finish(self.application.controller.get_calibration_cfg_as_dict())
\ No newline at end of file
+        devices = self.application.devices
+        lag_since = self.get_number_argument('lag_since')
+        if not devices.ready:
+            self.set_status(503)
+        self.finish_json({
+            "ready": devices.ready,
+            "devices": [device.status() for device in devices],
+            "ioloop": self.application.loop_monitor.stats(lag_since)
+        })
+
+
+class WSI2CStats(WSHandler):
+    """ The transactions statistics of the I2C buses.
+
+    The list is empty in simulation mode, since the simulated devices do not use the bus.
+    """
+    needs_controller = False
+    counts_as_use = False
+
+    def get(self):
+        self.finish_json({
+            "buses": I2CBus.all_stats()
+        })
+
+
+class WSLogs(WSHandler):
+    """ The most recent log records.
+
+    The optional "level" argument gives the minimal level of the returned records (e.g. "WARNING"),
+    and the optional "limit" one their maximum count.
+    """
+    needs_controller = False
+    counts_as_use = False
+
+    def get(self):
+        log_buffer = self.application.log_buffer
+        if log_buffer is None:
+            self.set_status(status_code=404, reason="log records not kept")
+            self.finish()
+            return
+
+        level = logging.getLevelName(self.get_argument('level', 'NOTSET').upper())
+        if not isinstance(level, int):
+            self.set_status(status_code=400, reason="invalid level")
+            self.finish()
+            return
+
+        limit = self.get_number_argument('limit', convert=int)
+        self.finish_json({
+            "records": log_buffer.records(level=level, limit=limit)
+        })
+
+
+def _bw_color_name(controller, color):
+    return "white" if color == controller.BW_WHITE else "black"
+
+
+def _analyze_color(controller, r, g, b):
+    color, decomp = controller.analyze_color_input((r, g, b))
+    return {
+        "color": controller.COLOR_NAMES[color],
+        "decomp": [d * 100 for d in decomp]
+    }
+
+
+def _bind_sensor(operation, sensor_id):
+    return lambda ctrl, **args: operation(ctrl, sensor_id, **args)
+
+
+def _store_levels(names):
+    return lambda ctrl, sid, **levels: ctrl.set_reference_levels(sid, [float(levels[name]) for name in names])
+
+
+class WSBatch(Arbitrated, WSHandler):
+    """ Runs an ordered list of controller operations in a single request.
+
+    The request body is a JSON object, which "ops" member is the list of operations to be
+    executed. Each operation is an object with the operation name in its "op" member and its
+    arguments in the optional "args" one. An argument given as a "$<n>.<field>" string is
+    replaced by the named field of the n-th (zero based) operation result, for instance to
+    store the references sampled by the preceding operations. Operations with their "always"
+    member set are executed even if a previous one failed (e.g. for switching lights off).
+
+    The operations are executed in sequence as a single operation of the device hardware
+    worker, and thus with exclusive access to the hardware. The leases of the involved
+    demonstrators must be held by the client. Calibration changes are saved once at the end
+    of the batch.
+
+    The reply contains the list of the operations results (null for operations skipped
+    because of an error), and the description of the error if any.
+    """
+    MAX_WAIT = 5
+
+    # suffixes of the operations changing the calibration data
+    CALIBRATION_OPERATIONS = ('.store', '.measure_response')
+
+    @staticmethod
+    def operations(controller):
+        """ Returns the operations available on a device, built from its sensors registry.
+
+        The operations of a sensor are named "<sensor id>.<operation>", the sensor being the
+        demonstrator which lease they require.
+
+        :return: a dictionary giving for each operation name the demonstrator and the
+            implementation, as a function of the controller and of the operation arguments
+        :rtype: dict
+        """
+        operations = {
+            'wait': (
+                None,
+                lambda ctrl, delay: sampling.clock.sleep(min(float(delay), WSBatch.MAX_WAIT))
+            ),
+        }
+        for sensor in controller.sensors:
+            ops = {
+                'sample': lambda ctrl, sid: {"current": ctrl.sample_input(sid)},
+                'sample_settled': lambda ctrl, sid: ctrl.sample_settled(sid),
+            }
+
+            if sensor.analyzer == sensors.ANALYZER_COLOR:
+                ops.update({
+                    'light': lambda ctrl, sid, color: ctrl.set_color_detector_light('0rgb'.index(color)),
+                    'measure_response': lambda ctrl, sid: ctrl.measure_response(sid),
+                    'analyze': lambda ctrl, sid, r, g, b: _analyze_color(ctrl, r, g, b),
+                    'store': lambda ctrl, sid, color, r, g, b: ctrl.set_color_detector_reference_levels(
+                        color, [float(r), float(g), float(b)]
+                    ),
+                })
+
+            elif sensor.led_gpio is not None:
+                ops.update({
+                    'light': lambda ctrl, sid, on: ctrl.set_light(sid, bool(on)),
+                    'measure_response': lambda ctrl, sid: ctrl.measure_response(sid),
+                })
+
+            if sensor.analyzer in sensors.REFERENCE_NAMES:
+                ops['store'] = _store_levels(sensors.REFERENCE_NAMES[sensor.analyzer])
+                if sensor.analyzer == sensors.ANALYZER_THRESHOLD:
+                    ops['analyze'] = lambda ctrl, sid, current: {
+                        "detection": ctrl.analyze_input(sid, current)
+                    }
+                else:
+                    ops['analyze'] = lambda ctrl, sid, current: {
+                        "color": _bw_color_name(ctrl, ctrl.analyze_input(sid, current))
+                    }
+
+            operations.update(
+                ('%s.%s' % (sensor.id, name), (sensor.id, _bind_sensor(op, sensor.id)))
+                for name, op in ops.iteritems()
+            )
+        return operations
+
+    def _parse(self):
+        try:
+            ops = json.loads(self.request.body)['ops']
+            return [(op['op'], op.get('args', {}), bool(op.get('always'))) for op in ops]
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError('invalid batch (%s)' % e)
+
+    @staticmethod
+    def _resolve(args, results):
+        resolved = {}
+        for name, value in args.iteritems():
+            if isinstance(value, basestring) and value.startswith('$'):
+                index, field = value[1:].split('.', 1)
+                value = results[int(index)][field]
+            resolved[str(name)] = value
+        return resolved
+
+    def _execute_batch(self, ops, operations):
+        controller = self.controller
+        results = []
+        reply = {"results": results}
+        stored = False
+
+        for name, args, always in ops:
+            if 'error' in reply and not always:
+                results.append(None)
+                continue
+
+            try:
+                result = operations[name][1](controller, **self._resolve(args, results))
+            except Exception as e:
+                self.logger.error("batch operation %s failed : %s", name, e)
+                results.append(None)
+                reply.setdefault('error', {
+                    "index": len(results) - 1,
+                    "op": name,
+                    "message": str(e)
+                })
+            else:
+                results.append(result)
+                stored = stored or name.endswith(self.CALIBRATION_OPERATIONS)
+
+        if stored:
+            controller.save_calibration()
+
+        return reply
+
+    @gen.coroutine
+    def post(self):
+        operations = self.operations(self.controller)
+        try:
+            ops = self._parse()
+            unknown = [name for name, _, _ in ops if name not in operations]
+            if unknown:
+                raise ValueError('unknown operation(s) : %s' % ', '.join(unknown))
+        except ValueError as e:
+            self.set_status(status_code=400, reason=str(e))
+            self.finish()
+            return
+
+        involved = set(operations[name][0] for name, _, _ in ops)
+        demonstrators = [d for d in self.controller.sensor_ids if d in involved]
+
+        for demonstrator in demonstrators:
+            self.demonstrator = demonstrator
+            if not self.claim_lease():
+                self.reply_in_use()
+                return
+
+        reply = yield self.run_on_device(self._execute_batch, ops, operations)
+        self.finish_json(reply)
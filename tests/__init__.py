@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+""" Unit tests of the hardware independent parts of the application.
+
+They use the standard library unittest module, and are run from the project root with :
+
+    $ python -m unittest discover -s tests -t .
+
+The application modules being imported as top level ones (as done by launch.py), the
+sources directory is added to the modules path.
+"""
+
+__author__ = 'Eric Pascual'
+
+import os
+import sys
+import logging
+
+# the tested modules log their errors, which are expected here
+logging.getLogger().addHandler(logging.NullHandler())
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Eric Pascual'
+
+import unittest
+
+import arbitration
+from arbitration import DemonstratorArbiter
+from tracing import VirtualClock
+
+
+class DemonstratorArbiterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock(1000.)
+        self._time, arbitration.time = arbitration.time, self.clock
+        self.arbiter = DemonstratorArbiter('test', lease_ttl=10, queue_ttl=3)
+
+    def tearDown(self):
+        arbitration.time = self._time
+
+    def test_grant(self):
+        self.assertTrue(self.arbiter.claim('a'))
+        self.assertTrue(self.arbiter.claim('a'))
+        self.assertEqual(self.arbiter.status('a'), {"holder": 1, "leased": 1, "position": 0, "expires_in": 10})
+
+    def test_queue(self):
+        self.arbiter.claim('a')
+        self.assertFalse(self.arbiter.claim('b'))
+        self.assertFalse(self.arbiter.claim('c'))
+        self.assertEqual(self.arbiter.status('c')['position'], 2)
+
+        self.arbiter.release('a')
+        # the lease goes to the head of the queue
+        self.assertFalse(self.arbiter.claim('c'))
+        self.assertTrue(self.arbiter.claim('b'))
+        self.assertEqual(self.arbiter.status('c')['position'], 1)
+
+    def test_renewal(self):
+        self.arbiter.claim('a')
+        self.clock.sleep(8)
+        self.arbiter.claim('a')
+        self.clock.sleep(8)
+        self.assertFalse(self.arbiter.claim('b'))
+
+    def test_expiry(self):
+        self.arbiter.claim('a')
+        self.clock.sleep(11)
+        self.assertEqual(self.arbiter.status('a')['leased'], 0)
+        self.assertTrue(self.arbiter.claim('b'))
+
+    def test_waiting_client_keeps_its_turn(self):
+        self.arbiter.claim('a')
+        for _ in range(6):
+            self.clock.sleep(2)
+            self.arbiter.claim('b')
+        # the lease of "a" has expired
+        self.assertFalse(self.arbiter.claim('c'))
+        self.assertTrue(self.arbiter.claim('b'))
+
+    def test_gone_waiting_client_is_dropped(self):
+        self.arbiter.claim('a')
+        self.arbiter.claim('b')
+        self.clock.sleep(11)
+        # "b" left without releasing its place, and does not block the others
+        self.assertTrue(self.arbiter.claim('c'))
+        self.assertEqual(self.arbiter.status('b')['position'], 0)
+
+    def test_release_from_queue(self):
+        self.arbiter.claim('a')
+        self.arbiter.claim('b')
+        self.arbiter.claim('c')
+        self.arbiter.release('b')
+        self.assertEqual(self.arbiter.status('c')['position'], 1)
+
+    def test_release_by_other_client(self):
+        self.arbiter.claim('a')
+        self.arbiter.release('b')
+        self.assertEqual(self.arbiter.status('a')['holder'], 1)
+
+    def test_results_cleared_with_lease(self):
+        self.arbiter.claim('a')
+        self.arbiter.publish('sample', {"current": 1.})
+        self.assertEqual(self.arbiter.last_result('sample'), {"current": 1.})
+        self.arbiter.release('a')
+        self.assertIsNone(self.arbiter.last_result('sample'))
+
+    def test_viewer_state(self):
+        self.arbiter.claim('a')
+        self.arbiter.claim('b')
+        self.arbiter.set_viewer_state('b', True)
+        self.assertTrue(self.arbiter.viewer_state('b'))
+        self.assertEqual(self.arbiter.viewer_state('c', default=False), False)
+
+
+if __name__ == '__main__':
+    unittest.main()
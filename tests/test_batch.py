@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Eric Pascual'
+
+import unittest
+
+import sensors
+from sensors import Sensor
+from wsapi import WSBatch
+
+
+class FakeController(object):
+    """ Controller recording the calls made by the batch operations.
+    """
+    BW_WHITE = 'w'
+
+    def __init__(self):
+        self.sensors = [
+            Sensor('barrier', 1, led_gpio=12, analyzer=sensors.ANALYZER_THRESHOLD),
+            Sensor('gate', 4, led_gpio=16, analyzer=sensors.ANALYZER_THRESHOLD),
+            Sensor('bw_detector', 2, led_gpio=13, analyzer=sensors.ANALYZER_BW),
+            Sensor('color_detector', 3, analyzer=sensors.ANALYZER_COLOR),
+            Sensor('ambient', 5),
+        ]
+        self.calls = []
+
+    def __getattr__(self, name):
+        def call(*args):
+            self.calls.append((name,) + args)
+            return 0.25
+        return call
+
+
+class ResolveTestCase(unittest.TestCase):
+    RESULTS = [{"current": 0.5}, None, {"current": 0.75, "settled": True}]
+
+    def test_references(self):
+        args = WSBatch._resolve({"free": "$0.current", "occupied": "$2.current", "on": 1}, self.RESULTS)
+        self.assertEqual(args, {"free": 0.5, "occupied": 0.75, "on": 1})
+
+    def test_field_with_dots(self):
+        self.assertEqual(WSBatch._resolve({"x": "$0.a.b"}, [{"a.b": 1}]), {"x": 1})
+
+    def test_plain_strings(self):
+        self.assertEqual(WSBatch._resolve({u"color": u"r"}, []), {"color": "r"})
+
+    def test_invalid_references(self):
+        self.assertRaises(KeyError, WSBatch._resolve, {"x": "$0.voltage"}, self.RESULTS)
+        self.assertRaises(IndexError, WSBatch._resolve, {"x": "$5.current"}, self.RESULTS)
+        self.assertRaises(TypeError, WSBatch._resolve, {"x": "$1.current"}, self.RESULTS)
+        self.assertRaises(ValueError, WSBatch._resolve, {"x": "$first.current"}, self.RESULTS)
+
+
+class OperationsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.controller = FakeController()
+        self.operations = WSBatch.operations(self.controller)
+
+    def run_op(self, name, **args):
+        demonstrator, operation = self.operations[name]
+        return operation(self.controller, **args)
+
+    def test_operations_follow_sensors(self):
+        self.assertIn('gate.sample', self.operations)
+        self.assertIn('gate.store', self.operations)
+        self.assertIn('ambient.sample', self.operations)
+        self.assertNotIn('ambient.light', self.operations)
+        self.assertNotIn('ambient.store', self.operations)
+        self.assertEqual(self.operations['gate.light'][0], 'gate')
+        self.assertIsNone(self.operations['wait'][0])
+
+    def test_sensor_dispatch(self):
+        self.assertEqual(self.run_op('gate.sample'), {"current": 0.25})
+        self.run_op('gate.light', on=1)
+        self.run_op('gate.store', free='0.5', occupied=0.25)
+        self.assertEqual(self.controller.calls, [
+            ('sample_input', 'gate'),
+            ('set_light', 'gate', True),
+            ('set_reference_levels', 'gate', [0.5, 0.25]),
+        ])
+
+    def test_analyze(self):
+        self.assertEqual(self.run_op('barrier.analyze', current=0.5), {"detection": 0.25})
+        self.assertEqual(self.run_op('bw_detector.analyze', current=0.5), {"color": "black"})
+        self.assertEqual(self.controller.calls[-1], ('analyze_input', 'bw_detector', 0.5))
+
+    def test_color_detector(self):
+        self.run_op('color_detector.light', color='g')
+        self.run_op('color_detector.store', color='w', r=1, g='2', b=3)
+        self.assertEqual(self.controller.calls, [
+            ('set_color_detector_light', 2),
+            ('set_color_detector_reference_levels', 'w', [1., 2., 3.]),
+        ])
+
+    def test_sensor_cannot_be_overridden(self):
+        self.assertRaises(TypeError, self.run_op, 'gate.sample', sid='barrier')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Eric Pascual'
+
+import unittest
+
+import breaker
+import sampling
+from breaker import CircuitBreaker, CircuitOpen, GuardedADC
+from tracing import VirtualClock
+
+
+class BreakerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock(1000.)
+        self._time, breaker.time = breaker.time, self.clock
+        self._clock, sampling.clock = sampling.clock, self.clock
+        self.breaker = CircuitBreaker('test', threshold=3, reset_delay=10)
+
+    def tearDown(self):
+        breaker.time = self._time
+        sampling.clock = self._clock
+
+    def trip(self):
+        for _ in range(self.breaker.threshold):
+            self.breaker.check()
+            self.breaker.failure()
+
+
+class CircuitBreakerTestCase(BreakerTestCase):
+    def test_closed_until_threshold(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.check()
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_success_resets_failures_count(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        self.breaker.success()
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_open_rejects_calls(self):
+        self.trip()
+        with self.assertRaises(CircuitOpen) as cm:
+            self.breaker.check()
+        self.assertEqual(cm.exception.retry_after, 10)
+        self.clock.sleep(4)
+        self.assertEqual(self.breaker.retry_after(), 6)
+
+    def test_half_open_lets_a_single_trial_through(self):
+        self.trip()
+        self.clock.sleep(10)
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.breaker.check()
+        self.assertRaises(CircuitOpen, self.breaker.check)
+
+    def test_successful_trial_closes(self):
+        self.trip()
+        self.clock.sleep(10)
+        self.breaker.check()
+        self.breaker.success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.breaker.retry_after(), 0)
+        self.breaker.check()
+
+    def test_failed_trial_opens_again(self):
+        self.trip()
+        self.clock.sleep(10)
+        self.breaker.check()
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.retry_after(), 10)
+
+
+class FlakyADC(object):
+    """ ADC driver failing a given number of times before returning readings.
+    """
+    def __init__(self, failures, error=IOError):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def readVoltages(self, channels):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error('read failed')
+        return [float(c) for c in channels]
+
+
+class GuardedADCTestCase(BreakerTestCase):
+    def test_retries_failed_reads(self):
+        adc = GuardedADC(FlakyADC(2), self.breaker, retries=2, backoff=0.05)
+        self.assertEqual(adc.readVoltages([1, 2]), [1., 2.])
+        # backoff delays of 0.05 and 0.1
+        self.assertAlmostEqual(self.clock.time(), 1000.15)
+        self.assertEqual(adc.last_good(2), (self.clock.time(), 2.))
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_reports_exhausted_retries(self):
+        adc = GuardedADC(FlakyADC(3), self.breaker, retries=2)
+        self.assertRaises(IOError, adc.readVoltage, 1)
+        self.assertIsNone(adc.last_good(1))
+        self.assertEqual(self.breaker.status()['failures'], 1)
+
+    def test_trips_breaker(self):
+        adc = GuardedADC(FlakyADC(100), self.breaker, retries=0)
+        for _ in range(3):
+            self.assertRaises(IOError, adc.readVoltage, 1)
+        self.assertRaises(CircuitOpen, adc.readVoltage, 1)
+        self.assertEqual(adc._adc.calls, 3)
+
+    def test_other_errors_conclude_trial(self):
+        adc = GuardedADC(FlakyADC(100, error=ValueError), self.breaker)
+        self.trip()
+        self.clock.sleep(10)
+        self.assertRaises(ValueError, adc.readVoltage, 1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+
+if __name__ == '__main__':
+    unittest.main()
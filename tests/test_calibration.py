@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Eric Pascual'
+
+import unittest
+
+import sensors
+import calibration
+from calibration import CalibrationJob, CalibrationJobs, JobConflict
+from controller import ControllerException
+from sensors import Sensor
+
+
+class FakeController(object):
+    def __init__(self, response_error=None):
+        self._sensors = {
+            'barrier': Sensor('barrier', 1, led_gpio=12, analyzer=sensors.ANALYZER_THRESHOLD),
+            'color_detector': Sensor('color_detector', 3, analyzer=sensors.ANALYZER_COLOR),
+        }
+        self.response_error = response_error
+        self.stored_levels = {}
+        self.calls = []
+
+    def sensor(self, sensor_id):
+        return self._sensors[sensor_id]
+
+    def sample_color_detector_reference(self, color):
+        return {"current": color / 10.}
+
+    def sample_reference(self, sensor_id):
+        return {"current": 0.5}
+
+    def measure_response(self, sensor_id, store=True):
+        self.calls.append(('measure_response', sensor_id, store))
+        if self.response_error:
+            raise ControllerException(self.response_error)
+        return {"rise": 0.1, "fall": 0.2}
+
+    def get_reference_levels(self, sensor_id):
+        return self.stored_levels.get(sensor_id)
+
+    def __getattr__(self, name):
+        def call(*args):
+            self.calls.append((name,) + args)
+        return call
+
+
+class FakeDevice(object):
+    id = 'test'
+
+    def __init__(self, controller):
+        self.controller = controller
+
+
+class SyncIOLoop(object):
+    def add_callback(self, callback, *args):
+        callback(*args)
+
+
+class CalibrationJobTestCase(unittest.TestCase):
+    def test_progress(self):
+        job = CalibrationJob('barrier', 'free', ['sample'])
+        self.assertTrue(job.running)
+        job.step_started(0)
+        job.step_done(0, {"current": 0.5})
+        job.finished(references={"free": 0.5})
+        state = job.as_dict()
+        self.assertEqual(state['state'], calibration.DONE)
+        self.assertEqual(state['steps'], [
+            {"name": "sample", "state": calibration.STEP_DONE, "value": {"current": 0.5}, "error": None}
+        ])
+        self.assertEqual(state['version'], 3)
+
+    def test_failure(self):
+        job = CalibrationJob('barrier', 'free', ['sample'])
+        job.finished(error='no light')
+        self.assertFalse(job.running)
+        self.assertEqual((job.state, job.error), (calibration.FAILED, 'no light'))
+
+
+class CalibrationJobsTestCase(unittest.TestCase):
+    def execute(self, controller, sensor_id, reference):
+        jobs = CalibrationJobs(FakeDevice(controller))
+        steps = jobs._plan(sensor_id, reference)
+        job = CalibrationJob(sensor_id, reference, [name for name, _ in steps])
+        return jobs, job, jobs._execute(job, steps, SyncIOLoop())
+
+    def test_plan(self):
+        jobs = CalibrationJobs(FakeDevice(FakeController()))
+        self.assertEqual([name for name, _ in jobs._plan('color_detector', 'w')], ['r', 'g', 'b', 'response'])
+        self.assertEqual([name for name, _ in jobs._plan('color_detector', 'b')], ['r', 'g', 'b'])
+        self.assertEqual([name for name, _ in jobs._plan('barrier', 'free')], ['sample'])
+        self.assertRaises(ValueError, jobs._plan, 'barrier', 'w')
+        self.assertRaises(ValueError, jobs._plan, 'color_detector', 'free')
+
+    def test_white_balance_commits_levels_and_response(self):
+        controller = FakeController()
+        _, job, references = self.execute(controller, 'color_detector', 'w')
+        self.assertEqual(references, {'w': [0.1, 0.2, 0.3]})
+        self.assertEqual(controller.calls, [
+            ('measure_response', 'color_detector', False),
+            ('set_color_detector_reference_levels', 'w', [0.1, 0.2, 0.3]),
+            ('set_response', 'color_detector', {"rise": 0.1, "fall": 0.2}),
+            ('save_calibration',),
+        ])
+        self.assertEqual([step['state'] for step in job.steps], [calibration.STEP_DONE] * 4)
+
+    def test_failed_response_is_not_fatal(self):
+        controller = FakeController(response_error='no step response')
+        _, job, references = self.execute(controller, 'color_detector', 'w')
+        self.assertEqual(references, {'w': [0.1, 0.2, 0.3]})
+        self.assertNotIn('set_response', [call[0] for call in controller.calls])
+        self.assertEqual(controller.calls[-1], ('save_calibration',))
+        self.assertEqual(job.steps[-1]['state'], calibration.STEP_FAILED)
+        self.assertEqual(job.steps[-1]['error'], 'no step response')
+
+    def test_failed_sampling_is_fatal(self):
+        controller = FakeController()
+
+        def fail(color):
+            raise ControllerException('BlinkM not available')
+        controller.sample_color_detector_reference = fail
+        self.assertRaises(ControllerException, self.execute, controller, 'color_detector', 'b')
+        self.assertEqual(controller.calls, [])
+
+    def test_level_waits_for_the_other_one(self):
+        controller = FakeController()
+        jobs, _, references = self.execute(controller, 'barrier', 'free')
+        self.assertIsNone(references)
+        self.assertEqual(controller.calls, [])
+
+        steps = jobs._plan('barrier', 'occupied')
+        job = CalibrationJob('barrier', 'occupied', ['sample'])
+        references = jobs._execute(job, steps, SyncIOLoop())
+        self.assertEqual(references, {'free': 0.5, 'occupied': 0.5})
+        self.assertEqual(controller.calls, [('set_reference_levels', 'barrier', [0.5, 0.5]), ('save_calibration',)])
+
+    def test_level_completed_by_stored_one(self):
+        controller = FakeController()
+        controller.stored_levels['barrier'] = [0.4, 0.1]
+        _, _, references = self.execute(controller, 'barrier', 'occupied')
+        self.assertEqual(references, {'free': 0.4, 'occupied': 0.5})
+
+    def test_single_running_job(self):
+        jobs = CalibrationJobs(FakeDevice(FakeController()))
+        job = CalibrationJob('barrier', 'free', ['sample'])
+        jobs._jobs[job.id] = job
+        self.assertRaises(JobConflict, jobs.start, 'barrier', 'occupied')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Eric Pascual'
+
+import unittest
+
+import demand
+from demand import Demand
+from tracing import VirtualClock
+
+
+class DemandTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock(1000.)
+        self._time, demand.time = demand.time, self.clock
+        self.events = []
+        self.demand = Demand(
+            'test',
+            on_suspend=lambda: self.events.append('suspend'),
+            on_resume=lambda: self.events.append('resume'),
+            idle_timeout=60, client_ttl=10
+        )
+
+    def tearDown(self):
+        demand.time = self._time
+
+    def idle(self, delay):
+        """ Lets the time pass, the demand being checked every second.
+        """
+        for _ in range(int(delay)):
+            self.clock.sleep(1)
+            self.demand._check()
+
+    def test_suspends_without_users(self):
+        self.idle(59)
+        self.assertFalse(self.demand.suspended)
+        self.idle(1)
+        self.assertTrue(self.demand.suspended)
+        self.assertEqual(self.events, ['suspend'])
+
+    def test_client_counts_until_ttl(self):
+        self.demand.touch('a')
+        self.assertEqual(self.demand.users, 1)
+        self.idle(10)
+        self.assertEqual(self.demand.users, 1)
+        self.idle(1)
+        self.assertEqual(self.demand.users, 0)
+
+    def test_idle_time_starts_after_last_client(self):
+        self.idle(50)
+        self.demand.touch('a')
+        self.idle(69)
+        self.assertFalse(self.demand.suspended)
+        self.idle(1)
+        self.assertTrue(self.demand.suspended)
+
+    def test_clients_are_counted_once(self):
+        self.demand.touch('a')
+        self.demand.touch('a')
+        self.demand.touch('b')
+        self.assertEqual(self.demand.status()['clients'], 2)
+
+    def test_resumes_on_request(self):
+        self.idle(60)
+        self.demand.touch('a')
+        self.assertFalse(self.demand.suspended)
+        self.assertEqual(self.events, ['suspend', 'resume'])
+
+    def test_holders(self):
+        self.demand.hold('job')
+        self.demand.hold('job')
+        self.idle(100)
+        self.assertFalse(self.demand.suspended)
+        self.demand.release('job')
+        self.assertEqual(self.demand.status()['holders'], ['job'])
+        self.demand.release('job')
+        self.assertEqual(self.demand.users, 0)
+        self.idle(59)
+        self.assertFalse(self.demand.suspended)
+        self.idle(1)
+        self.assertTrue(self.demand.suspended)
+
+    def test_hold_resumes(self):
+        self.idle(60)
+        self.demand.hold('job')
+        self.assertEqual(self.events, ['suspend', 'resume'])
+
+
+if __name__ == '__main__':
+    unittest.main()
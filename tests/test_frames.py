@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Eric Pascual'
+
+import unittest
+import struct
+import os
+import shutil
+import tempfile
+
+import frames
+from frames import SampleHistory, SampleLog
+
+
+class FramesTestCase(unittest.TestCase):
+    SAMPLES = [(1500000000.125, 0, 0.5), (1500000000.25, 2, -1.25), (1500000001., 65535, 3.)]
+
+    def test_frame_layout(self):
+        self.assertEqual(frames.FRAME.size, 14)
+        data = frames.encode([(1.5, 3, 0.25)])
+        self.assertEqual(data, struct.pack('<d', 1.5) + struct.pack('<H', 3) + struct.pack('<f', 0.25))
+
+    def test_round_trip(self):
+        data = frames.encode(self.SAMPLES)
+        self.assertEqual(len(data), 3 * 14)
+        self.assertEqual(frames.decode(data), self.SAMPLES)
+
+    def test_decode_ignores_partial_frame(self):
+        data = frames.encode(self.SAMPLES)
+        self.assertEqual(frames.decode(data[:-1]), self.SAMPLES[:2])
+        self.assertEqual(frames.decode(''), [])
+
+    def test_values_are_single_precision(self):
+        (_, _, value), = frames.decode(frames.encode([(0., 0, 0.1)]))
+        self.assertAlmostEqual(value, 0.1, places=6)
+
+
+class SampleHistoryTestCase(unittest.TestCase):
+    def test_keeps_last_samples(self):
+        history = SampleHistory(capacity=3)
+        for i in range(5):
+            history.append(float(i), i, i / 2.)
+        self.assertEqual(len(history), 3)
+        self.assertEqual(history.samples(), [(2., 2, 1.), (3., 3, 1.5), (4., 4, 2.)])
+
+    def test_samples_since(self):
+        history = SampleHistory(capacity=10)
+        for i in range(5):
+            history.append(float(i), 0, 0.)
+        self.assertEqual([t for t, _, _ in history.samples(since=2.)], [3., 4.])
+
+    def test_encode(self):
+        history = SampleHistory(capacity=3)
+        for i in range(4):
+            history.append(float(i), i, 0.5)
+        self.assertEqual(frames.decode(history.encode(since=1.)), [(2., 2, 0.5), (3., 3, 0.5)])
+
+
+
+class SampleLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'logs', 'test.samples')
+        self.log = SampleLog(self.path)
+        # small chunks, so that the exports span several of them
+        self.log.CHUNK_FRAMES = 4
+
+    def tearDown(self):
+        self.log.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def fill(self, count, sensors=2):
+        for i in range(count):
+            self.log.append(float(i), i % sensors, float(i))
+
+    def exported(self, **kwargs):
+        chunks = list(self.log.export(**kwargs))
+        for chunk in chunks:
+            self.assertTrue(chunk)
+            self.assertLessEqual(len(chunk), self.log.CHUNK_FRAMES)
+        return [s for chunk in chunks for s in chunk]
+
+    def test_export_all(self):
+        self.fill(10)
+        chunks = list(self.log.export())
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 4, 2])
+        self.assertEqual([t for chunk in chunks for t, _, _ in chunk], [float(i) for i in range(10)])
+
+    def test_export_time_range(self):
+        self.fill(20)
+        self.assertEqual([t for t, _, _ in self.exported(since=5., until=13.)], [float(i) for i in range(5, 14)])
+        self.assertEqual([t for t, _, _ in self.exported(since=18.5)], [19.])
+        self.assertEqual(self.exported(until=-1.), [])
+
+    def test_export_sensor(self):
+        self.fill(10)
+        self.assertEqual([t for t, _, _ in self.exported(index=1, since=2.)], [3., 5., 7., 9.])
+
+    def test_export_excludes_later_samples(self):
+        self.fill(6)
+        export = self.log.export()
+        first = next(export)
+        self.log.append(6., 0, 6.)
+        self.assertEqual(len(first) + sum(len(chunk) for chunk in export), 6)
+
+    def test_rotation(self):
+        self.log.close()
+        self.log = SampleLog(self.path, max_size=5 * frames.FRAME.size)
+        self.log.CHUNK_FRAMES = 4
+        self.fill(8)
+        self.assertTrue(os.path.exists(self.path + '.1'))
+        self.assertEqual([t for t, _, _ in self.exported()], [float(i) for i in range(8)])
+
+    def test_discards_partial_frame(self):
+        self.fill(3)
+        self.log.close()
+        with open(self.path, 'ab') as fp:
+            fp.write('\0' * 5)
+        self.log = SampleLog(self.path)
+        self.log.append(3., 0, 3.)
+        self.assertEqual([t for t, _, _ in self.exported()], [0., 1., 2., 3.])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Eric Pascual'
+
+import unittest
+
+import loopmonitor
+from loopmonitor import LoopLagMonitor, percentile
+from tracing import VirtualClock
+
+
+class FakeIOLoop(object):
+    """ IOLoop running the scheduled callback on demand, with a given lag.
+    """
+    def __init__(self, clock):
+        self.clock = clock
+        self.callback = None
+
+    def time(self):
+        return self.clock.time()
+
+    def call_at(self, when, callback):
+        self.due, self.callback = when, callback
+        return callback
+
+    def remove_timeout(self, timeout):
+        self.callback = None
+
+    def run(self, lag):
+        self.clock.advance_to(self.due + lag)
+        self.callback()
+
+
+class PercentileTestCase(unittest.TestCase):
+    def test_nearest_rank(self):
+        values = range(101)
+        self.assertEqual(percentile(values, 0), 0)
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertIsNone(percentile([], 50))
+
+
+class LoopLagMonitorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock(1000.)
+        self._time, loopmonitor.time = loopmonitor.time, self.clock
+        self.io_loop = FakeIOLoop(self.clock)
+        self.monitor = LoopLagMonitor(interval=0.1, capacity=5, io_loop=self.io_loop)
+        self.monitor.start()
+
+    def tearDown(self):
+        loopmonitor.time = self._time
+
+    def test_no_measure(self):
+        self.assertEqual(self.monitor.stats(), {'samples': 0})
+
+    def test_stats(self):
+        for lag in (0.001, 0.004, 0.002):
+            self.io_loop.run(lag)
+        stats = self.monitor.stats()
+        self.assertEqual(stats['samples'], 3)
+        self.assertAlmostEqual(stats['last_ms'], 2)
+        self.assertAlmostEqual(stats['mean_ms'], 7 / 3.)
+        self.assertAlmostEqual(stats['max_ms'], 4)
+        self.assertAlmostEqual(stats['p99_ms'], 4)
+
+    def test_stats_since(self):
+        self.io_loop.run(0.05)
+        since = self.clock.time() + 0.01
+        self.io_loop.run(0.001)
+        self.io_loop.run(0.003)
+        stats = self.monitor.stats(since)
+        self.assertEqual(stats['samples'], 2)
+        self.assertAlmostEqual(stats['max_ms'], 3)
+        self.assertEqual(self.monitor.stats(self.clock.time() + 1), {'samples': 0})
+
+    def test_capacity(self):
+        for i in range(8):
+            self.io_loop.run(i * 0.001)
+        stats = self.monitor.stats()
+        self.assertEqual(stats['samples'], 5)
+        self.assertAlmostEqual(stats['mean_ms'], 5)
+
+    def test_stop(self):
+        self.monitor.stop()
+        self.assertIsNone(self.io_loop.callback)
+
+
+if __name__ == '__main__':
+    unittest.main()
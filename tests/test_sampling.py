@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Eric Pascual'
+
+import unittest
+import math
+import random
+
+import sampling
+from sampling import CachingReader
+from tracing import VirtualClock
+
+
+class FakeADC(object):
+    """ ADC driver returning the number of conversions done, and recording the read channels.
+    """
+    def __init__(self):
+        self.conversions = 0
+        self.reads = []
+
+    def readVoltages(self, channels):
+        self.reads.append(list(channels))
+        self.conversions += 1
+        return [float(self.conversions)] * len(channels)
+
+
+class CachingReaderTestCase(unittest.TestCase):
+    def setUp(self):
+        # the freshness is measured with the real clock
+        self._time, sampling.time = sampling.time, VirtualClock(1000.)
+        self.adc = FakeADC()
+        self.reader = CachingReader(self.adc, freshness=0.2)
+
+    def tearDown(self):
+        sampling.time = self._time
+
+    def test_shares_fresh_readings(self):
+        self.assertEqual(self.reader.read_voltage(1), 1.)
+        sampling.time.sleep(0.1)
+        self.assertEqual(self.reader.read_voltage(1), 1.)
+        self.assertEqual(self.adc.conversions, 1)
+
+    def test_converts_again_once_stale(self):
+        self.reader.read_voltage(1)
+        sampling.time.sleep(0.3)
+        self.assertEqual(self.reader.read_voltage(1), 2.)
+
+    def test_fresh_read_ignores_cache(self):
+        self.reader.read_voltage(1)
+        self.assertEqual(self.reader.read_voltage(1, fresh=True), 2.)
+
+    def test_converts_missing_channels_only(self):
+        self.reader.read_voltage(1)
+        self.assertEqual(self.reader.read_voltages([2, 1, 3]), [2., 1., 2.])
+        self.assertEqual(self.adc.reads, [[1], [2, 3]])
+
+    def test_invalidate_channel(self):
+        self.reader.read_voltages([1, 2])
+        self.reader.invalidate(1)
+        self.assertEqual(self.reader.read_voltages([1, 2]), [2., 1.])
+
+    def test_invalidate_all(self):
+        self.reader.read_voltages([1, 2])
+        self.reader.invalidate()
+        self.assertEqual(self.reader.read_voltages([1, 2]), [2., 2.])
+
+
+
+class VirtualClockTestCase(unittest.TestCase):
+    """ Base of the test cases running the sampling functions with a virtual clock.
+    """
+    def setUp(self):
+        self._clock, sampling.clock = sampling.clock, VirtualClock(1000.)
+
+    def tearDown(self):
+        sampling.clock = self._clock
+
+    def signal(self, fn):
+        """ Returns a read function sampling a signal given as a function of the time.
+        """
+        start = sampling.clock.time()
+        return lambda: fn(sampling.clock.time() - start)
+
+
+class SettlingTestCase(VirtualClockTestCase):
+    def test_constant_signal_settles_at_once(self):
+        trace, settled = sampling.record_until_settled(self.signal(lambda t: 2.), window=8, interval=0.05)
+        self.assertTrue(settled)
+        self.assertEqual(len(trace), 8)
+        self.assertAlmostEqual(trace[-1][0], 7 * 0.05)
+
+    def test_step_response_settles_near_final_value(self):
+        read = self.signal(lambda t: 1. - math.exp(-t / 0.2))
+        trace, settled = sampling.record_until_settled(read, tolerance=0.01, window=8, interval=0.05)
+        self.assertTrue(settled)
+        self.assertGreater(len(trace), 8)
+        self.assertAlmostEqual(trace[-1][1], 1., delta=0.05)
+
+    def test_drifting_signal_times_out(self):
+        trace, settled = sampling.record_until_settled(self.signal(lambda t: t), interval=0.05, timeout=1)
+        self.assertFalse(settled)
+        self.assertGreaterEqual(trace[-1][0], 1)
+
+    def test_dark_signal_settles_with_absolute_tolerance(self):
+        # noise around zero, which the relative tolerance alone cannot accept
+        noise = random.Random(0)
+        read = lambda: noise.gauss(0, 0.0005)
+        _, settled = sampling.record_until_settled(read, abs_tolerance=0, timeout=1)
+        self.assertFalse(settled)
+        _, settled = sampling.record_until_settled(read, abs_tolerance=0.002, timeout=1)
+        self.assertTrue(settled)
+
+    def test_times_are_relative_to_start(self):
+        start = sampling.clock.time() - 1
+        trace, _ = sampling.record_until_settled(self.signal(lambda t: 2.), start=start)
+        self.assertAlmostEqual(trace[0][0], 1)
+
+    def test_sample_until_settled_statistics(self):
+        read = self.signal(lambda t: 2. + (0.01 if int(round(t / 0.05)) % 2 else -0.01))
+        mean, variance, elapsed, settled = sampling.sample_until_settled(read, window=8, interval=0.05)
+        self.assertTrue(settled)
+        self.assertAlmostEqual(mean, 2.)
+        self.assertAlmostEqual(variance, 0.0001)
+        self.assertAlmostEqual(elapsed, 7 * 0.05)
+
+
+
+class StepResponseTestCase(unittest.TestCase):
+    @staticmethod
+    def response(v0, vf, tau, times):
+        return [(t, vf + (v0 - vf) * math.exp(-t / tau)) for t in times]
+
+    def test_fit_rise_time_constant(self):
+        trace = self.response(0.2, 1.5, 0.3, [i * 0.05 for i in range(40)])
+        self.assertAlmostEqual(sampling.fit_time_constant(trace, 1.5), 0.3, places=6)
+
+    def test_fit_fall_time_constant(self):
+        trace = self.response(1.5, 0.2, 0.8, [i * 0.05 for i in range(80)])
+        self.assertAlmostEqual(sampling.fit_time_constant(trace, 0.2), 0.8, places=6)
+
+    def test_fit_without_step(self):
+        self.assertIsNone(sampling.fit_time_constant([(i * 0.05, 1.) for i in range(10)], 1.))
+
+    def test_fit_ignores_readings_near_final_value(self):
+        trace = self.response(0., 1., 0.3, [i * 0.05 for i in range(40)])
+        # noise on the settled part, which would bias the log-linear fit
+        trace[30:] = [(t, v + (-1) ** i * 0.001) for i, (t, v) in enumerate(trace[30:])]
+        self.assertAlmostEqual(sampling.fit_time_constant(trace, 1.), 0.3, places=3)
+
+    def test_extrapolate_final_value(self):
+        trace = self.response(0.2, 1.5, 0.3, [0.02, 0.07, 0.12, 0.17])
+        self.assertAlmostEqual(sampling.extrapolate_final(trace, 0.3), 1.5, places=6)
+
+    def test_extrapolate_settled_response(self):
+        trace = [(10., 1.2), (10., 1.2), (10., 1.2)]
+        self.assertAlmostEqual(sampling.extrapolate_final(trace, 0.3), 1.2)
+
+
+
+class DemodulateTestCase(unittest.TestCase):
+    def test_removes_ambient_drift(self):
+        # off, on, off,... readings, with an ambient light rising linearly
+        ambient = [0.1 * i for i in range(9)]
+        readings = [a + (0.5 if i % 2 else 0) for i, a in enumerate(ambient)]
+        mean, variance = sampling.demodulate(readings)
+        self.assertAlmostEqual(mean, 0.5)
+        self.assertAlmostEqual(variance, 0)
+
+    def test_variance(self):
+        mean, variance = sampling.demodulate([0, 1, 0, 3, 0])
+        self.assertAlmostEqual(mean, 2)
+        self.assertAlmostEqual(variance, 1)
+
+    def test_rejects_even_count(self):
+        self.assertRaises(ValueError, sampling.demodulate, [0, 1, 0, 1])
+
+    def test_rejects_short_input(self):
+        self.assertRaises(ValueError, sampling.demodulate, [0])
+        self.assertRaises(ValueError, sampling.demodulate, [])
+
+
+
+class RippleADC(object):
+    """ ADC driver converting a constant level with a 100 Hz ripple (i.e. 50 Hz mains), each
+    conversion taking a given time.
+    """
+    def __init__(self, clock, level=1., amplitude=0.2, conversion_time=0.):
+        self.clock = clock
+        self.level = level
+        self.amplitude = amplitude
+        self.conversion_time = conversion_time
+        self.passes = []
+
+    def readVoltages(self, channels):
+        t = self.clock.time()
+        self.passes.append(t)
+        voltage = self.level + self.amplitude * math.sin(2 * math.pi * 100 * t + 0.3)
+        self.clock.sleep(self.conversion_time * len(channels))
+        return [voltage] * len(channels)
+
+
+class FlickerFilterTestCase(VirtualClockTestCase):
+    def setUp(self):
+        super(FlickerFilterTestCase, self).setUp()
+        # the first pass is timed with the real clock, which is virtual too here
+        self._time, sampling.time = sampling.time, sampling.clock
+
+    def tearDown(self):
+        sampling.time = self._time
+        super(FlickerFilterTestCase, self).tearDown()
+
+    def test_cancels_ripple(self):
+        adc = RippleADC(sampling.clock)
+        self.assertAlmostEqual(sampling.FlickerFilter(adc, taps=4).readVoltage(1), 1., places=9)
+        self.assertEqual(len(adc.passes), 4)
+
+    def test_ripple_is_not_cancelled_without_filter(self):
+        adc = RippleADC(sampling.clock)
+        self.assertNotAlmostEqual(adc.readVoltages([1])[0], 1., places=2)
+
+    def test_spacing_adapts_to_conversion_time(self):
+        adc = RippleADC(sampling.clock, conversion_time=0.006)
+        voltages = sampling.FlickerFilter(adc, taps=4).readVoltages([1, 2])
+        for voltage in voltages:
+            self.assertAlmostEqual(voltage, 1., places=9)
+        # 12 ms passes : taps spaced by 1.25 ripple periods
+        spacings = [b - a for a, b in zip(adc.passes, adc.passes[1:])]
+        for spacing in spacings:
+            self.assertAlmostEqual(spacing, 0.0125)
+
+    def test_taps_count(self):
+        adc = RippleADC(sampling.clock)
+        self.assertAlmostEqual(sampling.FlickerFilter(adc, taps=3).readVoltage(1), 1., places=9)
+        self.assertEqual(len(adc.passes), 3)
+        self.assertEqual(sampling.FlickerFilter(adc, taps=1).taps, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+__author__ = 'Eric Pascual'
+
+import unittest
+import os
+import shutil
+import tempfile
+
+import tracing
+from tracing import Recorder, Replay, VirtualClock, TraceExhausted
+
+
+class FakeADC(object):
+    """ ADC driver returning a given sequence of readings.
+    """
+    values = []
+
+    def __init__(self, address, address2, rate):
+        self._values = iter(self.values)
+
+    def readVoltages(self, channels):
+        return [next(self._values) for _ in channels]
+
+
+class FakeGPIO(object):
+    def output(self, pin, state):
+        pass
+
+
+class TraceTestCase(unittest.TestCase):
+    START = 1000.
+
+    def setUp(self):
+        self._time, tracing.time = tracing.time, VirtualClock(self.START)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'test.trace')
+
+    def tearDown(self):
+        tracing.time = self._time
+        shutil.rmtree(self.tmp_dir)
+
+    def record(self):
+        """ Records the readings of two devices having their ADC at the same address, and a
+        GPIO write.
+        """
+        recorder = Recorder(self.path)
+        create = recorder.adc_factory(FakeADC)
+        FakeADC.values = [0.1, 0.2, 0.3]
+        adc_a = create(address=0x68, device_id='a')
+        FakeADC.values = [1.1, 1.2, 1.3]
+        adc_b = create(address=0x68, device_id='b')
+        gpio = recorder.gpio(FakeGPIO())
+
+        for _ in range(3):
+            tracing.time.sleep(1)
+            adc_a.readVoltages([1])
+            adc_b.readVoltages([1])
+        gpio.output(12, True)
+        recorder.close()
+
+    def test_read_trace(self):
+        self.record()
+        start, events = tracing.read_trace(self.path)
+        self.assertEqual(start, self.START)
+        self.assertEqual(len(events), 7)
+        self.assertEqual(events[0], (1., tracing.KIND_ADC, 'a', 0x68, (1, 0, 0, 0), 0.1))
+        self.assertEqual(events[1], (1., tracing.KIND_ADC, 'b', 0x68, (1, 0, 0, 0), 1.1))
+        self.assertEqual(events[-1], (3., tracing.KIND_GPIO, '', 0, (12, 1, 0, 0), 0.))
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'wb') as fp:
+            fp.write('\0' * 64)
+        self.assertRaises(ValueError, tracing.read_trace, self.path)
+
+    def test_replay_by_device(self):
+        self.record()
+        replay = Replay(self.path)
+        adc_a = replay.adc_factory()(address=0x68, device_id='a')
+        adc_b = replay.adc_factory()(address=0x68, device_id='b')
+
+        self.assertEqual(adc_b.readVoltages([1]), [1.1])
+        self.assertEqual(adc_a.readVoltages([1]), [0.1])
+        self.assertEqual(replay.clock.time(), self.START + 1)
+        self.assertEqual(adc_a.readVoltage(1), 0.2)
+        self.assertEqual(replay.clock.time(), self.START + 2)
+
+    def test_replay_follows_clock(self):
+        self.record()
+        replay = Replay(self.path)
+        adc = replay.adc_factory()(address=0x68, device_id='a')
+
+        # the readings recorded while the controller was waiting are skipped
+        replay.clock.sleep(2.5)
+        self.assertEqual(adc.readVoltage(1), 0.3)
+        self.assertRaises(TraceExhausted, adc.readVoltage, 1)
+
+    def test_replay_unknown_channel(self):
+        self.record()
+        replay = Replay(self.path)
+        adc = replay.adc_factory()(address=0x68, device_id='a')
+        self.assertRaises(TraceExhausted, adc.readVoltage, 2)
+
+    def test_gpio_writes_advance_clock(self):
+        self.record()
+        replay = Replay(self.path)
+        replay.gpio().output(12, 1)
+        self.assertEqual(replay.clock.time(), self.START + 3)
+
+
+class VirtualClockTestCase(unittest.TestCase):
+    def test_sleep_and_advance(self):
+        clock = VirtualClock(10.)
+        clock.sleep(1.5)
+        self.assertEqual(clock.time(), 11.5)
+        clock.sleep(-1)
+        self.assertEqual(clock.time(), 11.5)
+        clock.advance_to(11.)
+        self.assertEqual(clock.time(), 11.5)
+        clock.advance_to(20.)
+        self.assertEqual(clock.time(), 20.)
+
+
+if __name__ == '__main__':
+    unittest.main()